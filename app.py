@@ -1,17 +1,29 @@
 import streamlit as st
+import asyncio
 import uuid
+import io
+import tempfile
 import os
 import pandas as pd
 
 from database import (
     init_db,
-    query_df,
+    query_guarded,
+    QueryBudgetError,
+    ColumnarResult,
     query_students,
+    query_students_page,
+    estimate_student_count,
+    export_students_csv,
+    bulk_import,
     get_students_by_student_id,
     get_distinct_values,
+    get_majors_by_college,
+    get_async_db,
     insert_student,
     update_student_by_id,
-    delete_student_by_id,
+    update_students,
+    delete_students,
 )
 from llm_interface import LLMInterface
 from charts import smart_plot
@@ -334,9 +346,7 @@ def render_data_management():
         if current_college:
             try:
                 # 查询所选学院下的专业 (多选)
-                in_clause = "', '".join(current_college)
-                major_df = query_df(f"SELECT DISTINCT major FROM students WHERE college IN ('{in_clause}')")
-                majors = major_df["major"].tolist() if not major_df.empty else []
+                majors = get_majors_by_college(current_college)
             except Exception:
                 majors = []
         else:
@@ -404,6 +414,7 @@ def render_data_management():
                 "grade": st.session_state.filter_grade,
                 "gender": st.session_state.filter_gender,
             }
+            st.session_state.query_page_cursors = [None]
             st.rerun()
 
         # 重置按钮
@@ -419,6 +430,7 @@ def render_data_management():
             for key in keys_to_reset:
                 if key in st.session_state:
                     del st.session_state[key]
+            st.session_state.query_page_cursors = [None]
             st.rerun()
 
         # 5. 执行查询
@@ -438,7 +450,7 @@ def render_data_management():
         f_major = filters["major"] if filters["major"] != "全部" else None
         f_gender = filters["gender"] if filters["gender"] != "全部" else None
 
-        df = query_students(
+        query_filters = dict(
             name=filters["name"] or None,
             student_id=filters["student_id"] or None,
             class_name=filters["class_name"] or None,
@@ -448,14 +460,68 @@ def render_data_management():
             gender=f_gender,
         )
 
+        # 键集分页：cursors[i] 为第 i 页的起始游标（第一页为 None）
+        if "query_page_cursors" not in st.session_state:
+            st.session_state.query_page_cursors = [None]
+        cursors = st.session_state.query_page_cursors
+        page_size = st.session_state.get("query_page_size", 50)
+
+        try:
+            df, next_cursor = query_students_page(page_size=page_size, cursor=cursors[-1], **query_filters)
+        except ValueError:
+            st.session_state.query_page_cursors = cursors = [None]
+            df, next_cursor = query_students_page(page_size=page_size, **query_filters)
+        total, exact = estimate_student_count(**query_filters)
+
         st.divider()
-        st.caption(f"共 {len(df)} 条记录")
+        st.caption(f"共 {total}{'' if exact else '+'} 条记录 · 第 {len(cursors)} 页")
         if df.empty:
             st.info("暂无匹配数据")
         else:
             st.dataframe(df, use_container_width=True, hide_index=True, height=420)
+
+            c_prev, c_next, c_size = st.columns([1, 1, 2])
+            if c_prev.button("上一页", disabled=len(cursors) <= 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+            if c_next.button("下一页", disabled=next_cursor is None, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+
+            def on_page_size_change():
+                st.session_state.query_page_cursors = [None]
+
+            c_size.selectbox(
+                "每页条数", [50, 100, 200, 500],
+                key="query_page_size",
+                on_change=on_page_size_change,
+                label_visibility="collapsed",
+            )
+
+            c_page, c_all = st.columns(2)
             csv = df.to_csv(index=False).encode("utf-8")
-            st.download_button("下载当前结果 (CSV)", csv, "students_export.csv", "text/csv")
+            c_page.download_button("下载当前页 (CSV)", csv, "students_export.csv", "text/csv")
+
+            # 全量导出在点击下载时才生成：按块写入临时文件，内存中只保留一块数据，
+            # 文件交给 Streamlit 读取后随关闭自动删除
+            export_filters = dict(query_filters)
+
+            def export_all():
+                file = tempfile.TemporaryFile()
+                text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+                export_students_csv(text, **export_filters)
+                text.flush()
+                text.detach()
+                file.seek(0)
+                return file
+
+            c_all.download_button(
+                f"下载全部 {total}{'' if exact else '+'} 条结果 (CSV)",
+                export_all,
+                "students_export_all.csv",
+                "text/csv",
+                key="query_export_all",
+            )
 
     with tab_create:
         st.subheader("新增学生")
@@ -507,6 +573,40 @@ def render_data_management():
                         })
                         st.success(f"新增成功，记录 ID: {row_id}")
 
+        st.divider()
+        st.subheader("批量导入")
+        st.caption("支持 CSV / Excel / SQL 文件，表头可用字段名或中文（学号、姓名、班级、学院、专业、年级、性别、手机号）。已存在的学号会被跳过。")
+
+        uploaded = st.file_uploader("选择文件", type=["csv", "xlsx", "xls", "sql"], key="bulk_import_file")
+        if uploaded is not None and st.button("开始导入", key="bulk_import_btn"):
+            bar = st.progress(0.0, text="正在导入...")
+
+            def on_progress(done, total):
+                if total:
+                    bar.progress(min(done / total, 1.0), text=f"正在导入... {done}/{total}")
+                else:
+                    bar.progress(0.0, text=f"正在导入... 已处理 {done} 行")
+
+            try:
+                report = bulk_import(uploaded, progress=on_progress)
+            except Exception as e:
+                bar.empty()
+                st.error(f"导入失败：{e}")
+            else:
+                bar.progress(1.0, text="导入完成")
+                st.success(
+                    f"导入完成：新增 {report['inserted']} 条，"
+                    f"跳过重复 {report['duplicates']} 条，"
+                    f"无效 {report['invalid']} 条，用时 {report['elapsed']:.1f} 秒。"
+                )
+                if report["errors"]:
+                    st.dataframe(
+                        pd.DataFrame(report["errors"], columns=["行号", "错误原因"]),
+                        use_container_width=True,
+                        hide_index=True,
+                        height=200,
+                    )
+
     with tab_update:
         st.subheader("修改学生")
         st.caption("先按学号或姓名查询，再选择记录进行修改。")
@@ -603,6 +703,54 @@ def render_data_management():
                         name=search_name.strip() or None,
                     )
 
+            st.markdown("#### 批量修改")
+            st.caption("多选记录后统一修改班级 / 学院 / 专业 / 年级，留空的字段保持不变。")
+            bulk_ids = st.multiselect(
+                "选择记录（可多选）",
+                options,
+                key="update_bulk_ids",
+                format_func=lambda x: f"ID {x} - {update_df[update_df['id'] == x].iloc[0]['name']}"
+            )
+            with st.form("bulk_update_form"):
+                col1, col2, col3, col4 = st.columns(4)
+                bulk_class_name = col1.text_input("班级")
+                bulk_college = col2.text_input("学院")
+                bulk_major = col3.text_input("专业")
+                bulk_grade = col4.text_input("年级")
+                bulk_submitted = st.form_submit_button("批量保存")
+
+            if bulk_submitted:
+                bulk_updates = {
+                    field: value.strip()
+                    for field, value in (
+                        ("class_name", bulk_class_name),
+                        ("college", bulk_college),
+                        ("major", bulk_major),
+                    )
+                    if value.strip()
+                }
+                if bulk_grade.strip():
+                    try:
+                        bulk_updates["grade"] = int(bulk_grade.strip())
+                    except ValueError:
+                        st.error("年级需为数字。")
+                        bulk_updates = None
+
+                if bulk_updates is None:
+                    pass
+                elif not bulk_ids:
+                    st.warning("请先选择要修改的记录。")
+                elif not bulk_updates:
+                    st.info("未填写需要修改的字段。")
+                else:
+                    outcomes = update_students(bulk_updates, row_ids=[int(x) for x in bulk_ids])
+                    updated = sum(1 for outcome in outcomes.values() if outcome == "updated")
+                    st.success(f"批量修改完成，成功 {updated} 条，未找到 {len(outcomes) - updated} 条。")
+                    st.session_state.update_search_df = query_students(
+                        student_id=search_student_id.strip() or None,
+                        name=search_name.strip() or None,
+                    )
+
     with tab_delete:
         st.subheader("删除学生")
         st.caption("删除操作不可恢复，请谨慎确认。")
@@ -630,76 +778,86 @@ def render_data_management():
         else:
             st.dataframe(delete_df, use_container_width=True, hide_index=True, height=220)
             options = delete_df["id"].tolist()
-            selected_id = st.selectbox(
-                "选择记录",
+            selected_ids = st.multiselect(
+                "选择记录（可多选）",
                 options,
-                key="delete_select_id",
+                key="delete_select_ids",
                 format_func=lambda x: f"ID {x} - {delete_df[delete_df['id'] == x].iloc[0]['name']}"
             )
-            confirm = st.checkbox("我已确认删除该记录", key="delete_confirm")
+            confirm = st.checkbox("我已确认删除所选记录", key="delete_confirm")
             if st.button("删除", key="delete_btn"):
-                if not confirm:
+                if not selected_ids:
+                    st.warning("请先选择要删除的记录。")
+                elif not confirm:
                     st.warning("请先勾选确认删除。")
                 else:
-                    rowcount = delete_student_by_id(int(selected_id))
-                    st.success(f"删除成功，影响 {rowcount} 行。")
+                    outcomes = delete_students([int(x) for x in selected_ids])
+                    deleted = sum(1 for outcome in outcomes.values() if outcome == "deleted")
+                    st.success(f"删除成功，影响 {deleted} 行。")
                     st.session_state.delete_search_df = query_students(
                         student_id=del_student_id.strip() or None,
                         name=del_name.strip() or None,
                     )
 
+        st.divider()
+        st.markdown("#### 按年级批量删除")
+        st.caption("用于清理已毕业年级，所选年级的全部记录将在一个事务内删除。")
+        grade_values = [g for g in get_distinct_values("grade") if g is not None]
+        col_g, col_btn = st.columns([3, 1])
+        purge_grades = col_g.multiselect("年级", grade_values, key="delete_purge_grades")
+        purge_confirm = st.checkbox("我已确认删除所选年级的全部记录", key="delete_purge_confirm")
+        if col_btn.button("删除年级", key="delete_purge_btn"):
+            if not purge_grades:
+                st.warning("请先选择年级。")
+            elif not purge_confirm:
+                st.warning("请先勾选确认删除。")
+            else:
+                outcomes = delete_students(grade=list(purge_grades))
+                st.success(f"删除成功，影响 {len(outcomes)} 行。")
+                st.session_state.delete_search_df = None
+
 
 def render_dashboard():
     st.header("数据看板")
     st.caption("全局统计与分布概览。")
     st.subheader("关键指标")
 
-    def safe_query(sql):
-        try:
-            return query_df(sql)
-        except Exception:
-            return pd.DataFrame()
-
-    total_df = safe_query("SELECT COUNT(*) AS count FROM students")
-    college_df = safe_query("SELECT COUNT(DISTINCT college) AS count FROM students")
-    major_df = safe_query("SELECT COUNT(DISTINCT major) AS count FROM students")
-    class_df = safe_query("SELECT COUNT(DISTINCT class_name) AS count FROM students")
+    # 指标与分布均来自触发器维护的汇总表，代价与学生总数无关；五个查询并发执行
+    async def load_dashboard():
+        db = get_async_db()
+        return await asyncio.gather(
+            db.get_summary_counts(),
+            db.get_dimension_counts("college", as_frame=False),
+            db.get_dimension_counts("major", limit=10, as_frame=False),
+            db.get_dimension_counts("grade", order_by="value", as_frame=False),
+            db.get_dimension_counts("gender", as_frame=False),
+            return_exceptions=True,
+        )
 
-    total = int(total_df.iloc[0, 0]) if not total_df.empty else 0
-    college_count = int(college_df.iloc[0, 0]) if not college_df.empty else 0
-    major_count = int(major_df.iloc[0, 0]) if not major_df.empty else 0
-    class_count = int(class_df.iloc[0, 0]) if not class_df.empty else 0
+    summary, df_college, df_major, df_grade, df_gender = [
+        pd.DataFrame() if isinstance(r, Exception) else r for r in asyncio.run(load_dashboard())
+    ]
+    if not isinstance(summary, dict):
+        summary = {"total": 0, "college": 0, "major": 0, "class_name": 0}
 
     c1, c2, c3, c4 = st.columns(4)
-    c1.metric("学生总数", total)
-    c2.metric("学院数量", college_count)
-    c3.metric("专业数量", major_count)
-    c4.metric("班级数量", class_count)
+    c1.metric("学生总数", summary["total"])
+    c2.metric("学院数量", summary["college"])
+    c3.metric("专业数量", summary["major"])
+    c4.metric("班级数量", summary["class_name"])
 
     st.divider()
     st.subheader("分布图表")
     left, right = st.columns(2)
     with left:
-        df_college = safe_query(
-            "SELECT college, COUNT(*) AS count FROM students GROUP BY college ORDER BY count DESC"
-        )
         smart_plot(df_college, title="学院人数分布", use_container_width=True, height=320)
     with right:
-        df_major = safe_query(
-            "SELECT major, COUNT(*) AS count FROM students GROUP BY major ORDER BY count DESC LIMIT 10"
-        )
         smart_plot(df_major, title="专业人数 Top 10", use_container_width=True, height=320)
 
     left2, right2 = st.columns(2)
     with left2:
-        df_grade = safe_query(
-            "SELECT grade, COUNT(*) AS count FROM students GROUP BY grade ORDER BY grade"
-        )
         smart_plot(df_grade, title="年级人数分布", use_container_width=True, height=300)
     with right2:
-        df_gender = safe_query(
-            "SELECT gender, COUNT(*) AS count FROM students GROUP BY gender"
-        )
         smart_plot(df_gender, title="性别人数分布", use_container_width=True, height=300)
 
 # =====================
@@ -917,7 +1075,7 @@ if st.session_state.current_page == "对话":
             elif "sql" in msg:
                 # 从历史记录加载时，重新查询数据
                 try:
-                    df = query_df(msg["sql"])
+                    df = query_guarded(msg["sql"], analytics=msg.get("response_type") == "count")
                     msg["data"] = df # 缓存回内存
                 except:
                     pass
@@ -927,7 +1085,7 @@ if st.session_state.current_page == "对话":
             if df is not None and not df.empty:
                 # Case 1: 单个统计值 (e.g. 总人数) -> 使用 Metric 卡片
                 if len(df) == 1 and len(df.columns) == 1:
-                    val = df.iloc[0, 0]
+                    val = df.scalar() if isinstance(df, ColumnarResult) else df.iloc[0, 0]
                     col_name = df.columns[0]
                 
                     # 如果是数字类型（统计结果），使用 Metric
@@ -941,21 +1099,31 @@ if st.session_state.current_page == "对话":
 
                 # Case 2: 少量数据表格 -> 使用 Markdown 表格 (模仿 ChatGPT 样式)
                 elif len(df) < 10 and len(df.columns) < 5:
+                    table = df.to_pandas() if isinstance(df, ColumnarResult) else df
                     # 转换为 Markdown 表格
                     try:
-                        md_table = df.to_markdown(index=False)
+                        md_table = table.to_markdown(index=False)
                         st.markdown(md_table)
                     except:
-                        st.dataframe(df, use_container_width=True, hide_index=True)
+                        st.dataframe(table, use_container_width=True, hide_index=True)
             
                 # Case 3: 大数据表格 -> 使用交互式 DataFrame
                 else:
-                    st.dataframe(df, use_container_width=True, hide_index=True)
+                    table = df.to_pandas() if isinstance(df, ColumnarResult) else df
+                    st.dataframe(table, use_container_width=True, hide_index=True)
+
+                if df.attrs.get("truncated"):
+                    st.caption(f"结果超过 {df.attrs['max_rows']} 行，仅显示前 {df.attrs['max_rows']} 行，请缩小查询范围。")
+                elif df.attrs.get("plan", {}).get("action") == "rewrite":
+                    st.caption(df.attrs["plan"]["message"])
                 
                 should_plot = bool(msg.get("plot"))
                 if not should_plot and df is not None and len(df.columns) >= 2:
-                    num_cols = df.select_dtypes(include="number").columns
-                    if len(num_cols) == 1:
+                    if isinstance(df, ColumnarResult):
+                        num_count = sum(map(df.is_numeric, df.columns))
+                    else:
+                        num_count = len(df.select_dtypes(include="number").columns)
+                    if num_count == 1:
                         should_plot = True
                 
                 if should_plot and not (len(df) == 1 and len(df.columns) == 1):
@@ -982,7 +1150,18 @@ if st.session_state.current_page == "对话":
         for msg in current["messages"][-5:]:
             context_str += f"{msg['role']}: {msg['content']}\n"
 
-        result = llm.handle(user_input, context=context_str, pending=current.get("pending"))
+        # 先显示问题；模型流式返回的回复逐段写入助手气泡
+        with st.chat_message("user"):
+            st.markdown(user_input)
+        with st.chat_message("assistant"):
+            reply_box = st.empty()
+
+        result = llm.handle(
+            user_input,
+            context=context_str,
+            pending=current.get("pending"),
+            on_message=lambda text: reply_box.markdown(text + " ▌"),
+        )
 
         # ✅ 新增：普通聊天（不查数据库）
         if result["type"] == "chat":
@@ -1000,8 +1179,25 @@ if st.session_state.current_page == "对话":
 
         elif result["type"] == "sql":
             current["pending"] = None
-            df = query_df(result["sql"])
-            if df.empty:
+            # 模型生成的 SQL 受限执行：执行前检查查询计划，代价过高直接拒绝；超时 / 超步数中断，结果行数封顶；
+            # 统计类查询交给分析引擎（大表且安装 duckdb 时走列式快照），明细查询留在 SQLite
+            # 流式接收时 SQL 已在后台开始执行，直接取结果
+            try:
+                if result.get("prefetch") is not None:
+                    df = result["prefetch"].result()
+                else:
+                    df = query_guarded(result["sql"], analytics=result.get("response_type") == "count")
+                budget_error = None
+            except QueryBudgetError as e:
+                df = None
+                budget_error = str(e)
+
+            if budget_error:
+                current["messages"].append({
+                    "role": "assistant",
+                    "content": f"⚠️ {budget_error}"
+                })
+            elif df.empty:
                 # 尝试从 SQL 中提取查询对象，生成更友好的提示
                 import re
                 target_name = "该学生"
@@ -1021,7 +1217,7 @@ if st.session_state.current_page == "对话":
                 # 如果是查询单个学生详情，增加文字总结
                 if len(df) == 1 and "name" in df.columns and "student_id" in df.columns:
                     try:
-                        row = df.iloc[0]
+                        row = {col: df.column(col)[0] for col in df.columns}
                         # 简单的自然语言描述
                         desc = f"\n\n📄 **详细信息**：\n**{row['name']}** (学号: {row['student_id']}) 是 **{row['college']}** **{row['major']}** 专业 **{row['grade']}** 级的学生，性别 **{row['gender']}**，所在班级为 **{row['class_name']}**，手机号为 **{row['phone']}**。"
                         content += desc
@@ -1036,6 +1232,7 @@ if st.session_state.current_page == "对话":
                     "content": content,
                     "data": df,
                     "sql": result["sql"], # 保存 SQL 以便恢复
+                    "response_type": result.get("response_type"),
                     "plot": result.get("response_type") == "count" or "group by" in result["sql"].lower()
                 })
 
@@ -1,10 +1,34 @@
+import numpy as np
 import plotly.express as px
 import pandas as pd
 import streamlit as st
-from typing import Optional
+from typing import Any, Optional
+
+from database import ColumnarResult
+
+def _plot_columnar_counts(res: ColumnarResult, title: str, max_categories: int):
+    """类别 + 数值两列的列式结果：按字典编码直接聚合，不构造 DataFrame"""
+    cat_col, num_col = (res.columns if res.is_categorical(res.columns[0]) else res.columns[::-1])
+    codes = res.codes(cat_col)
+    valid = codes >= 0
+    sums = np.bincount(codes[valid], weights=res.data[num_col][valid], minlength=len(res.categories[cat_col]))
+    order = np.argsort(-sums, kind="stable")[:max_categories]
+    names = res.categories[cat_col][order]
+    values = sums[order]
+    if np.all(np.mod(values, 1) == 0):
+        values = values.astype(np.int64)
+    labels = {"x": cat_col, "y": num_col, "names": cat_col, "values": num_col, "color": cat_col}
+
+    if len(order) <= 8:
+        fig = px.pie(names=names, values=values, title=f"{title}（占比分析）", hole=0.4, labels=labels)
+        fig.update_traces(textposition='inside', textinfo='percent+label')
+    else:
+        fig = px.bar(x=names, y=values, title=f"{title}（统计图）", text=values, color=names, labels=labels)
+    return fig
+
 
 def smart_plot(
-    df: pd.DataFrame,
+    df: Any,
     title: str = "统计分析结果",
     max_categories: int = 20,
     key: Optional[str] = None,
@@ -29,6 +53,14 @@ def smart_plot(
     if len(df) == 1 and len(df.columns) == 1:
         return None
 
+    # 列式结果（database.query_columnar）：常见的「类别 + 人数」直接在数组上聚合，其余情况转换为 DataFrame
+    if isinstance(df, ColumnarResult):
+        if (len(df.columns) == 2 and sum(map(df.is_categorical, df.columns)) == 1
+                and sum(map(df.is_numeric, df.columns)) == 1):
+            fig = _plot_columnar_counts(df, title, max_categories)
+            return _show_figure(fig, key, width, height, use_container_width)
+        df = df.to_pandas()
+
     columns = df.columns.tolist()
     fig = None
 
@@ -107,6 +139,10 @@ def smart_plot(
             st.info("📊 数据维度较多，建议直接查看表格。")
             return None
 
+    return _show_figure(fig, key, width, height, use_container_width)
+
+
+def _show_figure(fig, key, width, height, use_container_width):
     if fig:
         # 优化图表布局
         layout_kwargs = dict(
@@ -1,20 +1,1043 @@
+import asyncio
+import atexit
+import base64
+import functools
+import hashlib
+import itertools
+import os
+import queue
+import re
 import sqlite3
+import textwrap
+import threading
+import time
+import numpy as np
 import pandas as pd
 import random
 from faker import Faker
-from typing import Optional, Dict, Any
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Sequence, Tuple, Iterable, Iterator, Union, IO, Callable
+
+try:
+    import duckdb  # 可选：统计类查询的列式分析引擎
+except ImportError:
+    duckdb = None
 
 DB_PATH = "students.db"
 
+# ===== 测试数据字典 =====
+COLLEGES_MAJORS = {
+    "计算机学院": ["软件工程", "计算机科学与技术", "网络工程", "信息安全"],
+    "自动化学院": ["自动化", "测控技术与仪器", "机器人工程"],
+    "信息工程学院": ["通信工程", "电子信息工程", "光电信息科学与工程"],
+    "机械工程学院": ["机械设计制造及其自动化", "车辆工程", "工业设计"]
+}
+# 简单的学院代码映射
+COLLEGE_CODES = {
+    "计算机学院": "01", "自动化学院": "02",
+    "信息工程学院": "03", "机械工程学院": "04"
+}
+GRADES = [2021, 2022, 2023, 2024]
+
+STUDENT_FIELDS = [
+    "student_id",
+    "name",
+    "class_name",
+    "college",
+    "major",
+    "grade",
+    "gender",
+    "phone",
+]
+
+# ===== 连接池配置 =====
+POOL_MAX_SIZE = 8             # 同时存在的连接上限
+POOL_ACQUIRE_TIMEOUT = 10.0   # 连接耗尽时的最长等待秒数
+STATEMENT_CACHE_SIZE = 256    # 每个连接缓存的预编译语句数
+
+# ===== 存储模式配置 =====
+JOURNAL_MODE = "WAL"          # WAL 下读写互不阻塞；设为 "DELETE" 可恢复默认回滚日志
+BUSY_TIMEOUT = 5.0            # 等待写锁的秒数（sqlite busy_timeout）
+BUSY_RETRIES = 3              # 超时后仍为 SQLITE_BUSY 时的重试次数
+CHECKPOINT_INTERVAL = 500     # 每累计多少次写操作主动 checkpoint 一次
+JOURNAL_MODES = {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"}
+NORMALIZED_STORAGE = False    # True 时 init_db 把学院 / 专业 / 班级迁移为字典表 + 整数外键（见 migrate_to_normalized）
+
+
+class _PooledConnection(sqlite3.Connection):
+    """close() 不真正关闭连接，而是归还给所属连接池"""
+
+    _pool = None
+    _owner = None  # 借出连接的线程
+    _depth = 0     # 同一线程内的重入借用次数
+
+    def close(self):
+        if self._pool is None:
+            super().close()
+        else:
+            self._pool.release(self)
+
+
+class ConnectionPool:
+    """
+    SQLite 连接池：
+    1. 同一线程内重复借用返回同一连接（可重入）
+    2. 连接总数有上限，耗尽时等待其他线程归还
+    3. 连接复用 sqlite3 的预编译语句缓存
+    """
+
+    def __init__(self, db_path: str, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_ACQUIRE_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []  # LIFO：最近归还的连接最先复用
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            factory=_PooledConnection,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,  # 连接由连接池保证同一时刻只属于一个线程
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn._pool = self
+        # WAL 模式下 NORMAL 同步即可保证一致性，且避免每次提交都 fsync
+        if conn.execute("PRAGMA journal_mode").fetchone()[0].upper() == "WAL":
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None and conn._depth > 0:
+            conn._depth += 1
+            return conn
+
+        deadline = time.monotonic() + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("数据库连接池已关闭")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"数据库连接池已耗尽（上限 {self.max_size}）")
+                self._cond.wait(remaining)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        conn._owner = threading.get_ident()
+        conn._depth = 1
+        local.conn = conn
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        if conn._depth <= 0:
+            return
+        if conn._owner != threading.get_ident():
+            # 跨线程归还（如生成器在其他线程被回收），直接关闭以免连接状态错乱
+            conn._depth = 0
+            self._discard(conn)
+            return
+
+        conn._depth -= 1
+        if conn._depth > 0:
+            return
+        self._local.conn = None
+
+        try:
+            # 与直接 close() 的语义一致：未提交的事务回滚
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                sqlite3.Connection.close(conn)
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            sqlite3.Connection.close(conn)
+        finally:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+    def close_all(self):
+        """关闭空闲连接；仍被借出的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        # DB_PATH 被修改（如测试切换数据库）时重建连接池
+        if _pool is None or _pool.db_path != DB_PATH:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def close_pool():
+    """关闭连接池（进程退出时自动调用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+atexit.register(close_pool)
+
 
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    """从连接池借用连接，用完调用 close() 归还"""
+    return get_pool().acquire()
+
+
+# ===== 内存只读副本（可选）=====
+# 读多写少的部署中，可用 backup API 把数据库整体复制到共享缓存的内存库，查询从内存副本读取。
+# 写操作后副本失效，下一次读取时重新复制并原子切换；进行中的读取继续使用旧副本直到归还
+READ_REPLICA = False
+_replica: Optional[Dict[str, Any]] = None  # {"key": (DB_PATH, 代数), "pool": ..., "keeper": ...}
+_replica_generation = 0
+_replica_serial = itertools.count()
+_replica_lock = threading.Lock()
+_replica_build_lock = threading.Lock()
+
+
+class _ReplicaPool(ConnectionPool):
+    """内存副本的连接池：共享缓存的内存库，连接为只读（query_only）"""
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            factory=_PooledConnection,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn._pool = self
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+
+def invalidate_replica():
+    global _replica_generation
+    with _replica_lock:
+        _replica_generation += 1
+
+
+def _current_replica_pool() -> ConnectionPool:
+    """返回与当前数据一致的副本连接池，过期时重新复制"""
+    global _replica
+    get_data_version()
+    with _replica_lock:
+        key = (DB_PATH, _replica_generation)
+        if _replica is not None and _replica["key"] == key:
+            return _replica["pool"]
+
+    with _replica_build_lock:
+        with _replica_lock:
+            # 等锁期间其他线程可能已完成复制
+            key = (DB_PATH, _replica_generation)
+            if _replica is not None and _replica["key"] == key:
+                return _replica["pool"]
+
+        uri = f"file:students_replica_{next(_replica_serial)}?mode=memory&cache=shared"
+        # keeper 连接维持内存库存活，直到副本被替换
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        src = get_connection()
+        try:
+            src.backup(keeper)
+        finally:
+            src.close()
+
+        replica = {"key": key, "pool": _ReplicaPool(uri), "keeper": keeper}
+        with _replica_lock:
+            old, _replica = _replica, replica
+    if old is not None:
+        _close_replica(old)
+    # 复制期间若又有写入，key 已过期，下一次读取会再次复制
+    return replica["pool"]
+
+
+def _close_replica(replica: Dict[str, Any]):
+    replica["pool"].close_all()
+    replica["keeper"].close()
+
+
+def close_replica():
+    """释放内存副本（进程退出时自动调用）"""
+    global _replica
+    with _replica_lock:
+        old, _replica = _replica, None
+    if old is not None:
+        _close_replica(old)
+
+
+atexit.register(close_replica)
+
+
+def get_read_connection():
+    """借用只读查询的连接：启用 READ_REPLICA 时来自内存副本，否则与 get_connection 相同"""
+    if READ_REPLICA:
+        return _current_replica_pool().acquire()
+    return get_connection()
+
+
+# ===== 数据版本 =====
+# 专用的监视连接从不写入，其 PRAGMA data_version 会在任何其他连接（包括其他进程）提交后变化。
+# 各进程内缓存据此判断是否过期，多个 Streamlit 进程共用同一数据库时也能及时失效
+_data_version = 0
+_data_version_raw: Optional[int] = None
+_version_conn: Optional[sqlite3.Connection] = None
+_version_path: Optional[str] = None
+_version_lock = threading.Lock()
+
+
+def get_data_version() -> int:
+    """
+    返回本进程观察到的数据版本号：单调递增，数据库内容被任意连接 / 进程修改后增大。
+    缓存层记录构建时的版本号，之后比较即可判断是否过期；检测到变化时同时使进程内缓存失效。
+    """
+    global _data_version, _data_version_raw, _version_conn, _version_path
+    with _version_lock:
+        if _version_conn is None or _version_path != DB_PATH:
+            if _version_conn is not None:
+                _version_conn.close()
+            _version_conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            _version_path = DB_PATH
+            _data_version_raw = None
+        raw = _version_conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = raw != _data_version_raw
+        if changed:
+            _data_version += 1
+            _data_version_raw = raw
+        version = _data_version
+    if changed:
+        _invalidate_caches()
+    return version
+
+
+def close_data_version_watcher():
+    global _version_conn
+    with _version_lock:
+        if _version_conn is not None:
+            _version_conn.close()
+            _version_conn = None
+
+
+atexit.register(close_data_version_watcher)
+
+
+# ===== 并发写入：SQLITE_BUSY 重试与 checkpoint =====
+_write_count = 0
+_write_lock = threading.Lock()
+
+
+def _is_busy_error(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return "database is locked" in msg or "database is busy" in msg
+
+
+def _retry_on_busy(func):
+    """busy_timeout 用尽后仍遇到写锁时，退避重试整个写操作"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if not _is_busy_error(exc) or attempt == BUSY_RETRIES:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+    return wrapper
+
+
+def checkpoint(mode: str = "PASSIVE"):
+    """手动执行 WAL checkpoint，返回 (busy, wal 页数, 已写回页数)"""
+    mode = mode.upper()
+    if mode not in {"PASSIVE", "FULL", "RESTART", "TRUNCATE"}:
+        raise ValueError(f"不支持的 checkpoint 模式：{mode}")
+    conn = get_connection()
+    try:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+    finally:
+        conn.close()
+
+
+def _invalidate_caches():
+    """使进程内的各级缓存（取值目录、分析快照、内存副本）失效"""
+    invalidate_catalog()
+    invalidate_analytics()
+    invalidate_replica()
+
+
+def _after_write(rowcount: int = 1):
+    """写操作提交后调用：使缓存失效，并累计写次数定期 checkpoint 防止 WAL 文件无限增长"""
+    if rowcount <= 0:
+        return
+    _invalidate_caches()
+    _count_write()
+
+
+def _count_write():
+    global _write_count
+    with _write_lock:
+        _write_count += 1
+        due = _write_count >= CHECKPOINT_INTERVAL
+        if due:
+            _write_count = 0
+    if due:
+        try:
+            checkpoint("PASSIVE")
+        except sqlite3.Error as e:
+            print(f"Checkpoint error: {e}")
+
+
+# ===== 索引管理 =====
+# 高频过滤 / 分组列上的二级索引（名称 -> 列）
+STUDENT_INDEXES = {
+    "idx_students_student_id": "student_id",
+    "idx_students_name": "name",
+    "idx_students_class_name": "class_name",
+    "idx_students_college_major_grade": "college, major, grade",
+    "idx_students_major_grade": "major, grade",
+    "idx_students_grade": "grade",
+}
+
+SQL_LOG_SIZE = 2000  # 最近执行过的 SQL，供索引顾问分析
+_sql_log = deque(maxlen=SQL_LOG_SIZE)
+
+
+def _log_sql(sql: str, params: Optional[Sequence[Any]] = None):
+    _sql_log.append((sql, tuple(params) if params else ()))
+
+
+def get_sql_log() -> List[tuple]:
+    """返回最近执行过的 (sql, params) 列表"""
+    return list(_sql_log)
+
+
+def clear_sql_log():
+    _sql_log.clear()
+
+
+def ensure_indexes(conn: Optional[sqlite3.Connection] = None):
+    """创建 STUDENT_INDEXES 中缺失的索引，并刷新查询规划器的统计信息"""
+    own = conn is None
+    if own:
+        conn = get_connection()
+    try:
+        for index_name, columns in STUDENT_INDEXES.items():
+            columns = ", ".join(_storage_column(c) for c in columns.split(", "))
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {_student_table()} ({columns})")
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+    finally:
+        if own:
+            conn.close()
+
+
+def _explain_plan(conn: sqlite3.Connection, sql: str, params: Sequence[Any] = ()) -> List[str]:
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def _is_full_scan(detail: str) -> bool:
+    # 3.36+ 为 "SCAN students"，旧版本为 "SCAN TABLE students"
+    # "SCAN ... USING (COVERING) INDEX" 走的是索引，虚拟表（FTS）扫描由其自身索引完成
+    return detail.startswith("SCAN") and "USING" not in detail and "VIRTUAL TABLE" not in detail
+
+
+_FIELD_ALTERNATION = "|".join(STUDENT_FIELDS)
+
+
+def _index_candidate_columns(sql: str) -> List[str]:
+    """从 WHERE 中的等值 / IN / 前缀 LIKE 条件和 GROUP BY 中提取可建索引的列"""
+    text = " ".join(sql.lower().split())
+    columns = []
+
+    m = re.search(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\blimit\b|$)", text)
+    if m:
+        pattern = rf"\b({_FIELD_ALTERNATION})\s*(?:=|\bin\b|\blike\s+'[^%_])"
+        for field in re.findall(pattern, m.group(1)):
+            if field not in columns:
+                columns.append(field)
+
+    m = re.search(r"\bgroup\s+by\b(.*?)(?=\border\s+by\b|\blimit\b|\bhaving\b|$)", text)
+    if m:
+        for token in re.findall(r"[a-z_]+", m.group(1)):
+            if token in STUDENT_FIELDS and token not in columns:
+                columns.append(token)
+
+    return columns[:3]
+
+
+def advise_indexes(statements: Optional[Sequence[Any]] = None, apply: bool = False) -> List[Dict[str, Any]]:
+    """
+    索引顾问：对 SQL 日志（或传入的语句）逐条执行 EXPLAIN QUERY PLAN，
+    为发生全表扫描的语句建议索引；apply=True 时直接创建并复核执行计划。
+    statements 中的元素可以是 sql 字符串或 (sql, params)。
+    """
+    if statements is None:
+        statements = get_sql_log()
+    entries = []
+    for item in statements:
+        sql, params = (item, ()) if isinstance(item, str) else (item[0], tuple(item[1] or ()))
+        if (sql, params) not in entries:
+            entries.append((sql, params))
+
+    suggestions: Dict[str, Dict[str, Any]] = {}
+    conn = get_connection()
+    try:
+        existing = {
+            tuple(r[2] for r in conn.execute(f"PRAGMA index_info({name})"))
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=?", (_student_table(),)
+            ).fetchall()
+        }
+
+        for sql, params in entries:
+            try:
+                plan = _explain_plan(conn, sql, params)
+            except sqlite3.Error:
+                continue
+            if not any(_is_full_scan(d) for d in plan):
+                continue
+            columns = [_storage_column(c) for c in _index_candidate_columns(sql)]
+            if not columns or tuple(columns) in existing:
+                continue
+            index_name = "idx_students_auto_" + "_".join(columns)
+            suggestion = suggestions.setdefault(index_name, {
+                "index": index_name,
+                "columns": columns,
+                "ddl": f"CREATE INDEX IF NOT EXISTS {index_name} ON {_student_table()} ({', '.join(columns)})",
+                "statements": [],
+                "plan": plan,
+                "applied": False,
+            })
+            suggestion["statements"].append(sql)
+
+        if apply and suggestions:
+            for suggestion in suggestions.values():
+                conn.execute(suggestion["ddl"])
+            conn.commit()
+            conn.execute("PRAGMA optimize")
+            for suggestion in suggestions.values():
+                sql = suggestion["statements"][0]
+                params = next(p for s, p in entries if s == sql)
+                new_plan = _explain_plan(conn, sql, params)
+                suggestion["applied"] = not any(_is_full_scan(d) for d in new_plan)
+                suggestion["plan"] = new_plan
+    finally:
+        conn.close()
+
+    return list(suggestions.values())
+
+
+def _ensure_trigger(conn: sqlite3.Connection, name: str, sql: str):
+    """
+    触发器不存在或定义变化时才（重新）创建。
+    避免每次初始化都改动 schema，导致所有连接的预编译语句缓存失效。
+    """
+    sql = textwrap.dedent(sql).strip()
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (name,)
+    ).fetchone()
+    if row and row[0] == sql:
+        return
+    if row:
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute(sql)
+
+
+# ===== 子串搜索索引（FTS5 trigram）=====
+SEARCH_FIELDS = ["name", "student_id", "class_name"]
+FTS_MIN_CHARS = 3  # trigram 至少需要 3 个字符才能走索引，更短的关键字回退为普通 LIKE
+_search_index_ready = False
+
+
+def ensure_search_index(conn: Optional[sqlite3.Connection] = None) -> bool:
+    """
+    创建 students_fts 影子索引（外部内容表，只存 trigram 倒排），
+    并用触发器与 students 保持同步。SQLite 不支持 FTS5 trigram 时返回 False。
+    """
+    global _search_index_ready
+    own = conn is None
+    if own:
+        conn = get_connection()
+    cols = ", ".join(SEARCH_FIELDS)
+    new_cols = ", ".join(_column_ref("new", c) for c in SEARCH_FIELDS)
+    old_cols = ", ".join(_column_ref("old", c) for c in SEARCH_FIELDS)
+    table = _student_table()
+    watched = ", ".join(_storage_column(c) for c in SEARCH_FIELDS)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='students_fts'"
+        ).fetchone()
+        try:
+            conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+                {cols}, content='students', content_rowid='id', tokenize='trigram'
+            )
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 trigram unavailable, falling back to LIKE: {e}")
+            _search_index_ready = False
+            return False
+
+        # 批量导入期间（bulk_load_state 非空，仅导入事务内可见）改为按批集中建索引
+        conn.execute("CREATE TABLE IF NOT EXISTS bulk_load_state (active INTEGER)")
+        _ensure_trigger(conn, "students_fts_ai", f"""
+        CREATE TRIGGER students_fts_ai AFTER INSERT ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load_state) BEGIN
+            INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END""")
+        _ensure_trigger(conn, "students_fts_ad", f"""
+        CREATE TRIGGER students_fts_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END""")
+        _ensure_trigger(conn, "students_fts_au", f"""
+        CREATE TRIGGER students_fts_au AFTER UPDATE OF {watched} ON {table} BEGIN
+            INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END""")
+        if not exists:
+            # 首次创建：为已有数据建立索引
+            conn.execute("INSERT INTO students_fts(students_fts) VALUES ('rebuild')")
+        conn.commit()
+        _search_index_ready = True
+        return True
+    finally:
+        if own:
+            conn.close()
+
+
+def rebuild_search_index():
+    """从 students 全量重建子串索引"""
+    conn = get_connection()
+    try:
+        conn.execute("INSERT INTO students_fts(students_fts) VALUES ('rebuild')")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ===== 看板汇总表（触发器维护）=====
+# student_stats 按维度记录每个取值的人数，看板读取它而不是扫描 students
+STATS_DIMS = ["college", "major", "class_name", "grade", "gender"]
+_stats_ready = False
+
+
+def _stats_delta_sql(dim: str, ref: str, delta: int, cond: str = "") -> List[str]:
+    """生成触发器中为某一维度 +1 / -1 的语句（value 用 IS 比较以兼容 NULL）"""
+    value = _column_ref(ref, dim)
+    where = f"dim = '{dim}' AND value IS {value}"
+    extra = f" AND {cond}" if cond else ""
+    if delta > 0:
+        return [
+            f"INSERT INTO student_stats (dim, value, count) SELECT '{dim}', {value}, 0 "
+            f"WHERE NOT EXISTS (SELECT 1 FROM student_stats WHERE {where}){extra};",
+            f"UPDATE student_stats SET count = count + 1 WHERE {where}{extra};",
+        ]
+    return [
+        f"UPDATE student_stats SET count = count - 1 WHERE {where}{extra};",
+        f"DELETE FROM student_stats WHERE {where} AND count <= 0{extra};",
+    ]
+
+
+def _trigger_body(statements: List[str]) -> str:
+    return "\n".join("    " + stmt for stmt in statements)
+
+
+def ensure_student_stats(conn: Optional[sqlite3.Connection] = None):
+    """创建汇总表及其 INSERT / UPDATE / DELETE 触发器，首次创建时全量构建"""
+    global _stats_ready
+    own = conn is None
+    if own:
+        conn = get_connection()
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='student_stats'"
+        ).fetchone()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS student_stats (
+            dim TEXT NOT NULL,
+            value,                  -- 不声明类型，保留年级等取值的原始类型
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_student_stats_dim_value ON student_stats (dim, value)")
+        conn.execute("CREATE TABLE IF NOT EXISTS bulk_load_state (active INTEGER)")
+
+        inserts, deletes, updates = [], [], []
+        table = _student_table()
+        for d in STATS_DIMS:
+            key = _storage_column(d)
+            changed = f"old.{key} IS NOT new.{key}"
+            inserts += _stats_delta_sql(d, "new", 1)
+            deletes += _stats_delta_sql(d, "old", -1)
+            updates += _stats_delta_sql(d, "old", -1, changed) + _stats_delta_sql(d, "new", 1, changed)
+
+        _ensure_trigger(conn, "student_stats_ai", (
+            f"CREATE TRIGGER student_stats_ai AFTER INSERT ON {table}\n"
+            "WHEN NOT EXISTS (SELECT 1 FROM bulk_load_state) BEGIN\n"
+            f"{_trigger_body(inserts)}\nEND"
+        ))
+        _ensure_trigger(conn, "student_stats_ad", (
+            f"CREATE TRIGGER student_stats_ad AFTER DELETE ON {table} BEGIN\n"
+            f"{_trigger_body(deletes)}\nEND"
+        ))
+        _ensure_trigger(conn, "student_stats_au", (
+            f"CREATE TRIGGER student_stats_au AFTER UPDATE OF {', '.join(map(_storage_column, STATS_DIMS))} ON {table} BEGIN\n"
+            f"{_trigger_body(updates)}\nEND"
+        ))
+        conn.commit()
+        if not exists:
+            rebuild_student_stats(conn)
+        _stats_ready = True
+    finally:
+        if own:
+            conn.close()
+
+
+def rebuild_student_stats(conn: Optional[sqlite3.Connection] = None):
+    """从 students 全量重建汇总表（数据被绕过触发器修改后使用）"""
+    own = conn is None
+    if own:
+        conn = get_connection()
+    try:
+        conn.execute("DELETE FROM student_stats")
+        conn.execute(
+            "INSERT INTO student_stats (dim, value, count) "
+            + " UNION ALL ".join(
+                f"SELECT '{d}', {d}, COUNT(*) FROM students GROUP BY {d}" for d in STATS_DIMS
+            )
+        )
+        conn.commit()
+    finally:
+        if own:
+            conn.close()
+
+
+def _apply_stats_batch(conn: sqlite3.Connection, after_id: int):
+    """批量写入后按批合并汇总表：对新增行分组计数后一次性累加（在调用方事务内执行）"""
+    cols = ", ".join(STATS_DIMS)
+    rows = conn.execute(
+        f"SELECT {cols}, COUNT(*) FROM students WHERE id > ? GROUP BY {cols}", (after_id,)
+    ).fetchall()
+    deltas: Dict[Tuple[str, Any], int] = {}
+    for row in rows:
+        for dim, value in zip(STATS_DIMS, row):
+            deltas[(dim, value)] = deltas.get((dim, value), 0) + row[-1]
+    conn.executemany(
+        "INSERT INTO student_stats (dim, value, count) SELECT ?, ?, 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM student_stats WHERE dim = ? AND value IS ?)",
+        [(dim, value, dim, value) for dim, value in deltas],
+    )
+    conn.executemany(
+        "UPDATE student_stats SET count = count + ? WHERE dim = ? AND value IS ?",
+        [(n, dim, value) for (dim, value), n in deltas.items()],
+    )
+
+
+def get_dimension_counts(
+    dim: str,
+    order_by: str = "count",
+    limit: Optional[int] = None,
+    as_frame: bool = True,
+) -> Any:
+    """
+    从汇总表读取某一维度的人数分布，列为 [dim, count]。
+    order_by="count" 按人数降序，order_by="value" 按取值升序；as_frame=False 时返回 ColumnarResult。
+    """
+    if dim not in STATS_DIMS:
+        raise ValueError(f"不支持的统计维度：{dim}")
+    order = "count DESC" if order_by == "count" else "value"
+    sql = f"SELECT value AS {dim}, count FROM student_stats WHERE dim = ? ORDER BY {order}"
+    params: List[Any] = [dim]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    if not as_frame:
+        return query_columnar(sql, params)
+    conn = get_read_connection()
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def get_summary_counts() -> Dict[str, int]:
+    """返回学生总数及学院 / 专业 / 班级数量（不含空值），均来自汇总表"""
+    conn = get_read_connection()
+    try:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM student_stats WHERE dim = 'gender'"
+        ).fetchone()[0]
+        distinct = dict(conn.execute(
+            "SELECT dim, COUNT(*) FROM student_stats "
+            "WHERE dim IN ('college', 'major', 'class_name') AND value IS NOT NULL GROUP BY dim"
+        ).fetchall())
+    finally:
+        conn.close()
+    return {
+        "total": total,
+        "college": distinct.get("college", 0),
+        "major": distinct.get("major", 0),
+        "class_name": distinct.get("class_name", 0),
+    }
+
+
+# ===== 字典编码存储（可选）=====
+# 学院 / 专业 / 班级名称存入字典表，基表 student_records 只存整数外键；
+# students 变为同名视图，INSTEAD OF 触发器把对视图的写入转到基表，已有 SQL（含大模型生成的）无需修改。
+# 本模块内的写操作直接写基表（视图写入的 rowcount / lastrowid 恒为 0）
+DIMENSION_TABLES = {  # students 列 -> (字典表, 基表外键列)
+    "college": ("colleges", "college_id"),
+    "major": ("majors", "major_id"),
+    "class_name": ("classes", "class_id"),
+}
+STUDENT_RECORDS = "student_records"
+_normalized = False
+
+
+def _is_normalized(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'students'").fetchone()
+    return bool(row) and row[0] == "view"
+
+
+def _student_table() -> str:
+    """写操作与索引所在的基表"""
+    return STUDENT_RECORDS if _normalized else "students"
+
+
+def _storage_column(column: str) -> str:
+    """students 的列在基表中的列名"""
+    if _normalized and column in DIMENSION_TABLES:
+        return DIMENSION_TABLES[column][1]
+    return column
+
+
+def _column_ref(ref: str, column: str) -> str:
+    """触发器中 new / old 行某列取值的表达式，字典编码列回查字典表"""
+    if _normalized and column in DIMENSION_TABLES:
+        table, key = DIMENSION_TABLES[column]
+        return f"(SELECT name FROM {table} WHERE id = {ref}.{key})"
+    return f"{ref}.{column}"
+
+
+def _encode_rows(
+    conn: sqlite3.Connection,
+    columns: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+) -> Tuple[List[str], List[Sequence[Any]]]:
+    """
+    把按 students 列给出的记录换成基表的 (列, 取值)：名称换成字典表 id，缺失的名称先插入字典表。
+    须在调用方的写事务内执行；未启用字典编码时原样返回。
+    """
+    if not _normalized:
+        return list(columns), list(rows)
+    ids: Dict[str, Dict[Any, int]] = {column: {} for column in DIMENSION_TABLES}
+
+    def encode(column: str, value: Any) -> Any:
+        if column not in DIMENSION_TABLES or value is None:
+            return value
+        if value not in ids[column]:
+            table = DIMENSION_TABLES[column][0]
+            conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (value,))
+            ids[column][value] = conn.execute(
+                f"SELECT id FROM {table} WHERE name = ?", (value,)
+            ).fetchone()[0]
+        return ids[column][value]
+
+    encoded = [[encode(c, v) for c, v in zip(columns, row)] for row in rows]
+    return [_storage_column(c) for c in columns], encoded
+
+
+def _decode_rows(conn: sqlite3.Connection, columns: Sequence[str], rows: List[tuple]) -> List[tuple]:
+    """把基表查询结果中的字典表 id 换回名称（字典表很小，一次读入）"""
+    names = {
+        column: dict(conn.execute(f"SELECT id, name FROM {DIMENSION_TABLES[column][0]}"))
+        for column in columns if column in DIMENSION_TABLES
+    }
+    return [
+        tuple(names[c].get(v) if c in names else v for c, v in zip(columns, row))
+        for row in rows
+    ]
+
+
+def _ensure_students_view(conn: sqlite3.Connection):
+    """创建 students 兼容视图（列顺序与原表一致）及其 INSTEAD OF 触发器"""
+    base = STUDENT_RECORDS
+    select = [f"{base}.id AS id"] + [
+        f"{DIMENSION_TABLES[f][0]}.name AS {f}" if f in DIMENSION_TABLES else f"{base}.{f} AS {f}"
+        for f in STUDENT_FIELDS
+    ]
+    joins = [
+        f"LEFT JOIN {table} ON {table}.id = {base}.{key}" for table, key in DIMENSION_TABLES.values()
+    ]
+    conn.execute(
+        "CREATE VIEW IF NOT EXISTS students AS\nSELECT " + ", ".join(select)
+        + f"\nFROM {base}\n" + "\n".join(joins)
+    )
+
+    fill_dims = [
+        f"INSERT OR IGNORE INTO {table} (name) SELECT new.{column} WHERE new.{column} IS NOT NULL;"
+        for column, (table, _) in DIMENSION_TABLES.items()
+    ]
+    columns = ["id"] + [_storage_column(f) for f in STUDENT_FIELDS]
+    values = ["new.id"] + [
+        f"(SELECT id FROM {DIMENSION_TABLES[f][0]} WHERE name = new.{f})" if f in DIMENSION_TABLES else f"new.{f}"
+        for f in STUDENT_FIELDS
+    ]
+    _ensure_trigger(conn, "students_view_ii", (
+        "CREATE TRIGGER students_view_ii INSTEAD OF INSERT ON students BEGIN\n"
+        + _trigger_body(fill_dims + [
+            f"INSERT INTO {base} ({', '.join(columns)}) VALUES ({', '.join(values)});"
+        ]) + "\nEND"
+    ))
+    _ensure_trigger(conn, "students_view_iu", (
+        "CREATE TRIGGER students_view_iu INSTEAD OF UPDATE ON students BEGIN\n"
+        + _trigger_body(fill_dims + [
+            f"UPDATE {base} SET " + ", ".join(f"{c} = {v}" for c, v in zip(columns, values))
+            + " WHERE id = old.id;"
+        ]) + "\nEND"
+    ))
+    _ensure_trigger(conn, "students_view_id", (
+        "CREATE TRIGGER students_view_id INSTEAD OF DELETE ON students BEGIN\n"
+        + _trigger_body([f"DELETE FROM {base} WHERE id = old.id;"]) + "\nEND"
+    ))
+
+
+def migrate_to_normalized() -> bool:
+    """
+    把 students 表迁移为字典编码存储，id 保持不变，子串索引与汇总表无需重建。
+    迁移期间应停止其他进程的写入；完成后 VACUUM 回收空间。已迁移时返回 False。
+    """
+    global _normalized
+    conn = get_connection()
+    try:
+        if _is_normalized(conn):
+            _normalized = True
+            return False
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, _ in DIMENSION_TABLES.values():
+                conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+            conn.execute(f"""
+            CREATE TABLE {STUDENT_RECORDS} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT,
+                name TEXT,
+                class_id INTEGER REFERENCES classes (id),
+                college_id INTEGER REFERENCES colleges (id),
+                major_id INTEGER REFERENCES majors (id),
+                grade INTEGER,
+                gender TEXT,
+                phone TEXT
+            )
+            """)
+            for column, (table, _) in DIMENSION_TABLES.items():
+                conn.execute(
+                    f"INSERT INTO {table} (name) SELECT DISTINCT {column} FROM students "
+                    f"WHERE {column} IS NOT NULL ORDER BY {column}"
+                )
+            conn.execute(
+                f"INSERT INTO {STUDENT_RECORDS} (id, "
+                + ", ".join(DIMENSION_TABLES[f][1] if f in DIMENSION_TABLES else f for f in STUDENT_FIELDS)
+                + ") SELECT s.id, "
+                + ", ".join(f"{DIMENSION_TABLES[f][0]}.id" if f in DIMENSION_TABLES else f"s.{f}" for f in STUDENT_FIELDS)
+                + " FROM students s "
+                + " ".join(f"LEFT JOIN {table} ON {table}.name = s.{column}" for column, (table, _) in DIMENSION_TABLES.items())
+            )
+            # 沿用原表的自增序号，已删除记录的 id 不会被复用
+            names = ("students", STUDENT_RECORDS)
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name IN (?, ?)", names
+            ).fetchone()[0]
+            conn.execute("DROP TABLE students")  # 同时删除其索引与触发器
+            conn.execute("DELETE FROM sqlite_sequence WHERE name IN (?, ?)", names)
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (STUDENT_RECORDS, seq))
+            _normalized = True
+            _ensure_students_view(conn)
+            # 以下各自提交：第一次提交即包含上面的整个迁移
+            ensure_search_index(conn)
+            ensure_student_stats(conn)
+            ensure_indexes(conn)
+        except Exception:
+            conn.rollback()
+            _normalized = _is_normalized(conn)
+            raise
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    _invalidate_caches()
+    return True
+
+
+_initialized: Optional[Tuple[str, str]] = None
+
 
+def init_db(journal_mode: Optional[str] = None, sample_data: bool = True):
+    """
+    初始化数据库；journal_mode 默认取 JOURNAL_MODE（WAL）。
+    sample_data 为 False 时只建表和索引，空库不填充 300 条示例数据（供压测数据生成使用）。
+    Streamlit 每次重跑脚本都会调用，同一进程内对同一数据库只初始化一次。
+    """
+    global _initialized, _normalized
+    mode = (journal_mode or JOURNAL_MODE).upper()
+    if mode not in JOURNAL_MODES:
+        raise ValueError(f"不支持的 journal_mode：{mode}")
+    if _initialized == (DB_PATH, mode):
+        return
 
-def init_db():
     conn = get_connection()
     cursor = conn.cursor()
 
+    # ===== 存储模式（持久化在数据库文件中）=====
+    cursor.execute(f"PRAGMA journal_mode={mode}")
+    if mode == "WAL":
+        cursor.execute("PRAGMA synchronous=NORMAL")
+
     # ===== 创建表（字段完整符合任务书）=====
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS students (
@@ -29,29 +1052,568 @@ def init_db():
         phone TEXT
     )
     """)
+    conn.commit()
+
+    # ===== 字典编码存储 =====
+    _normalized = _is_normalized(conn)
+    if NORMALIZED_STORAGE and not _normalized:
+        migrate_to_normalized()
+
+    # ===== 索引与汇总表 =====
+    ensure_search_index(conn)
+    ensure_student_stats(conn)
+    ensure_indexes(conn)
 
     # ===== 初始化数据 =====
     cursor.execute("SELECT COUNT(*) FROM students")
     count = cursor.fetchone()[0]
 
-    if count == 0:
+    if count == 0 and sample_data:
         print("Initializing database with Faker data...")
         generate_random_data(300)
 
     conn.commit()
     conn.close()
+    _initialized = (DB_PATH, mode)
+
+
+# ===== SQL 参数化 =====
+# 把规则 / 大模型生成的 SQL 中内联的字面量提取为绑定参数，
+# 使同一模板的语句文本一致（可复用预编译语句），并得到可用作缓存键的指纹
+_SQL_TOKEN = re.compile(
+    r"""
+      (?P<space>\s+|--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<ident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    | (?P<blob>[xX]'[0-9a-fA-F]*')
+    | (?P<hex>0[xX][0-9a-fA-F]+)
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[^\W\d]\w*)
+    | (?P<param>\?\d*|[:@$][^\W\d]\w*)
+    | (?P<op>.)
+    """,
+    re.S | re.X,
+)
+_PARAMETERIZABLE_STATEMENTS = {"select", "with", "insert", "update", "delete", "replace"}
+_CLAUSE_KEYWORDS = {
+    "select", "from", "join", "on", "where", "group", "having", "order",
+    "limit", "offset", "set", "values", "returning", "union", "except", "intersect",
+}
+# 只有这些子句中的字面量才是"值"；SELECT 列表中的字面量会影响结果列名，
+# ORDER BY / GROUP BY 中的整数是列序号，都保持原样
+_VALUE_CLAUSES = {"on", "where", "having", "limit", "offset", "set", "values"}
+
+
+def _literal_value(kind: str, text: str) -> Any:
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if kind == "hex":
+        return int(text, 16)
+    if any(c in text for c in ".eE"):
+        return float(text)
+    return int(text)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _parameterize(sql: str) -> Tuple[str, Tuple[Any, ...], str]:
+    """
+    返回 (参数化后的 SQL, 参数槽位, 指纹)。
+    槽位为 ("literal", 值) 或 ("arg", 原有 ? 占位符的序号)，由 normalize_sql 结合调用方参数展开。
+    """
+    tokens = [(m.lastgroup, m.group()) for m in _SQL_TOKEN.finditer(sql)]
+    words = [text.lower() for kind, text in tokens if kind == "word"]
+    named = any(kind == "param" and text != "?" for kind, text in tokens)
+    parameterize = bool(words) and words[0] in _PARAMETERIZABLE_STATEMENTS and not named
+
+    out: List[str] = []
+    canonical: List[str] = []
+    slots: List[Tuple[str, Any]] = []
+    clause: List[Optional[str]] = [None]
+    arg_index = 0
+    for kind, text in tokens:
+        if kind == "space":
+            if out and out[-1] != " ":
+                out.append(" ")
+            continue
+        if kind == "word" and text.lower() in _CLAUSE_KEYWORDS:
+            clause[-1] = text.lower()
+        elif text == "(":
+            clause.append(clause[-1])
+        elif text == ")" and len(clause) > 1:
+            clause.pop()
+
+        if parameterize and kind in ("string", "hex", "number") and clause[-1] in _VALUE_CLAUSES:
+            slots.append(("literal", _literal_value(kind, text)))
+            out.append("?")
+            canonical.append("?")
+            continue
+        if parameterize and kind == "param":
+            slots.append(("arg", arg_index))
+            arg_index += 1
+            out.append("?")
+            canonical.append("?")
+            continue
+        out.append(text)
+        canonical.append(text if kind in ("string", "ident", "blob") else text.lower())
+
+    while canonical and canonical[-1] == ";":
+        canonical.pop()
+    # IN 列表长度不同的语句视为同一模板
+    fingerprint_text = re.sub(r"\( \?(?: , \?)* \)", "(?+)", " ".join(canonical))
+    fingerprint = hashlib.sha1(fingerprint_text.encode("utf-8")).hexdigest()[:16]
+    bound_sql = "".join(out).strip()
+    if not parameterize:
+        return bound_sql, (), fingerprint
+    return bound_sql, tuple(slots), fingerprint
+
+
+def _sql_words(sql: str) -> List[str]:
+    """语句中的关键字 / 标识符（小写，不含字符串与注释内的内容）"""
+    return [m.group().lower() for m in _SQL_TOKEN.finditer(sql) if m.lastgroup == "word"]
 
 
-def query_df(sql: str) -> pd.DataFrame:
+def normalize_sql(sql: str, params: Optional[Sequence[Any]] = None) -> Tuple[str, Any]:
+    """
+    把 SQL 中 WHERE / SET / VALUES / LIMIT 等子句内的字面量提取为 ? 参数，
+    返回 (规范化 SQL, 参数列表)。已有的 ? 占位符按顺序与 params 合并；
+    含命名参数或非 DML 语句时只规范空白，不做参数化。
+    """
+    bound_sql, slots, _ = _parameterize(sql)
+    if not slots:
+        return bound_sql, params if params is not None else []
+    params = list(params or [])
+    return bound_sql, [params[value] if kind == "arg" else value for kind, value in slots]
+
+
+def sql_fingerprint(sql: str) -> str:
+    """语句模板指纹：字面量不同、大小写 / 空白不同、IN 列表长度不同的同一语句指纹相同"""
+    return _parameterize(sql)[2]
+
+
+def query_df(sql: str, params: Optional[Sequence[Any]] = None) -> pd.DataFrame:
     """只用于 SELECT / COUNT"""
-    conn = get_connection()
+    sql, params = normalize_sql(sql, params)
+    _log_sql(sql, params)
+    conn = get_read_connection()
     try:
-        return pd.read_sql_query(sql, conn)
+        return pd.read_sql_query(sql, conn, params=params)
     finally:
         conn.close()
 
 
-def query_students(
+# ===== 受限执行 =====
+# 大模型生成的 SQL 不可控：用 SQLite 进度回调限制单条语句的执行时间和虚拟机步数，并限制返回行数
+QUERY_TIME_BUDGET = 5.0             # 单条语句最长执行秒数
+QUERY_STEP_BUDGET = 50_000_000      # 单条语句最多虚拟机指令数（全表扫描百万行约 4-7M）
+QUERY_MAX_ROWS = 5000               # 返回行数上限，超出部分截断
+PROGRESS_HANDLER_INTERVAL = 1000    # 每执行多少条虚拟机指令检查一次预算
+
+
+class QueryBudgetError(RuntimeError):
+    """查询超出时间或步数预算，已被中断"""
+
+
+@contextmanager
+def _execution_budget(conn: sqlite3.Connection, time_budget: Optional[float], step_budget: Optional[int]):
+    """在连接上安装进度回调，超出预算时中断当前语句并抛出 QueryBudgetError"""
+    if time_budget is None and step_budget is None:
+        yield
+        return
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    state = {"steps": 0, "reason": None}
+
+    def handler():
+        state["steps"] += PROGRESS_HANDLER_INTERVAL
+        if step_budget is not None and state["steps"] > step_budget:
+            state["reason"] = f"执行步数超过 {step_budget:,}"
+        elif deadline is not None and time.monotonic() > deadline:
+            state["reason"] = f"执行时间超过 {time_budget:g} 秒"
+        return state["reason"] is not None
+
+    conn.set_progress_handler(handler, PROGRESS_HANDLER_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if state["reason"] is not None:
+            raise QueryBudgetError(f"查询已中止：{state['reason']}，请缩小查询范围") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def query_guarded(
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    analytics: bool = False,
+    max_rows: int = QUERY_MAX_ROWS,
+    time_budget: float = QUERY_TIME_BUDGET,
+    step_budget: int = QUERY_STEP_BUDGET,
+) -> "ColumnarResult":
+    """
+    受限执行不可信（大模型 / 规则生成）的查询，返回 ColumnarResult。
+    执行前经 check_query_plan 检查，代价过高抛出 QueryPlanError，必要时追加 LIMIT；
+    超出时间或步数预算时抛出 QueryBudgetError；结果超过 max_rows 时截断，
+    attrs 中记录 truncated、max_rows 与 plan。analytics=True 时按统计查询交给 query_analytics。
+    """
+    report = check_query_plan(sql, params)
+    if report["action"] == "reject":
+        raise QueryPlanError(report["message"])
+    run = query_analytics if analytics else query_columnar
+    result = run(report["sql"], report["params"], max_rows=max_rows, time_budget=time_budget, step_budget=step_budget)
+    result.attrs["plan"] = {key: report[key] for key in ("action", "cost", "issues", "message")}
+    return result
+
+
+# ===== 执行计划检查 =====
+# 执行前用 EXPLAIN QUERY PLAN 估算代价：按学生总数和各维度取值数（student_stats）估计每个循环访问的行数，
+# 嵌套循环相乘。代价过高直接拒绝；可能返回大量行的明细查询自动追加 LIMIT；其余问题仅记录告警
+PLAN_MAX_COST = 10_000_000      # 估算访问行数上限，超过则拒绝执行
+PLAN_AUTO_LIMIT = QUERY_MAX_ROWS  # 明细查询预计返回行数超过该值且未写 LIMIT 时自动追加
+PLAN_LOG_SIZE = 500
+_plan_log = deque(maxlen=PLAN_LOG_SIZE)
+_PLAN_SMALL_TABLES = {"student_stats", "bulk_load_state", *(t for t, _ in DIMENSION_TABLES.values())}
+_AGGREGATE_WORDS = {"count", "sum", "avg", "min", "max", "total", "group_concat", "group", "distinct"}
+
+
+class QueryPlanError(QueryBudgetError):
+    """执行计划估算代价过高，查询在执行前被拒绝"""
+
+
+def _plan_row_stats(conn: sqlite3.Connection) -> Tuple[int, Dict[str, int]]:
+    """返回 (学生总数, {列: 取值个数})；未出现在汇总表中的列视为近似唯一"""
+    rows = conn.execute("SELECT dim, COUNT(*), SUM(count) FROM student_stats GROUP BY dim").fetchall()
+    distinct = {_storage_column(dim): n for dim, n, _ in rows}
+    total = next((int(s or 0) for dim, _, s in rows if dim == "gender"), 0)
+    return max(total, 1), distinct
+
+
+_PLAN_TABLE = re.compile(r"^(?:SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)")  # 旧版本 SQLite 输出 "SCAN TABLE students"
+_PLAN_CONSTRAINT = re.compile(r"(\w+)\s*([=<>]+)")
+
+
+def _plan_small_table(detail: str) -> bool:
+    m = _PLAN_TABLE.match(detail)
+    return m is not None and m.group(1) in _PLAN_SMALL_TABLES
+
+
+def _plan_loop_rows(detail: str, total: int, distinct: Dict[str, int]) -> Tuple[float, float]:
+    """估算一个 SCAN / SEARCH 循环每次执行访问的行数，返回 (行数, 一次性开销)"""
+    if "VIRTUAL TABLE" in detail:
+        return max(1.0, total / 100), 0.0  # 子串索引命中的行按总数的 1% 估算
+    if _plan_small_table(detail):
+        return (100.0 if detail.startswith("SCAN") else 1.0), 0.0
+    if detail.startswith("SCAN"):
+        return float(total), 0.0
+    m = re.search(r"\((.*)\)", detail)
+    constraints = m.group(1).split(" AND ") if m else []
+    rows = float(total)
+    ranged = False
+    for cond in constraints:
+        m = _PLAN_CONSTRAINT.match(cond)
+        if m is None:
+            continue  # 跳跃扫描的 ANY(col)、表达式索引等约束不参与估算
+        col, op = m.groups()
+        if col == "rowid" and op == "=":
+            rows = 1.0
+        elif op == "=":
+            rows /= distinct.get(col, total)
+        else:
+            ranged = True
+    if ranged:
+        rows /= 3
+    build = float(total) if "AUTOMATIC" in detail else 0.0
+    return max(rows, 1.0), build
+
+
+def _plan_cost(nodes: List[Tuple[int, int, str]], parent: int, total: int, distinct: Dict[str, int], issues: List[str]):
+    """递归估算某一层计划节点的 (代价, 输出行数)"""
+    cost, rows = 0.0, 1.0
+    loops = 0
+    for node_id, node_parent, detail in nodes:
+        if node_parent != parent:
+            continue
+        if detail.startswith(("SCAN", "SEARCH")):
+            loop_rows, build = _plan_loop_rows(detail, total, distinct)
+            small = _plan_small_table(detail)  # 汇总表、字典表扫描代价可忽略
+            if _is_full_scan(detail) and not small:
+                issues.append(f"全表扫描：{detail}")
+            if loops > 0 and detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail and not small:
+                issues.append(f"笛卡尔积 / 无索引连接：{detail}")
+            if build:
+                issues.append(f"临时自动索引（可考虑建索引）：{detail}")
+            cost += build + rows * loop_rows
+            rows *= loop_rows
+            loops += 1
+        elif detail.startswith("USE TEMP B-TREE"):
+            issues.append(detail)
+            cost += rows
+        else:
+            # 子查询 / 复合查询 / 物化视图等：相关子查询随外层每行执行一次
+            sub_cost, _ = _plan_cost(nodes, node_id, total, distinct, issues)
+            cost += sub_cost * (rows if detail.startswith("CORRELATED") else 1)
+    return cost, rows
+
+
+def check_query_plan(sql: str, params: Optional[Sequence[Any]] = None) -> Dict[str, Any]:
+    """
+    执行前检查查询计划，返回
+    {"sql", "params", "plan", "cost", "rows", "issues", "action", "message"}，
+    action 为 "ok" / "warn" / "rewrite"（sql 已追加 LIMIT）/ "reject"。结果同时写入计划日志。
+    """
+    sql, params = normalize_sql(sql, params)
+    conn = get_read_connection()
+    try:
+        nodes = [(row[0], row[1], row[-1]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        total, distinct = _plan_row_stats(conn)
+    finally:
+        conn.close()
+
+    issues: List[str] = []
+    cost, rows = _plan_cost(nodes, 0, total, distinct, issues)
+    words = _sql_words(sql)
+    report = {
+        "sql": sql,
+        "params": params,
+        "plan": [detail for _, _, detail in nodes],
+        "cost": int(cost),
+        "rows": int(rows),
+        "issues": issues,
+        "action": "warn" if issues else "ok",
+        "message": "",
+    }
+    if cost > PLAN_MAX_COST:
+        report["action"] = "reject"
+        report["message"] = f"查询已拒绝：预计需访问约 {int(cost):,} 行（上限 {PLAN_MAX_COST:,}），请增加筛选条件"
+    elif (words and words[0] == "select" and rows > PLAN_AUTO_LIMIT
+          and "limit" not in words and not _AGGREGATE_WORDS & set(words)):
+        report["action"] = "rewrite"
+        report["sql"] = f"{sql.rstrip().rstrip(';')} LIMIT {PLAN_AUTO_LIMIT}"
+        report["message"] = f"预计返回约 {int(rows):,} 行，已自动限制为前 {PLAN_AUTO_LIMIT} 行"
+    _plan_log.append({
+        "fingerprint": sql_fingerprint(sql),
+        **{key: report[key] for key in ("sql", "params", "plan", "cost", "issues", "action")},
+    })
+    return report
+
+
+def get_plan_log() -> List[Dict[str, Any]]:
+    """
+    返回最近检查过的执行计划，可用于索引调优，例如：
+    advise_indexes([(e["sql"], e["params"]) for e in get_plan_log() if e["issues"]])
+    """
+    return list(_plan_log)
+
+
+def clear_plan_log():
+    _plan_log.clear()
+
+
+# ===== 列式结果 =====
+# 小结果集（COUNT / GROUP BY 统计）直接从游标取成 NumPy 数组，省去 DataFrame 构造开销
+COLUMNAR_CATEGORICAL = {"college", "major", "class_name", "gender"}
+
+
+class ColumnarResult:
+    """
+    轻量列式结果：数值列为 int64 / float64 数组（NULL 记为 NaN），
+    学院、专业、班级、性别等类别列做字典编码（codes 为 int32，-1 表示 NULL），其余为 object 数组。
+    """
+
+    def __init__(self, columns: List[str], data: Dict[str, np.ndarray], categories: Dict[str, np.ndarray]):
+        self.columns = columns
+        self.data = data
+        self.categories = categories
+        self.attrs: Dict[str, Any] = {}  # 与 DataFrame.attrs 对应，如截断信息
+
+    def __len__(self) -> int:
+        return len(self.data[self.columns[0]]) if self.columns else 0
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self), len(self.columns)
+
+    def is_categorical(self, name: str) -> bool:
+        return name in self.categories
+
+    def is_numeric(self, name: str) -> bool:
+        return name not in self.categories and self.data[name].dtype.kind in "iuf"
+
+    def codes(self, name: str) -> np.ndarray:
+        return self.data[name]
+
+    def column(self, name: str) -> np.ndarray:
+        """返回解码后的列（类别列还原为取值数组，NULL 为 None）"""
+        values = self.data[name]
+        if name not in self.categories:
+            return values
+        decoded = np.append(self.categories[name], None)  # codes == -1 落到末尾的 None
+        return decoded[values]
+
+    def scalar(self) -> Any:
+        """单值聚合结果（如 COUNT(*)）的取值"""
+        if self.empty:
+            return None
+        value = self.column(self.columns[0])[0]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def to_pandas(self) -> pd.DataFrame:
+        frame = {}
+        for name in self.columns:
+            if name in self.categories:
+                frame[name] = pd.Categorical.from_codes(self.data[name], categories=self.categories[name])
+            else:
+                frame[name] = self.data[name]
+        df = pd.DataFrame(frame, columns=self.columns)
+        df.attrs.update(self.attrs)
+        return df
+
+
+def _columnar_array(name: str, values: Sequence[Any], categorical: bool) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """把一列 Python 值转换为 (数组, 字典) ；非类别列的字典为 None"""
+    kinds = {type(v) for v in values}
+    if categorical and kinds <= {str, type(None)}:
+        mapping: Dict[str, int] = {}
+        codes = np.fromiter(
+            (-1 if v is None else mapping.setdefault(v, len(mapping)) for v in values),
+            dtype=np.int32,
+            count=len(values),
+        )
+        return codes, np.array(list(mapping), dtype=object)
+    if kinds and kinds <= {int, bool}:
+        return np.array(values, dtype=np.int64), None
+    if kinds and kinds <= {int, float, bool, type(None)}:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64), None
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array, None
+
+
+def query_columnar(
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    categorical: Optional[Sequence[str]] = None,
+    max_rows: Optional[int] = None,
+    time_budget: Optional[float] = None,
+    step_budget: Optional[int] = None,
+) -> ColumnarResult:
+    """
+    执行查询并以 ColumnarResult 返回，适合统计类小结果集。
+    categorical 指定需要字典编码的列，默认为 COLUMNAR_CATEGORICAL 中出现的列。
+    max_rows 限制返回行数（attrs["truncated"] 标记是否截断）；time_budget / step_budget 见 query_guarded。
+    """
+    sql, params = normalize_sql(sql, params)
+    _log_sql(sql, params)
+    conn = get_read_connection()
+    try:
+        with _execution_budget(conn, time_budget, step_budget):
+            cursor = conn.execute(sql, params)
+            try:
+                columns = [d[0] for d in cursor.description]
+                rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows + 1)
+            finally:
+                # 提前结束读取时及时重置语句，避免归还的连接仍持有读快照
+                cursor.close()
+    finally:
+        conn.close()
+
+    return _capped_columnar(columns, rows, max_rows, categorical)
+
+
+def _capped_columnar(
+    columns: List[str],
+    rows: List[tuple],
+    max_rows: Optional[int],
+    categorical: Optional[Sequence[str]] = None,
+) -> ColumnarResult:
+    truncated = max_rows is not None and len(rows) > max_rows
+    result = _to_columnar(columns, rows[:max_rows] if truncated else rows, categorical)
+    result.attrs.update(truncated=truncated, max_rows=max_rows)
+    return result
+
+
+def _to_columnar(columns: List[str], rows: List[tuple], categorical: Optional[Sequence[str]] = None) -> ColumnarResult:
+    encode = set(COLUMNAR_CATEGORICAL if categorical is None else categorical)
+    data: Dict[str, np.ndarray] = {}
+    categories: Dict[str, np.ndarray] = {}
+    for name, values in zip(columns, zip(*rows) if rows else [()] * len(columns)):
+        array, mapping = _columnar_array(name, values, name in encode)
+        data[name] = array
+        if mapping is not None:
+            categories[name] = mapping
+    return ColumnarResult(columns, data, categories)
+
+
+# ===== 流式读取 =====
+STREAM_CHUNK_SIZE = 5000
+
+
+def _stream_rows(sql: str, params: Optional[Sequence[Any]], chunk_size: int) -> Iterator[Any]:
+    """先产出列名列表，再在同一个游标上逐块产出行；结束（或生成器被关闭）时归还连接"""
+    sql, params = normalize_sql(sql, params)
+    _log_sql(sql, params)
+    conn = get_read_connection()
+    try:
+        cursor = conn.execute(sql, params)
+        yield [d[0] for d in cursor.description or ()]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def iter_query(
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    as_frame: bool = True
+) -> Iterator[Union[pd.DataFrame, List[tuple]]]:
+    """
+    在同一个游标上按块读取结果，内存占用与结果总量无关。
+    as_frame=True 时每块为 DataFrame，否则为元组列表。
+    迭代结束（或生成器被关闭）时归还连接。
+    """
+    stream = _stream_rows(sql, params, chunk_size)
+    try:
+        columns = next(stream)
+        for rows in stream:
+            yield pd.DataFrame.from_records(rows, columns=columns) if as_frame else rows
+    finally:
+        stream.close()
+
+
+def export_students_csv(
+    output: Union[str, IO[str]],
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    **filters: Any
+) -> int:
+    """按过滤条件把学生数据分块写出为 CSV（路径或文本缓冲区），返回写出行数；没有数据时也写出表头"""
+    conditions, params = _build_student_filters(**filters)
+    sql = "SELECT * FROM students"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id DESC"
+
+    total = 0
+    stream = _stream_rows(sql, params, chunk_size)
+    try:
+        columns = next(stream)
+        pd.DataFrame(columns=columns).to_csv(output, index=False)
+        for rows in stream:
+            pd.DataFrame.from_records(rows, columns=columns).to_csv(output, index=False, header=False, mode="a")
+            total += len(rows)
+    finally:
+        stream.close()
+    return total
+
+
+def _build_student_filters(
     name: Optional[str] = None,
     student_id: Optional[str] = None,
     class_name: Optional[str] = None,
@@ -59,19 +1621,28 @@ def query_students(
     major: Any = None,   # str or List[str]
     grade: Any = None,   # int or List[int]
     gender: Any = None   # str or List[str]
-) -> pd.DataFrame:
+):
+    """把过滤条件转换为 (WHERE 条件列表, 参数列表)，供查询 / 分页 / 计数共用"""
     conditions = []
     params = []
 
-    if name:
-        conditions.append("name LIKE ?")
-        params.append(f"%{name}%")
-    if student_id:
-        conditions.append("student_id LIKE ?")
-        params.append(f"%{student_id}%")
-    if class_name:
-        conditions.append("class_name LIKE ?")
-        params.append(f"%{class_name}%")
+    # 子串过滤：关键字够长时走 trigram 索引，否则回退为 LIKE 扫描
+    fts_conditions = []
+    fts_params = []
+    for field, value in (("name", name), ("student_id", student_id), ("class_name", class_name)):
+        if not value:
+            continue
+        if _search_index_ready and len(value) >= FTS_MIN_CHARS:
+            fts_conditions.append(f"{field} LIKE ?")
+            fts_params.append(f"%{value}%")
+        else:
+            conditions.append(f"{field} LIKE ?")
+            params.append(f"%{value}%")
+    if fts_conditions:
+        conditions.append(
+            "id IN (SELECT rowid FROM students_fts WHERE " + " AND ".join(fts_conditions) + ")"
+        )
+        params.extend(fts_params)
     
     # 支持多选 (List/Tuple) 或单选
     if college:
@@ -110,20 +1681,116 @@ def query_students(
             conditions.append("gender = ?")
             params.append(gender)
 
+    return conditions, params
+
+
+def query_students(
+    name: Optional[str] = None,
+    student_id: Optional[str] = None,
+    class_name: Optional[str] = None,
+    college: Any = None, # str or List[str]
+    major: Any = None,   # str or List[str]
+    grade: Any = None,   # int or List[int]
+    gender: Any = None   # str or List[str]
+) -> pd.DataFrame:
+    conditions, params = _build_student_filters(
+        name, student_id, class_name, college, major, grade, gender
+    )
+
     sql = "SELECT * FROM students"
     if conditions:
         sql += " WHERE " + " AND ".join(conditions)
     sql += " ORDER BY id DESC"
 
-    conn = get_connection()
+    _log_sql(sql, params)
+    conn = get_read_connection()
     try:
         return pd.read_sql_query(sql, conn, params=params)
     finally:
         conn.close()
 
 
+# ===== 键集分页 =====
+def _encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        prefix, value = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        if prefix != "id":
+            raise ValueError(prefix)
+        return int(value)
+    except Exception:
+        raise ValueError(f"无效的分页游标：{cursor}")
+
+
+def query_students_page(
+    page_size: int = 50,
+    cursor: Optional[str] = None,
+    **filters: Any
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    按 id 倒序的键集分页（WHERE id < 游标，不使用 OFFSET），翻页代价与页码无关。
+    返回 (本页数据, 下一页游标)，下一页游标为 None 表示已到末页。
+    """
+    if page_size <= 0:
+        raise ValueError("page_size 必须为正整数")
+
+    conditions, params = _build_student_filters(**filters)
+    last_id = _decode_cursor(cursor)
+    if last_id is not None:
+        conditions.append("id < ?")
+        params.append(last_id)
+
+    sql = "SELECT * FROM students"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # 多取一行用于判断是否还有下一页
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(page_size + 1)
+
+    _log_sql(sql, params)
+    conn = get_read_connection()
+    try:
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        next_cursor = _encode_cursor(int(df["id"].iloc[-1]))
+    return df, next_cursor
+
+
+def estimate_student_count(cap: int = 10000, **filters: Any) -> Tuple[int, bool]:
+    """
+    估算满足条件的记录数，返回 (数量, 是否精确)。
+    无过滤条件时直接 COUNT(*)；有过滤条件时最多数到 cap 条，超过则返回 (cap, False)。
+    """
+    conditions, params = _build_student_filters(**filters)
+    conn = get_read_connection()
+    try:
+        if not conditions:
+            return conn.execute("SELECT COUNT(*) FROM students").fetchone()[0], True
+        sql = (
+            "SELECT COUNT(*) FROM (SELECT 1 FROM students WHERE "
+            + " AND ".join(conditions)
+            + " LIMIT ?)"
+        )
+        count = conn.execute(sql, params + [cap + 1]).fetchone()[0]
+    finally:
+        conn.close()
+    if count > cap:
+        return cap, False
+    return count, True
+
+
 def get_students_by_student_id(student_id: str) -> pd.DataFrame:
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         return pd.read_sql_query(
             "SELECT * FROM students WHERE student_id = ?",
@@ -134,92 +1801,616 @@ def get_students_by_student_id(student_id: str) -> pd.DataFrame:
         conn.close()
 
 
+def _insert_student_on(conn: sqlite3.Connection, student: Dict[str, Any]) -> int:
+    values = [student.get(field) for field in STUDENT_FIELDS]
+    columns, (values,) = _encode_rows(conn, STUDENT_FIELDS, [values])
+    cursor = conn.execute(
+        f"INSERT INTO {_student_table()} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+        values,
+    )
+    return cursor.lastrowid
+
+
+def _update_student_on(conn: sqlite3.Connection, row_id: int, updates: Dict[str, Any]) -> int:
+    fields = [field for field in updates.keys() if field in STUDENT_FIELDS]
+    if not fields:
+        return 0
+    columns, (params,) = _encode_rows(conn, fields, [[updates[field] for field in fields]])
+    set_clause = ", ".join([f"{column} = ?" for column in columns])
+    cursor = conn.execute(
+        f"UPDATE {_student_table()} SET {set_clause} WHERE id = ?",
+        [*params, row_id]
+    )
+    return cursor.rowcount
+
+
+def _delete_student_on(conn: sqlite3.Connection, row_id: int) -> int:
+    cursor = conn.execute(f"DELETE FROM {_student_table()} WHERE id = ?", (row_id,))
+    return cursor.rowcount
+
+
 def insert_student(student: Dict[str, Any]) -> int:
-    fields = [
-        "student_id",
-        "name",
-        "class_name",
-        "college",
-        "major",
-        "grade",
-        "gender",
-        "phone",
-    ]
-    values = [student.get(field) for field in fields]
+    return _write(_insert_student_on, student)
+
+
+def update_student_by_id(row_id: int, updates: Dict[str, Any]) -> int:
+    return _write(_update_student_on, row_id, updates)
+
+
+def delete_student_by_id(row_id: int) -> int:
+    return _write(_delete_student_on, row_id)
 
+
+# ===== 写入队列（组提交）=====
+# 单条新增 / 修改 / 删除交给唯一的写线程：排队中的请求合并进同一个事务，一次提交（一次 fsync）。
+# 每个请求在独立的 SAVEPOINT 中执行，失败只回滚它自己；Future 在事务提交后才完成，
+# 调用方拿到结果时写入已可见，同一调用方的请求按提交顺序执行
+GROUP_COMMIT = True            # False 时每次写操作各自立即提交
+WRITE_QUEUE_SIZE = 1000        # 排队请求上限，队列满时提交方等待
+GROUP_COMMIT_MAX_BATCH = 500   # 单个事务最多合并的请求数
+WRITE_RESULT_TIMEOUT = 60.0    # 提交方等待写线程结果的最长秒数，超时抛出 TimeoutError
+
+
+@_retry_on_busy
+def _write_now(func: Callable[..., Any], *args) -> Tuple[Any, int]:
+    """在当前线程的连接上执行一次写操作并立即提交，返回 (结果, 变更行数)"""
     conn = get_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO students
-            (student_id, name, class_name, college, major, grade, gender, phone)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            values,
-        )
+        before = conn.total_changes
+        result = func(conn, *args)
         conn.commit()
-        return cursor.lastrowid
+        return result, conn.total_changes - before
     finally:
         conn.close()
 
 
-def update_student_by_id(row_id: int, updates: Dict[str, Any]) -> int:
-    allowed_fields = {
-        "student_id",
-        "name",
-        "class_name",
-        "college",
-        "major",
-        "grade",
-        "gender",
-        "phone",
-    }
-    fields = [field for field in updates.keys() if field in allowed_fields]
-    if not fields:
-        return 0
+def _write(func: Callable[..., Any], *args) -> Any:
+    """执行 func(conn, *args) 形式的写操作：GROUP_COMMIT 时经写入队列合并提交"""
+    if GROUP_COMMIT and not WriteQueue.is_writer_thread():
+        return get_write_queue().submit(func, *args).result(timeout=WRITE_RESULT_TIMEOUT)
+    result, changed = _write_now(func, *args)
+    _after_write(changed)
+    return result
 
-    set_clause = ", ".join([f"{field} = ?" for field in fields])
-    params = [updates[field] for field in fields]
-    params.append(row_id)
 
+@_retry_on_busy
+def _commit_batch(batch: List[tuple]) -> Tuple[List[Tuple[bool, Any]], int]:
+    """在一个 IMMEDIATE 事务内依次执行一批请求，返回 ([(是否成功, 结果或异常)], 变更行数)"""
     conn = get_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE students SET {set_clause} WHERE id = ?",
-            params
-        )
-        conn.commit()
-        return cursor.rowcount
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            outcomes = []
+            for func, args, _ in batch:
+                conn.execute("SAVEPOINT write_request")
+                try:
+                    outcomes.append((True, func(conn, *args)))
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO write_request")
+                    outcomes.append((False, exc))
+                conn.execute("RELEASE write_request")
+            conn.commit()
+            return outcomes, conn.total_changes - before
+        except Exception:
+            conn.rollback()
+            raise
     finally:
         conn.close()
 
 
-def delete_student_by_id(row_id: int) -> int:
+class WriteQueue:
+    """有界写入队列 + 唯一写线程，submit 返回 concurrent.futures.Future"""
+
+    _writer_idents: set = set()
+
+    def __init__(self, max_size: int = WRITE_QUEUE_SIZE, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def is_writer_thread(cls) -> bool:
+        # 写线程内部再调用写接口时直接执行，避免等待自己
+        return threading.get_ident() in cls._writer_idents
+
+    def submit(self, func: Callable[..., Any], *args) -> Future:
+        """排队执行 func(conn, *args)，Future 的结果为 func 的返回值（事务提交后才完成）"""
+        future = Future()
+        try:
+            self._queue.put((func, args, future), timeout=POOL_ACQUIRE_TIMEOUT)
+        except queue.Full:
+            raise RuntimeError(f"写入队列已满（上限 {self._queue.maxsize}），请稍后重试")
+        return future
+
+    def insert(self, student: Dict[str, Any]) -> Future:
+        return self.submit(_insert_student_on, student)
+
+    def update(self, row_id: int, updates: Dict[str, Any]) -> Future:
+        return self.submit(_update_student_on, row_id, updates)
+
+    def delete(self, row_id: int) -> Future:
+        return self.submit(_delete_student_on, row_id)
+
+    def flush(self):
+        """等待此前提交的请求全部落盘"""
+        self.submit(lambda conn: None).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch": self.requests / self.batches if self.batches else 0.0,
+            "pending": self._queue.qsize(),
+        }
+
+    def _run(self):
+        WriteQueue._writer_idents.add(threading.get_ident())
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            batch = [req for req in batch if req[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outcomes, changed = _commit_batch(batch)
+            except Exception as exc:
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            # 事务已提交：先使缓存失效（提交方拿到结果后读到的就是新数据），再完成 Future，
+            # 最后累计写次数 / checkpoint。后续处理出错只记录，不能让写线程退出而使提交方永远等待
+            try:
+                if changed > 0:
+                    _invalidate_caches()
+            except Exception as e:
+                print(f"Cache invalidation error: {e}")
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            try:
+                if changed > 0:
+                    _count_write()
+            except Exception as e:
+                print(f"Post-write error: {e}")
+
+    def close(self):
+        """处理完已排队的请求后停止写线程"""
+        self._queue.put(None)
+        self._thread.join()
+        WriteQueue._writer_idents.discard(self._thread.ident)
+
+
+_write_queue: Optional[WriteQueue] = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> WriteQueue:
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue()
+        return _write_queue
+
+
+def close_write_queue():
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is not None:
+            _write_queue.close()
+            _write_queue = None
+
+
+atexit.register(close_write_queue)
+
+
+# ===== 批量修改 / 删除 =====
+SQL_VARIABLE_CHUNK = 900  # 单条语句的绑定参数数量（SQLite 默认上限 999）
+
+
+def _resolve_target_ids(
+    conn: sqlite3.Connection,
+    row_ids: Optional[Sequence[int]],
+    filters: Dict[str, Any],
+) -> Tuple[List[int], List[int]]:
+    """
+    在当前事务内确定批量操作的目标记录，返回 (请求的 id 列表, 其中存在的 id 列表)。
+    row_ids 与过滤条件二选一；两者都为空时拒绝执行，避免误改全表。
+    """
+    if row_ids is not None:
+        ids = list(dict.fromkeys(int(i) for i in row_ids))
+        existing = set()
+        for i in range(0, len(ids), SQL_VARIABLE_CHUNK):
+            part = ids[i:i + SQL_VARIABLE_CHUNK]
+            existing.update(r[0] for r in conn.execute(
+                f"SELECT id FROM students WHERE id IN ({','.join(['?'] * len(part))})",
+                part,
+            ))
+        return ids, [i for i in ids if i in existing]
+
+    conditions, params = _build_student_filters(**filters)
+    if not conditions:
+        raise ValueError("批量操作需指定 id 列表或至少一个过滤条件")
+    sql = "SELECT id FROM students WHERE " + " AND ".join(conditions) + " ORDER BY id"
+    ids = [r[0] for r in conn.execute(sql, params)]
+    return ids, ids
+
+
+@_retry_on_busy
+def update_students(
+    updates: Dict[str, Any],
+    row_ids: Optional[Sequence[int]] = None,
+    **filters,
+) -> Dict[int, str]:
+    """
+    把同一组字段更新应用到多条记录（按 id 列表或 query_students 的过滤条件）。
+    整批在一个事务内完成，返回 {id: "updated" | "not_found"}。
+    """
+    fields = [field for field in updates.keys() if field in STUDENT_FIELDS]
+    if not fields:
+        raise ValueError("没有可更新的字段")
+
     conn = get_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM students WHERE id = ?", (row_id,))
+        # IMMEDIATE 事务：确定目标与写入之间不会被其他写者插队
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requested, ids = _resolve_target_ids(conn, row_ids, filters)
+            columns, (values,) = _encode_rows(conn, fields, [[updates[field] for field in fields]])
+            set_clause = ", ".join([f"{column} = ?" for column in columns])
+            conn.executemany(
+                f"UPDATE {_student_table()} SET {set_clause} WHERE id = ?",
+                ([*values, row_id] for row_id in ids),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    _after_write(len(ids))
+    found = set(ids)
+    return {row_id: "updated" if row_id in found else "not_found" for row_id in requested}
+
+
+@_retry_on_busy
+def delete_students(row_ids: Optional[Sequence[int]] = None, **filters) -> Dict[int, str]:
+    """
+    按 id 列表或 query_students 的过滤条件批量删除，整批在一个事务内完成。
+    返回 {id: "deleted" | "not_found"}。
+    """
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requested, ids = _resolve_target_ids(conn, row_ids, filters)
+            conn.executemany(f"DELETE FROM {_student_table()} WHERE id = ?", ((row_id,) for row_id in ids))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    _after_write(len(ids))
+    found = set(ids)
+    return {row_id: "deleted" if row_id in found else "not_found" for row_id in requested}
+
+
+# ===== 批量写入（导入 / 测试数据生成共用）=====
+@contextmanager
+def _bulk_load_pragmas(conn: sqlite3.Connection):
+    """批量写入期间放宽持久性要求（异常断电最多丢失本次批量写入），加大页缓存"""
+    old_sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+    old_cache = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    try:
+        yield conn
+    finally:
+        conn.execute(f"PRAGMA synchronous={int(old_sync)}")
+        conn.execute(f"PRAGMA cache_size={int(old_cache)}")
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def _insert_batch(conn: sqlite3.Connection, records: Any) -> int:
+    """
+    在一个事务内 executemany 写入一批 (STUDENT_FIELDS 顺序的) 记录并提交。
+    事务内置位 bulk_load_state 暂停逐行维护子串索引和汇总表，改为写入后按批集中处理。
+    """
+    table = _student_table()
+    placeholders = ", ".join(["?"] * len(STUDENT_FIELDS))
+    # 先取得写锁再读 MAX(id)：否则其他线程（如写入队列）在两步之间提交的行已被触发器索引过，
+    # 又会因 id > last_id 被下面的批量补录重复计入
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        conn.execute("INSERT INTO bulk_load_state (active) VALUES (1)")
+        columns, records = _encode_rows(conn, STUDENT_FIELDS, records)
+        inserted = conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", records
+        ).rowcount
+        # 子串索引与汇总表按当前数据库判断，而不是进程级标志：
+        # 触发器随表存在，bulk_load_state 暂停了它们就必须补录
+        if _has_table(conn, "students_fts"):
+            search_cols = ", ".join(SEARCH_FIELDS)
+            conn.execute(
+                f"INSERT INTO students_fts (rowid, {search_cols}) "
+                f"SELECT id, {search_cols} FROM students WHERE id > ?",
+                (last_id,),
+            )
+        if _has_table(conn, "student_stats"):
+            _apply_stats_batch(conn, last_id)
+        conn.execute("DELETE FROM bulk_load_state")
         conn.commit()
-        return cursor.rowcount
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted
+
+
+# ===== 批量导入 =====
+IMPORT_BATCH_SIZE = 10000
+IMPORT_MAX_ERRORS = 100  # 报告中最多保留的错误明细条数
+
+# 支持中文表头
+IMPORT_COLUMN_ALIASES = {
+    "学号": "student_id",
+    "姓名": "name",
+    "班级": "class_name",
+    "学院": "college",
+    "专业": "major",
+    "年级": "grade",
+    "性别": "gender",
+    "手机号": "phone",
+    "手机": "phone",
+    "电话": "phone",
+}
+
+_PHONE_PATTERN = r"^\+?[\d\- ]{5,20}$"
+
+# .sql 导入只接受 students 的建表语句与 INSERT ... VALUES，其余语句（PRAGMA、索引、触发器等导出附带内容）一律忽略
+_SQL_LEADING_COMMENTS = re.compile(r"^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.S)
+_SQL_STUDENTS = r"(?:main\s*\.\s*)?[\"`\[]?students[\"`\]]?"
+_SQL_IMPORT_INSERT = re.compile(rf"^INSERT\s+INTO\s+{_SQL_STUDENTS}\s*(?:\([^)]*\)\s*)?VALUES\b", re.I)
+_SQL_IMPORT_CREATE = re.compile(rf"^CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?{_SQL_STUDENTS}\s*\(", re.I)
+_SQL_IMPORT_FUNCTIONS = {"replace", "char", "unhex", "unistr"}  # .dump 用于转义换行等字符的函数
+
+
+def _detect_import_format(source: Any, fmt: Optional[str]) -> str:
+    if fmt:
+        fmt = fmt.lower().lstrip(".")
+    else:
+        name = source if isinstance(source, str) else getattr(source, "name", "")
+        fmt = os.path.splitext(name)[1].lower().lstrip(".")
+    if fmt == "xls":
+        fmt = "xlsx"
+    if fmt not in {"csv", "xlsx", "sql"}:
+        raise ValueError(f"不支持的导入格式：{fmt or '未知'}（支持 csv / xlsx / sql）")
+    return fmt
+
+
+def _read_import_source(source: Any, fmt: str, batch_size: int) -> Tuple[Iterator[pd.DataFrame], Optional[int]]:
+    """按块读取待导入数据，返回 (DataFrame 块迭代器, 总行数或 None)"""
+    if fmt == "csv":
+        total = None
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                total = max(sum(1 for _ in f) - 1, 0)
+        return pd.read_csv(source, dtype=str, chunksize=batch_size, keep_default_na=False), total
+
+    if fmt == "xlsx":
+        try:
+            df = pd.read_excel(source, dtype=str, keep_default_na=False)
+        except ImportError:
+            raise ImportError("导入 Excel 需要安装 openpyxl：pip install openpyxl")
+        chunks = (df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size))
+        return chunks, len(df)
+
+    # .sql：在内存库中执行脚本，再从其中的 students 表按块读出
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8") as f:
+            script = f.read()
+    else:
+        script = source.read()
+        if isinstance(script, bytes):
+            script = script.decode("utf-8")
+    create, inserts = None, []
+    for statement in _split_sql_statements(script):
+        statement = _SQL_LEADING_COMMENTS.sub("", statement)
+        if _SQL_IMPORT_INSERT.match(statement):
+            inserts.append(statement)
+        elif create is None and _SQL_IMPORT_CREATE.match(statement):
+            create = statement
+    if not inserts:
+        raise ValueError("SQL 文件中没有可导入的 INSERT INTO students ... VALUES 语句")
+
+    # 脚本不在任何真实数据库上执行：内存暂存库禁止 ATTACH，授权回调只放行对 students 的建表、插入与读取
+    staging = sqlite3.connect(":memory:")
+    staging.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 0)
+    staging.set_authorizer(_import_sql_authorizer)
+    try:
+        staging.execute(create or f"CREATE TABLE students (id INTEGER PRIMARY KEY, {', '.join(STUDENT_FIELDS)})")
+        for statement in inserts:
+            staging.execute(statement)
+        total = staging.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        staging.close()
+        raise ValueError(f"SQL 文件中没有可导入的 students 表：{e}")
+
+    def chunks():
+        try:
+            cols = ", ".join(STUDENT_FIELDS)
+            cursor = staging.execute(f"SELECT {cols} FROM students ORDER BY rowid")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield pd.DataFrame.from_records(rows, columns=STUDENT_FIELDS)
+        finally:
+            staging.close()
+
+    return chunks(), total
+
+
+def _split_sql_statements(script: str) -> Iterator[str]:
+    """按分号切分 SQL 脚本；字符串、注释中的分号由 sqlite3.complete_statement 判断"""
+    buffer = ""
+    for part in script.split(";"):
+        buffer += part + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \t\r\n;"):
+                yield buffer.strip()
+            buffer = ""
+
+
+def _import_sql_authorizer(action, arg1, arg2, db_name, trigger):
+    """.sql 导入暂存库的授权回调：只允许 students（及 AUTOINCREMENT 附带的 sqlite_sequence）的建表、写入与读取"""
+    tables = {"students", "sqlite_sequence", "sqlite_master"}
+    if db_name not in (None, "main") or trigger is not None:
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_CREATE_TABLE and arg1 in ("students", "sqlite_sequence"):
+        return sqlite3.SQLITE_OK
+    if action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_READ) and arg1 in tables:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_FUNCTION and (arg2 or "").lower() in _SQL_IMPORT_FUNCTIONS | {"count"}:
+        return sqlite3.SQLITE_OK
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_TRANSACTION):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _validate_import_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    向量化校验一块数据，返回 (规范化后的数据, 每行错误原因)。
+    错误原因为空字符串的行视为有效。
+    """
+    df = df.rename(columns=lambda c: IMPORT_COLUMN_ALIASES.get(str(c).strip(), str(c).strip()))
+    df = df.reindex(columns=STUDENT_FIELDS)
+    for col in STUDENT_FIELDS:
+        values = df[col].fillna("").astype(str).str.strip().astype(object)
+        df[col] = values.where(values != "", None)
+
+    errors = pd.Series("", index=df.index, dtype=object)
+
+    def flag(mask: pd.Series, reason: str):
+        mask = mask.fillna(False).astype(bool)
+        errors[mask] = errors[mask] + reason + "；"
+
+    flag(df["student_id"].isna() | df["name"].isna(), "学号或姓名为空")
+
+    grade = pd.to_numeric(df["grade"], errors="coerce")
+    flag(df["grade"].notna() & (grade.isna() | (grade % 1 != 0)), "年级需为整数")
+    df["grade"] = grade.astype("Int64")
+
+    flag(df["gender"].notna() & ~df["gender"].isin(["男", "女"]), "性别只能为男/女")
+    flag(df["phone"].notna() & ~df["phone"].str.match(_PHONE_PATTERN, na=True).astype(bool), "手机号格式错误")
+
+    return df, errors.str.rstrip("；")
+
+
+def bulk_import(
+    source: Any,
+    fmt: Optional[str] = None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    skip_existing: bool = True,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None
+) -> Dict[str, Any]:
+    """
+    批量导入 CSV / Excel / SQL 学生名单（路径或文件对象，如 Streamlit 上传文件）。
+    每块数据一次 executemany + 一个事务，导入期间临时放宽同步等 PRAGMA。
+    skip_existing=True 时跳过库中或文件中已出现过的学号。
+    progress(已处理行数, 总行数或 None) 用于报告进度。
+    """
+    fmt = _detect_import_format(source, fmt)
+    chunks, total = _read_import_source(source, fmt, batch_size)
+
+    report = {
+        "inserted": 0,
+        "invalid": 0,
+        "duplicates": 0,
+        "errors": [],
+        "elapsed": 0.0,
+    }
+    start = time.perf_counter()
+    processed = 0
+
+    conn = get_connection()
+    try:
+        with _bulk_load_pragmas(conn):
+            for chunk in chunks:
+                df, errors = _validate_import_frame(chunk)
+                row_numbers = pd.Series(range(processed + 1, processed + len(df) + 1), index=df.index)
+                processed += len(df)
+
+                invalid = errors != ""
+                report["invalid"] += int(invalid.sum())
+                for row_no, reason in zip(row_numbers[invalid], errors[invalid]):
+                    if len(report["errors"]) < IMPORT_MAX_ERRORS:
+                        report["errors"].append((int(row_no), reason))
+                df = df[~invalid]
+
+                if skip_existing and not df.empty:
+                    # 之前的批次已提交，查库即可覆盖跨批次的重复
+                    dup = df["student_id"].duplicated()
+                    ids = df.loc[~dup, "student_id"].tolist()
+                    existing = set()
+                    for i in range(0, len(ids), SQL_VARIABLE_CHUNK):
+                        part = ids[i:i + SQL_VARIABLE_CHUNK]
+                        existing.update(r[0] for r in conn.execute(
+                            f"SELECT student_id FROM students WHERE student_id IN ({','.join(['?'] * len(part))})",
+                            part,
+                        ))
+                    if existing:
+                        dup = dup | df["student_id"].isin(existing)
+                    report["duplicates"] += int(dup.sum())
+                    df = df[~dup]
+
+                if not df.empty:
+                    records = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+                    report["inserted"] += _insert_batch(conn, records)
+
+                if progress:
+                    progress(processed, total)
     finally:
         conn.close()
 
+    report["elapsed"] = time.perf_counter() - start
+    _after_write(report["inserted"])
+    return report
+
+
+@_retry_on_busy
 def generate_random_data(num_records: int = 300):
     """使用 Faker 生成随机学生信息数据并导入数据库"""
     conn = get_connection()
     cursor = conn.cursor()
     
     fake = Faker('zh_CN')
-    
-    colleges_majors = {
-        "计算机学院": ["软件工程", "计算机科学与技术", "网络工程", "信息安全"],
-        "自动化学院": ["自动化", "测控技术与仪器", "机器人工程"],
-        "信息工程学院": ["通信工程", "电子信息工程", "光电信息科学与工程"],
-        "机械工程学院": ["机械设计制造及其自动化", "车辆工程", "工业设计"]
-    }
-    grades = [2021, 2022, 2023, 2024]
+    colleges = list(COLLEGES_MAJORS.keys())
 
     records = []
 
@@ -230,15 +2421,10 @@ def generate_random_data(num_records: int = 300):
         phone = fake.phone_number()
         
         # 学业信息
-        grade = random.choice(grades)
-        college = random.choice(list(colleges_majors.keys()))
-        major = random.choice(colleges_majors[college])
-        
-        # 简单的学院代码映射
-        college_code = {
-            "计算机学院": "01", "自动化学院": "02",
-            "信息工程学院": "03", "机械工程学院": "04"
-        }.get(college, "00")
+        grade = random.choice(GRADES)
+        college = random.choice(colleges)
+        major = random.choice(COLLEGES_MAJORS[college])
+        college_code = COLLEGE_CODES.get(college, "00")
         
         student_id = f"{grade}{college_code}{random.randint(1000, 9999)}"
         
@@ -249,36 +2435,507 @@ def generate_random_data(num_records: int = 300):
 
         records.append((student_id, name, class_name, college, major, grade, gender, phone))
 
-    cursor.executemany("""
-    INSERT INTO students
-    (student_id, name, class_name, college, major, grade, gender, phone)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, records)
+    columns, rows = _encode_rows(conn, STUDENT_FIELDS, records)
+    cursor.executemany(
+        f"INSERT INTO {_student_table()} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+        rows,
+    )
 
     conn.commit()
     conn.close()
+    _after_write(len(records))
     print(f"Successfully generated {len(records)} student records using Faker.")
 
     return len(records)
 
 
-def execute_sql(sql: str) -> int:
+# ===== 大规模测试数据生成（压测用）=====
+SYNTHETIC_BATCH_SIZE = 50000
+NAME_POOL_SIZE = 5000  # 每种性别预生成的姓名数
+PHONE_PREFIXES = ["130", "131", "132", "135", "136", "137", "138", "139",
+                  "150", "151", "152", "157", "158", "159", "166", "177",
+                  "180", "182", "186", "187", "188", "189", "198", "199"]
+
+
+def _build_name_pools(seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    fake = Faker('zh_CN')
+    fake.seed_instance(seed)
+    male = np.array([fake.name_male() for _ in range(NAME_POOL_SIZE)], dtype=object)
+    female = np.array([fake.name_female() for _ in range(NAME_POOL_SIZE)], dtype=object)
+    return male, female
+
+
+def _synthetic_chunk(task: Tuple[int, int, int, int, np.ndarray, np.ndarray]) -> List[tuple]:
+    """
+    生成一块测试数据（可在子进程中运行）。
+    随机数由 (seed, 块序号) 决定，结果与进程数无关，同一 seed 总能复现同一份数据。
+    start 为本块第一条记录的全局序号，用于生成不重复的学号。
+    """
+    index, start, size, seed, male_names, female_names = task
+    rng = np.random.default_rng([seed, index])
+
+    colleges = list(COLLEGES_MAJORS.keys())
+    majors = [m for c in colleges for m in COLLEGES_MAJORS[c]]
+    counts = np.array([len(COLLEGES_MAJORS[c]) for c in colleges])
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # 学院 -> 学院内专业：按各学院专业数均匀抽样
+    college_idx = rng.integers(0, len(colleges), size)
+    major_idx = offsets[college_idx] + (rng.random(size) * counts[college_idx]).astype(int)
+    grade = rng.choice(np.array(GRADES), size)
+    is_male = rng.random(size) < 0.5
+    names = np.where(
+        is_male,
+        male_names[rng.integers(0, len(male_names), size)],
+        female_names[rng.integers(0, len(female_names), size)],
+    )
+
+    college_arr = np.array(colleges, dtype=object)[college_idx]
+    major_arr = np.array(majors, dtype=object)[major_idx]
+    code_arr = np.array([COLLEGE_CODES.get(c, "00") for c in colleges], dtype=object)[college_idx]
+    grade_str = grade.astype(str).astype(object)
+    # 学号 = 年级 + 学院代码 + 全局序号：前缀定长、序号唯一，整批学号不会重复
+    serial = np.char.zfill(np.arange(start, start + size).astype(str), 6).astype(object)
+    student_ids = grade_str + code_arr + serial
+
+    # 班级 (专业简称 + 年级后两位 + 班号)
+    major_short = np.array([m[:2] for m in majors], dtype=object)[major_idx]
+    class_num = rng.integers(1, 5, size).astype(str).astype(object)
+    class_names = major_short + (grade % 100).astype(str).astype(object) + "0" + class_num + "班"
+
+    phones = (
+        np.array(PHONE_PREFIXES, dtype=object)[rng.integers(0, len(PHONE_PREFIXES), size)]
+        + np.char.zfill(rng.integers(0, 10 ** 8, size).astype(str), 8).astype(object)
+    )
+    genders = np.where(is_male, "男", "女").astype(object)
+
+    return list(zip(
+        student_ids.tolist(), names.tolist(), class_names.tolist(),
+        college_arr.tolist(), major_arr.tolist(), grade.tolist(),
+        genders.tolist(), phones.tolist(),
+    ))
+
+
+def iter_synthetic_records(
+    num_records: int,
+    seed: int = 0,
+    workers: int = 1,
+    batch_size: int = SYNTHETIC_BATCH_SIZE
+) -> Iterator[List[tuple]]:
+    """按块产出确定性的测试数据；workers > 1 时多进程并行生成，产出顺序不变"""
+    male_names, female_names = _build_name_pools(seed)
+    tasks = [
+        (i, start, min(batch_size, num_records - start), seed, male_names, female_names)
+        for i, start in enumerate(range(0, num_records, batch_size))
+    ]
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _synthetic_chunk(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_synthetic_chunk, tasks)
+
+
+def generate_synthetic_data(
+    num_records: int,
+    seed: int = 0,
+    workers: int = 1,
+    batch_size: int = SYNTHETIC_BATCH_SIZE,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None
+) -> int:
+    """生成大规模测试数据并边生成边写入（每块一个事务），返回写入条数"""
+    inserted = 0
+    conn = get_connection()
+    try:
+        with _bulk_load_pragmas(conn):
+            for records in iter_synthetic_records(num_records, seed, workers, batch_size):
+                inserted += _insert_batch(conn, records)
+                if progress:
+                    progress(inserted, num_records)
+    finally:
+        conn.close()
+    _after_write(inserted)
+    return inserted
+
+
+@_retry_on_busy
+def execute_sql(sql: str, params: Optional[Sequence[Any]] = None) -> int:
     """用于 INSERT / UPDATE / DELETE"""
+    sql, params = normalize_sql(sql, params)
+    _log_sql(sql, params)
+    words = _sql_words(sql)
     conn = get_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute(sql)
+        if _normalized and words[:1] in (["insert"], ["update"], ["delete"], ["replace"]) and "returning" not in words:
+            # 经视图的 INSTEAD OF 触发器写入时 rowcount 恒为 0，改用 RETURNING 计数
+            rowcount = len(cursor.execute(f"{sql.rstrip().rstrip(';')} RETURNING 1", params).fetchall())
+        else:
+            cursor.execute(sql, params)
+            rowcount = cursor.rowcount
         conn.commit()
-        return cursor.rowcount
     finally:
         conn.close()
+    _after_write(rowcount)
+    return rowcount
+
+
+# ===== 取值目录缓存 =====
+# 一次分组扫描得到各维度的取值及人数，写操作后失效
+CATALOG_COLUMNS = ["college", "major", "class_name", "grade", "gender"]
+_catalog: Optional[Dict[str, Any]] = None
+_catalog_generation = 0
+_catalog_lock = threading.Lock()
+
+
+def invalidate_catalog():
+    """数据变更后清空取值目录，下次访问时重建"""
+    global _catalog, _catalog_generation
+    with _catalog_lock:
+        _catalog = None
+        _catalog_generation += 1
+
+
+def _catalog_sort_key(value: Any):
+    # None 排最后，数字按数值、文本按字典序
+    if value is None:
+        return (2, 0, "")
+    if isinstance(value, str):
+        return (1, 0, value)
+    return (0, value, "")
+
+
+def _load_catalog() -> Dict[str, Any]:
+    global _catalog
+    get_data_version()  # 其他进程修改过数据时先使缓存失效
+    with _catalog_lock:
+        if _catalog is not None:
+            return _catalog
+        generation = _catalog_generation
+
+    # 字典编码存储下按整数外键分组，再用字典表换回名称
+    cols = ", ".join(_storage_column(c) for c in CATALOG_COLUMNS)
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {cols}, COUNT(*) FROM {_student_table()} GROUP BY {cols}"
+        ).fetchall()
+        if _normalized:
+            rows = _decode_rows(conn, CATALOG_COLUMNS + ["count"], rows)
+    finally:
+        conn.close()
+
+    counts: Dict[str, Dict[Any, int]] = {col: {} for col in CATALOG_COLUMNS}
+    majors_by_college: Dict[Any, Dict[Any, int]] = {}
+    for row in rows:
+        n = row[-1]
+        for col, value in zip(CATALOG_COLUMNS, row):
+            counts[col][value] = counts[col].get(value, 0) + n
+        college_majors = majors_by_college.setdefault(row[0], {})
+        college_majors[row[1]] = college_majors.get(row[1], 0) + n
+
+    catalog = {
+        "counts": {
+            col: sorted(values.items(), key=lambda kv: _catalog_sort_key(kv[0]))
+            for col, values in counts.items()
+        },
+        "majors_by_college": majors_by_college,
+    }
+    with _catalog_lock:
+        # 构建期间发生写操作则不缓存这份可能过期的结果
+        if generation == _catalog_generation:
+            _catalog = catalog
+    return catalog
+
+
+def get_value_counts(column: str) -> List[Tuple[Any, int]]:
+    """返回某一维度的 [(取值, 人数), ...]（含 NULL），来自取值目录缓存"""
+    if column not in CATALOG_COLUMNS:
+        raise ValueError(f"不支持的统计维度：{column}")
+    return list(_load_catalog()["counts"][column])
+
+
+def get_majors_by_college(colleges: Any) -> List[str]:
+    """返回所选学院（str 或 List[str]）下的专业列表"""
+    if isinstance(colleges, str):
+        colleges = [colleges]
+    majors_by_college = _load_catalog()["majors_by_college"]
+    majors = []
+    for college in colleges:
+        for major in majors_by_college.get(college, {}):
+            if major and major not in majors:
+                majors.append(major)
+    return sorted(majors, key=_catalog_sort_key)
 
 
 def get_distinct_values(column: str):
-    conn = get_connection()
+    if column in CATALOG_COLUMNS:
+        return [value for value, _ in get_value_counts(column)]
+
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
         cursor.execute(f"SELECT DISTINCT {column} FROM students")
         return [row[0] for row in cursor.fetchall()]
     finally:
         conn.close()
+
+
+# ===== 分析引擎（可选）=====
+# 统计类查询可交给进程内列式引擎 DuckDB，在 students 的列式快照上执行。
+# 写操作后快照失效，由后台线程重建；重建完成前统计查询照常走 SQLite，结果始终与数据库一致。
+# 未安装 duckdb、数据量小或语句不兼容时同样回退到 SQLite
+ANALYTICS_BACKEND = "auto"    # "auto" | "duckdb" | "sqlite"
+ANALYTICS_MIN_ROWS = 100000   # 小于该行数时 SQLite 已足够快，不值得维护快照
+ANALYTICS_LOAD_CHUNK = 50000  # 重建快照时每次从 SQLite 读出并写入 DuckDB 的行数
+ANALYTICS_SCHEMA = {
+    "id": "BIGINT", "student_id": "VARCHAR", "name": "VARCHAR", "class_name": "VARCHAR",
+    "college": "VARCHAR", "major": "VARCHAR", "grade": "BIGINT", "gender": "VARCHAR", "phone": "VARCHAR",
+}
+_analytics_conn = None
+_analytics_snapshot: Optional[Tuple[str, int]] = None  # 快照对应的 (DB_PATH, 代数)
+_analytics_generation = 0
+_analytics_refresh_thread: Optional[threading.Thread] = None
+_analytics_lock = threading.Lock()
+
+
+def invalidate_analytics():
+    global _analytics_generation
+    with _analytics_lock:
+        _analytics_generation += 1
+
+
+def analytics_backend() -> str:
+    """返回统计查询当前应使用的后端（"duckdb" 或 "sqlite"）"""
+    if ANALYTICS_BACKEND == "sqlite":
+        return "sqlite"
+    if duckdb is None:
+        if ANALYTICS_BACKEND == "duckdb":
+            raise ImportError("使用 DuckDB 分析引擎需要安装 duckdb：pip install duckdb")
+        return "sqlite"
+    if ANALYTICS_BACKEND == "auto" and get_summary_counts()["total"] < ANALYTICS_MIN_ROWS:
+        return "sqlite"
+    return "duckdb"
+
+
+def _snapshot_source(rows: List[tuple]) -> Any:
+    """把行数据转换为 DuckDB 可直接扫描的对象：优先 Arrow 表，类型不一致时退回 DataFrame"""
+    columns = list(ANALYTICS_SCHEMA)
+    try:
+        import pyarrow as pa
+        return pa.table({name: pa.array(values) for name, values in zip(columns, zip(*rows))})
+    except (ImportError, ValueError, TypeError):  # ArrowInvalid / ArrowTypeError 分别继承自二者
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def refresh_analytics_snapshot() -> bool:
+    """
+    同步重建 DuckDB 快照，返回快照是否与当前数据一致（重建期间又有写入时为 False）。
+    一般由 query_analytics 在后台线程中触发，测试或预热时也可直接调用。
+    """
+    global _analytics_conn, _analytics_snapshot
+    with _analytics_lock:
+        key = (DB_PATH, _analytics_generation)
+
+    target = duckdb.connect()  # 内存库
+    # 与 SQLite 一致：NULL 视为最小值，升序排在最前、降序排在最后
+    target.execute("SET GLOBAL default_null_order = 'nulls_first_on_asc_last_on_desc'")
+    columns = ", ".join(f"{name} {kind}" for name, kind in ANALYTICS_SCHEMA.items())
+    target.execute(f"CREATE TABLE students ({columns})")
+    # 分块流式写入，内存中只保留一块数据（同一条 SELECT 语句内读到的是一致的快照）
+    conn = get_connection()
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(ANALYTICS_SCHEMA)} FROM students")
+        while True:
+            rows = cursor.fetchmany(ANALYTICS_LOAD_CHUNK)
+            if not rows:
+                break
+            target.register("students_chunk", _snapshot_source(rows))
+            target.execute("INSERT INTO students SELECT * FROM students_chunk")
+            target.unregister("students_chunk")
+    finally:
+        conn.close()
+
+    with _analytics_lock:
+        if key != (DB_PATH, _analytics_generation):
+            return False
+        # 旧连接不主动关闭：其他线程可能仍持有由它派生的游标
+        _analytics_conn, _analytics_snapshot = target, key
+    return True
+
+
+def _refresh_in_background():
+    try:
+        refresh_analytics_snapshot()
+    except Exception as e:
+        print(f"Analytics snapshot error: {e}")
+
+
+def _wait_analytics_refresh():
+    # 解释器退出时 DuckDB 仍在后台线程中运行会直接 abort，先等待重建结束
+    thread = _analytics_refresh_thread
+    if thread is not None:
+        thread.join()
+
+
+atexit.register(_wait_analytics_refresh)
+
+
+def _analytics_cursor():
+    """快照是最新的则返回 DuckDB 游标；否则启动后台重建并返回 None"""
+    global _analytics_refresh_thread
+    get_data_version()
+    with _analytics_lock:
+        if _analytics_conn is not None and _analytics_snapshot == (DB_PATH, _analytics_generation):
+            return _analytics_conn.cursor()
+        if _analytics_refresh_thread is None or not _analytics_refresh_thread.is_alive():
+            _analytics_refresh_thread = threading.Thread(target=_refresh_in_background, daemon=True)
+            _analytics_refresh_thread.start()
+    return None
+
+
+# 只有 DuckDB 与 SQLite 结果一致的聚合语句才交给分析引擎：列名、COUNT / SUM / MIN / MAX / AVG、比较与 IN、
+# GROUP BY / ORDER BY / LIMIT。整数除法、LIKE 大小写、日期函数等方言差异会让同一问题随数据量换引擎而结果不同，
+# 出现其他任何词或运算符（/、%、||、LIKE、函数调用等）都留在 SQLite
+_ANALYTICS_WORDS = {
+    "select", "from", "where", "group", "by", "having", "order", "limit", "offset", "as", "and", "or", "not",
+    "in", "is", "null", "distinct", "asc", "desc", "between", "students",
+} | set(ANALYTICS_SCHEMA)
+_ANALYTICS_AGGREGATES = {"count", "sum", "min", "max", "avg"}
+_ANALYTICS_TOKEN = re.compile(r"\s+|([^\W\d]\w*)|(\d+|<>|!=|<=|>=|[=<>,()*?.])|(.)")
+
+
+def _analytics_compatible(sql: str) -> bool:
+    allowed = _ANALYTICS_WORDS | _ANALYTICS_AGGREGATES
+    words = []
+    for m in _ANALYTICS_TOKEN.finditer(sql):
+        word, _, other = m.groups()
+        if other is not None:
+            return False
+        if word is None:
+            continue
+        word = word.lower()
+        if words and words[-1] == "as":
+            allowed = allowed | {word}  # 列别名，之后的 ORDER BY 可以引用
+        elif word not in allowed:
+            return False
+        words.append(word)
+    return bool(words) and words[0] == "select" and bool(_ANALYTICS_AGGREGATES & set(words) or "group" in words)
+
+
+def query_analytics(
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    max_rows: Optional[int] = None,
+    time_budget: Optional[float] = None,
+    step_budget: Optional[int] = None,
+) -> ColumnarResult:
+    """
+    统计类（聚合）查询入口，返回 ColumnarResult。
+    大表、安装了 duckdb、快照就绪且语句属于两者语义一致的聚合形式时在列式快照上执行，其余情况走 SQLite。
+    预算参数同 query_columnar；DuckDB 上只有时间预算生效（超时由定时器中断）。
+    """
+    limits = dict(max_rows=max_rows, time_budget=time_budget, step_budget=step_budget)
+    bound_sql, bound_params = normalize_sql(sql, params)
+    if not _analytics_compatible(bound_sql) or analytics_backend() == "sqlite":
+        return query_columnar(sql, params, **limits)
+    cursor = _analytics_cursor()
+    if cursor is None:
+        return query_columnar(sql, params, **limits)
+
+    _log_sql(bound_sql, bound_params)
+    timer = threading.Timer(time_budget, cursor.interrupt) if time_budget is not None else None
+    try:
+        if timer is not None:
+            timer.start()
+        cursor.execute(bound_sql, bound_params)
+        columns = [d[0] for d in cursor.description]
+        rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows + 1)
+    except duckdb.InterruptException as e:
+        raise QueryBudgetError(f"查询已中止：执行时间超过 {time_budget:g} 秒，请缩小查询范围") from e
+    except duckdb.Error as e:
+        # SQLite 方言（如部分内置函数）DuckDB 不一定支持，回退执行
+        print(f"Analytics fallback: {e}")
+        return query_columnar(sql, params, **limits)
+    finally:
+        if timer is not None:
+            timer.cancel()
+        cursor.close()
+    return _capped_columnar(columns, rows, max_rows)
+
+
+# ===== 异步访问 =====
+# AsyncDatabase 把同步接口放到专用线程中执行：每次调用从连接池借出一个连接，调用内的同步接口
+# 复用这条连接（借用可重入），调用结束即归还，空闲时不占用连接池。互不依赖的查询可用 asyncio.gather
+# 并发执行，同一事件循环也可以同时服务多个请求
+ASYNC_WORKERS = 4  # 同时进行的调用数（即最多同时借用的连接数），须小于 POOL_MAX_SIZE，给同步调用留出余量
+ASYNC_HELPERS = [
+    "query_df", "query_columnar", "query_guarded", "query_analytics", "check_query_plan", "execute_sql",
+    "query_students", "query_students_page", "estimate_student_count", "get_students_by_student_id",
+    "insert_student", "update_student_by_id", "delete_student_by_id", "update_students", "delete_students",
+    "bulk_import", "get_dimension_counts", "get_summary_counts", "get_value_counts",
+    "get_distinct_values", "get_majors_by_college",
+]
+
+
+class AsyncDatabase:
+    """本模块同步接口的 asyncio 版本，方法名与参数和 ASYNC_HELPERS 中的同步函数一致"""
+
+    def __init__(self, workers: int = ASYNC_WORKERS):
+        if not 0 < workers < POOL_MAX_SIZE:
+            raise ValueError(f"workers 须在 1 到 {POOL_MAX_SIZE - 1} 之间")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite-async")
+
+    def _call(self, func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        # 调用期间持有一个连接，函数内部的 get_connection() 都复用它
+        conn = get_connection()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # 函数内未归还的借用一并结束，连接整体归还，未提交的事务随之回滚
+            conn._depth = 1
+            conn.close()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在专用线程中执行任意同步函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, func, args, kwargs))
+
+    def close(self):
+        """等待进行中的调用结束"""
+        self._executor.shutdown(wait=True)
+
+
+def _async_helper(name: str):
+    async def helper(self, *args, **kwargs):
+        return await self.run(globals()[name], *args, **kwargs)
+    helper.__name__ = name
+    helper.__doc__ = f"{name} 的异步版本"
+    return helper
+
+
+for _name in ASYNC_HELPERS:
+    setattr(AsyncDatabase, _name, _async_helper(_name))
+
+_async_db: Optional[AsyncDatabase] = None
+_async_db_lock = threading.Lock()
+
+
+def get_async_db() -> AsyncDatabase:
+    """进程内共享的 AsyncDatabase（可在多个事件循环中使用）"""
+    global _async_db
+    with _async_db_lock:
+        if _async_db is None:
+            _async_db = AsyncDatabase()
+        return _async_db
+
+
+def close_async_db():
+    global _async_db
+    with _async_db_lock:
+        if _async_db is not None:
+            _async_db.close()
+            _async_db = None
+
+
+atexit.register(close_async_db)
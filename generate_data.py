@@ -0,0 +1,49 @@
+"""
+压测数据生成工具
+
+用法：
+    python generate_data.py --count 1000000 --seed 42 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import database
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成确定性的大规模学生测试数据")
+    parser.add_argument("--count", type=int, required=True, help="生成的记录数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（相同种子生成相同数据）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行生成的进程数")
+    parser.add_argument("--batch-size", type=int, default=database.SYNTHETIC_BATCH_SIZE, help="每个事务写入的记录数")
+    parser.add_argument("--db", default=database.DB_PATH, help="数据库文件路径")
+    args = parser.parse_args(argv)
+
+    if args.count <= 0:
+        parser.error("--count 必须为正整数")
+
+    database.DB_PATH = args.db
+    # 只建表不填充示例数据，保证相同参数生成的数据完全相同
+    database.init_db(sample_data=False)
+
+    start = time.perf_counter()
+
+    def on_progress(done, total):
+        elapsed = time.perf_counter() - start
+        print(f"\r已写入 {done}/{total} 条（{done / max(elapsed, 1e-9):,.0f} 条/秒）", end="", flush=True)
+
+    inserted = database.generate_synthetic_data(
+        args.count,
+        seed=args.seed,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        progress=on_progress,
+    )
+    print(f"\n完成：共写入 {inserted} 条记录，用时 {time.perf_counter() - start:.1f} 秒。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# 大模型响应缓存：同一问题（归一化后）在表结构与取值目录未变时直接复用上次的模型输出，不再消耗 token。
+# 缓存的是模型返回的 JSON 文本，之后的 SQL 执行、修改前预览等仍按实时数据进行
+LLM_CACHE_SIZE = 512             # 内存中最多保留的条目数（LRU 淘汰）
+LLM_CACHE_TTL = 24 * 3600        # 条目有效期（秒）
+LLM_CACHE_FILE: Optional[str] = None  # 设为文件路径（如 "llm_cache.db"）时持久化到 SQLite，重启后仍可命中
+
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_question(text: str) -> str:
+    """归一化用户问题：全角转半角、小写、合并空白、去掉句末标点"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = " ".join(text.split())
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def fingerprint(*parts: Any) -> str:
+    """任意可 JSON 序列化内容的短指纹"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMResponseCache:
+    """LRU + TTL 的模型响应缓存，可选 SQLite 文件作为二级存储"""
+
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL, path: Optional[str] = LLM_CACHE_FILE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (写入时间, 响应文本)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - ttl,))
+            self._conn.commit()
+
+    def make_key(self, text: str, schema: str, context: Optional[str] = None, variant: str = "") -> str:
+        """缓存键 = 归一化问题 + 表结构 / 取值指纹 + 写入 Prompt 的上下文 + 提示词变体
+
+        “女生呢”这类追问的含义取决于上下文，因此上下文非空时总是参与缓存键；
+        没有上下文的独立问题才能跨会话命中
+        """
+        return fingerprint(variant, schema, normalize_question(text), normalize_question(context) if context else "")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT created, value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row:
+                    entry = tuple(row)
+                    self._remember(key, entry)
+            if entry is not None and now - entry[0] > self.ttl:
+                self._forget(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: str):
+        entry = (time.time(), value)
+        with self._lock:
+            self._remember(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, created, value) VALUES (?, ?, ?)", (key, *entry)
+                )
+                self._conn.commit()
+
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_shared_cache: Optional[LLMResponseCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache:
+    """进程内共享的缓存：Streamlit 每次重跑都会新建 LLMInterface，缓存需跨实例、跨会话复用"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMResponseCache()
+        return _shared_cache
@@ -1,11 +1,16 @@
 import re
 import json
 import os
-from typing import Dict, Any, Optional
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
 
 import dashscope
 from dashscope import Generation
-from database import get_distinct_values, query_df, get_connection
+from database import get_distinct_values, query_df, query_guarded, sql_fingerprint
+from llm_cache import LLMResponseCache, fingerprint, get_response_cache
 
 # =========================
 # 配置 DashScope
@@ -14,6 +19,448 @@ from database import get_distinct_values, query_df, get_connection
 dashscope.api_key = os.getenv("DASHSCOPE_API_KEY", "").strip()
 MODEL_NAME = "qwen-turbo"
 
+# =========================
+# 关键词自动机
+# =========================
+# 规则路径用到的全部关键词表，按分组编译成一个 Aho–Corasick 自动机：
+# 对问题扫描一遍即可得到命中的所有分组，耗时只与文本长度有关，与关键词数量无关
+KEYWORD_GROUPS = {
+    "has": ["有"],
+    "is": ["是"],
+    "question": ["吗"],
+    "count": ["统计", "人数", "多少"],
+    "select": ["查询", "查一下", "查看", "搜索", "找"],
+    "conjunction": ["和", "或", "且"],
+    "insert": ["新增", "添加", "插入"],
+    "update": ["修改", "更新"],
+    "delete": ["删除", "移除"],
+    # 含这些词时不走闲聊快捷回复
+    "operation": ["查", "统计", "多少", "是", "修改", "删除", "增加", "班", "级", "学院", "专业"],
+    "greeting": ["你好", "您好", "嗨", "hello"],
+    "capability": ["你能干什么", "会什么", "功能", "可以做什么"],
+    "help": ["怎么用", "帮助"],
+    "thanks": ["谢谢", "感谢"],
+    # 统计问题已指明维度
+    "count_dimension": ["学院", "专业", "性别", "班", "级", "总", "全部"],
+}
+
+
+class KeywordMatcher:
+    """多模式关键词匹配（Aho–Corasick），一次扫描报告所有命中分组，包括互相重叠的关键词"""
+
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        goto: List[Dict[str, int]] = [{}]
+        fail: List[int] = [0]
+        out: List[set] = [set()]
+        for group, words in groups.items():
+            for word in words:
+                node = 0
+                for ch in word:
+                    nxt = goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[node][ch] = nxt
+                        goto.append({})
+                        fail.append(0)
+                        out.append(set())
+                    node = nxt
+                out[node].add(group)
+
+        # 按层（BFS）计算失败指针，并把失败链上的输出并入当前状态
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] |= out[fail[nxt]]
+                queue.append(nxt)
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [frozenset(o) for o in out]
+
+    def groups(self, text: str) -> frozenset:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        hits = set()
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                hits |= out[node]
+        return frozenset(hits)
+
+
+_keyword_matcher = KeywordMatcher(KEYWORD_GROUPS)
+
+
+@lru_cache(maxsize=256)
+def keyword_hits(text: str) -> frozenset:
+    """问题命中的关键词分组（不区分大小写）；同一问题在意图识别、闲聊回复、规划中只扫描一次"""
+    return _keyword_matcher.groups(text.lower())
+
+
+# =========================
+# Prompt 构建
+# =========================
+# 表结构、输出规范等静态部分在导入时渲染一次；学院 / 专业取值只附带与问题相关的项，
+# 整个 Prompt 受估算 token 预算约束，超出时先截断上下文（保留最近部分），再删减低相关度的取值
+PROMPT_TOKEN_BUDGET = 1500      # 单次 Prompt 的估算 token 上限
+PROMPT_MAX_VALUES = 15          # 每个维度最多附带的相关取值数
+PROMPT_SAMPLE_VALUES = 5        # 问题未提及任何取值时附带的示例数（供追问时列举）
+PROMPT_LOG_SIZE = 500           # 保留最近多少次 Prompt 的大小记录
+
+SCHEMA_PROMPT = """数据库表结构：
+students (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT (学号),
+    name TEXT (姓名),
+    class_name TEXT (班级),
+    college TEXT (学院),
+    major TEXT (专业),
+    grade INTEGER (年级),
+    gender TEXT (性别),
+    phone TEXT (手机号)
+)"""
+
+_prompt_log: deque = deque(maxlen=PROMPT_LOG_SIZE)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个计，其余字符按 4 个 1 token 计"""
+    wide = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+@lru_cache(maxsize=16)
+def _catalog_index(values: tuple) -> Dict[str, List[int]]:
+    """取值目录的二元组倒排索引；“学院”“工程”这类多数取值共有的片段不参与匹配"""
+    index: Dict[str, List[int]] = {}
+    for i, value in enumerate(values):
+        for gram in _bigrams(value):
+            index.setdefault(gram, []).append(i)
+    common = max(2, len(values) // 4)
+    return {gram: ids for gram, ids in index.items() if len(ids) <= common}
+
+
+def relevant_values(text: str, values: Iterable[Any], limit: int = PROMPT_MAX_VALUES) -> List[str]:
+    """按与问题的相关度挑选取值：完整出现在问题中的优先，其次按共有二元组数排序"""
+    values = tuple(str(v) for v in values if v)
+    index = _catalog_index(values)
+    scores: Dict[int, int] = {}
+    for gram in _bigrams(text):
+        for i in index.get(gram, ()):
+            scores[i] = scores.get(i, 0) + 1
+    ranked = sorted(scores, key=lambda i: (values[i] not in text, -scores[i], i))
+    return [values[i] for i in ranked[:limit]]
+
+
+def _tail_within(text: str, budget: int) -> str:
+    """保留文本末尾不超过 budget 个估算 token 的部分"""
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    used = 0.0
+    for i in range(len(text) - 1, -1, -1):
+        used += 1 if ord(text[i]) > 0x2E7F else 0.25
+        if used > budget:
+            return text[i + 1:]
+    return text
+
+
+class PromptBuilder:
+    """静态头尾预渲染一次，取值目录按问题裁剪，整体受 token 预算约束"""
+
+    def __init__(self, name: str, head: str, tail: str, budget: int = PROMPT_TOKEN_BUDGET):
+        self.name = name
+        self.head = head
+        self.tail = tail
+        self.budget = budget
+        self.static_tokens = estimate_tokens(head) + estimate_tokens(tail)
+        # 头尾模板的指纹进入缓存键：修改 Prompt 后旧的缓存响应自动失效
+        self.variant = f"{MODEL_NAME}:{name}:{fingerprint(head, tail)}"
+
+    def build(self, text: str, context: Optional[str] = None, catalog: Optional[Dict[str, List[Any]]] = None) -> str:
+        """catalog: {标签: 全部取值}，如 {"学院列表": colleges}"""
+        return self.render(text, context, catalog)[0]
+
+    def render(self, text: str, context: Optional[str] = None,
+               catalog: Optional[Dict[str, List[Any]]] = None) -> Tuple[str, str]:
+        """同 build，另返回实际写入 Prompt 的上下文（裁剪后），供缓存键使用"""
+        allowance = self.budget - self.static_tokens - estimate_tokens(self._question(text, ""))
+
+        # 1. 取值目录：相关取值优先，没有相关项时给少量示例；超预算时从最长的列表末尾删减
+        lines = []
+        for label, values in (catalog or {}).items():
+            values = [str(v) for v in values if v]
+            picked = relevant_values(text, values) or values[:PROMPT_SAMPLE_VALUES]
+            lines.append([label, picked, len(values)])
+        block = self._catalog(lines)
+        while lines and estimate_tokens(block) > allowance:
+            longest = max(lines, key=lambda line: len(line[1]))
+            if not longest[1]:
+                break
+            longest[1].pop()
+            block = self._catalog(lines)
+
+        # 2. 上下文：用剩余预算保留最近的部分
+        context = context or ""
+        kept = _tail_within(context, allowance - estimate_tokens(block))
+
+        prompt = self.head + block + self._question(text, kept) + self.tail
+        tokens = estimate_tokens(prompt)
+        _prompt_log.append({
+            "prompt": self.name,
+            "chars": len(prompt),
+            "tokens": tokens,
+            "values": sum(len(line[1]) for line in lines),
+            "catalog_size": sum(line[2] for line in lines),
+            "context_trimmed": len(kept) < len(context),
+            "over_budget": tokens > self.budget,
+        })
+        return prompt, kept
+
+    @staticmethod
+    def _catalog(lines: List[list]) -> str:
+        if not lines:
+            return ""
+        rows = [
+            f"{label}: {picked}" + (f"（共 {total} 个，仅列出相关项）" if len(picked) < total else "")
+            for label, picked, total in lines
+        ]
+        return "数据库现有数据参考：\n" + "\n".join(rows) + "\n\n"
+
+    @staticmethod
+    def _question(text: str, context: str) -> str:
+        return f'用户输入: "{text}"\n上下文: "{context}"\n\n'
+
+
+def get_prompt_log():
+    """最近的 Prompt 大小记录（新的在后）"""
+    return list(_prompt_log)
+
+
+def clear_prompt_log():
+    _prompt_log.clear()
+
+
+def get_prompt_stats() -> Dict[str, Any]:
+    entries = list(_prompt_log)
+    tokens = [e["tokens"] for e in entries]
+    return {
+        "calls": len(entries),
+        "avg_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+        "max_tokens": max(tokens, default=0),
+        "over_budget": sum(1 for e in entries if e["over_budget"]),
+        "context_trimmed": sum(1 for e in entries if e["context_trimmed"]),
+    }
+
+
+_PROMPT_HEAD = """
+你是一个智能学生信息管理助手。请根据用户输入和上下文，判断用户意图并生成相应的操作。
+
+""" + SCHEMA_PROMPT + "\n\n"
+
+PRIMARY_PROMPT = PromptBuilder("primary", _PROMPT_HEAD, """请以 JSON 格式返回结果，不要包含 Markdown 格式标记（如 ```json）：
+{
+    "type": "sql" | "chat" | "ask" | "boolean_check",
+    // sql: 普通查询; chat: 闲聊/上下文回顾; ask: 追问; boolean_check: 是非判断(如"张三是男生吗")
+    
+    "response_type": "count" | "select", // type="sql" 时需要。
+    "sql": "SELECT ...",             // type="sql" 或 "boolean_check" 时需要。
+    "message": "...",                // type="chat" 或 "ask" 时需要。
+    "expected_value": "..."          // type="boolean_check" 时需要。用户预期的值(如"男")。
+}
+
+注意：
+1. 如果用户询问之前的对话内容（如“我刚才问了什么”、“重复一遍”），请务必根据【上下文】中的信息进行回答，并将 type 设为 "chat"。
+2. 如果用户问“统计学院人数”或“各学院人数”，请使用 GROUP BY college。同理适用于专业、班级等。
+3. 如果用户问“张三是男生吗”，请返回 type="boolean_check"，生成查询性别的 SQL，并将 "男" 放入 expected_value。
+4. 如果用户只说“统计人数”且未指定维度，请返回 type="ask"，并在 message 中列出具体的学院或专业供用户选择（参考上面的列表）。
+5. 如果用户请求修改/删除/添加，请生成对应的 UPDATE/DELETE/INSERT 语句，并将 type 设为 "sql"。
+6. 模糊查询请使用 LIKE。
+7. 确保 SQL 语法正确。
+""")
+
+FALLBACK_PROMPT = PromptBuilder("fallback", _PROMPT_HEAD, """请以 JSON 格式返回结果，不要包含 Markdown 格式标记（如 ```json）：
+{
+    "type": "sql" | "chat" | "ask",  // sql: 需要查询数据库; chat: 普通闲聊/上下文回顾; ask: 需要用户补充信息
+    "response_type": "count" | "select", // 仅当 type="sql" 时需要。count: 统计类; select: 明细类
+    "sql": "SELECT ...",             // 仅当 type="sql" 时需要。请生成标准的 SQLite 查询语句。
+    "message": "..."                 // 仅当 type="chat" 或 "ask" 时需要。
+}
+
+注意：
+1. 如果用户询问之前的对话内容（如“我刚才问了什么”），请务必根据【上下文】中的信息进行回答，并将 type 设为 "chat"。
+2. 如果用户问“张三是男生吗”，请生成查询性别的 SQL，不要直接回答。
+3. 如果用户问“一共有几个专业”，请使用 SELECT COUNT(DISTINCT major)...
+4. 模糊查询请使用 LIKE。
+5. 确保 SQL 语法正确，字段名符合表结构。
+""")
+
+
+# =========================
+# 流式输出
+# =========================
+# 模型输出按增量（stream + incremental_output）返回，边接收边解析：
+# sql 字段一完整即开始校验并在后台预执行查询，chat / ask 的 message 逐段回调给界面显示
+LLM_STREAM = True
+PREFETCH_WORKERS = 2             # 后台预执行查询的线程数
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetch_lock = threading.Lock()
+
+
+def _prefetch_executor() -> ThreadPoolExecutor:
+    global _prefetch_pool
+    with _prefetch_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="sql-prefetch")
+        return _prefetch_pool
+
+
+class StreamingJSONParser:
+    """
+    增量解析模型输出的顶层 JSON 对象。
+    fields 为已完整的字段；partial 为正在接收的字符串字段（已到达的部分）。
+    开头的 ```json 等非 JSON 内容会被跳过；嵌套值按原文收集，完整后用 json.loads 解析。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.partial: Dict[str, str] = {}
+        self._state = "start"
+        self._key = ""
+        self._buf: List[str] = []
+        self._escape: Optional[str] = None  # 字符串中的转义序列（不含反斜杠），None 表示不在转义中
+        self._depth = 0
+        self._in_string = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[str]:
+        """送入一段输出，返回本段中完整的字段名"""
+        self.text += chunk
+        completed = []
+        for ch in chunk:
+            state = self._state
+            if state == "start":
+                if ch == "{":
+                    self._state = "key_wait"
+            elif state == "key_wait":
+                if ch == '"':
+                    self._state, self._buf = "key", []
+                elif ch == "}":
+                    self._state = "done"
+            elif state == "key":
+                if self._string_char(ch):
+                    self._key = "".join(self._buf)
+                    self._state = "colon"
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value_wait"
+            elif state == "value_wait":
+                if ch == '"':
+                    self._state, self._buf = "string", []
+                    self.partial[self._key] = ""
+                elif not ch.isspace():
+                    self._state, self._buf = "raw", [ch]
+                    self._depth = 1 if ch in "{[" else 0
+                    self._in_string = False
+            elif state == "string":
+                if self._string_char(ch):
+                    self.partial.pop(self._key, None)
+                    self.fields[self._key] = self._decoded()
+                    completed.append(self._key)
+                    self._state = "key_wait"
+            elif state == "raw":
+                if self._raw_char(ch):
+                    raw = "".join(self._buf).strip()
+                    try:
+                        self.fields[self._key] = json.loads(raw)
+                    except ValueError:
+                        self.fields[self._key] = raw
+                    completed.append(self._key)
+                    self._state = "done" if ch == "}" else "key_wait"
+
+        if self._state == "string":
+            self.partial[self._key] = self._decoded()
+        return completed
+
+    def _string_char(self, ch: str) -> bool:
+        """处理字符串内的一个字符，遇到结束引号返回 True"""
+        if self._escape is not None:
+            self._escape += ch
+            if self._escape[0] != "u":
+                self._buf.append(_JSON_ESCAPES.get(ch, ch))
+                self._escape = None
+            elif len(self._escape) == 5:
+                try:
+                    self._buf.append(chr(int(self._escape[1:], 16)))
+                except ValueError:
+                    pass
+                self._escape = None
+            return False
+        if ch == "\\":
+            self._escape = ""
+            return False
+        if ch == '"':
+            return True
+        self._buf.append(ch)
+        return False
+
+    def _raw_char(self, ch: str) -> bool:
+        """收集数字 / 布尔 / 嵌套值，值结束（遇到同层的逗号或右括号）时返回 True"""
+        if self._in_string:
+            if self._escape is not None:
+                self._escape = None
+            elif ch == "\\":
+                self._escape = ""
+            elif ch == '"':
+                self._in_string = False
+        elif ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            if self._depth == 0:
+                return True
+            self._depth -= 1
+        elif ch == "," and self._depth == 0:
+            return True
+        self._buf.append(ch)
+        return False
+
+    def _decoded(self) -> str:
+        # \uXXXX 代理对逐个解码后在这里合并
+        text = "".join(self._buf)
+        try:
+            return text.encode("utf-16", "surrogatepass").decode("utf-16")
+        except UnicodeError:
+            return text
+
+
+def _iter_responses(resp):
+    """流式调用返回响应的迭代器；非流式调用（或测试替身）只有一个响应对象"""
+    if hasattr(resp, "status_code"):
+        yield resp
+    else:
+        yield from resp
+
 
 class LLMInterface:
     """
@@ -23,7 +470,10 @@ class LLMInterface:
     C. SQL 生成
     """
 
-    def __init__(self):
+    def __init__(self, cache: Optional[LLMResponseCache] = None):
+        # 模型响应缓存（默认进程内共享）
+        self.cache = cache or get_response_cache()
+
         # 数据库字段白名单（严格）
         self.table = "students"
         self.fields = {
@@ -50,7 +500,14 @@ class LLMInterface:
     # =====================================================
     # 主入口
     # =====================================================
-    def handle(self, text: str, context: Optional[str] = None, pending: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def handle(
+        self,
+        text: str,
+        context: Optional[str] = None,
+        pending: Optional[Dict[str, Any]] = None,
+        on_message: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """on_message: 流式接收 chat / ask 回复时以已到达的文本回调，用于界面逐字显示"""
         text = text.strip()
         
         # ---------- 二次确认流程 ----------
@@ -74,66 +531,19 @@ class LLMInterface:
         except:
             colleges = []
             majors = []
+        # 表结构与取值目录的指纹：学院 / 专业变化后旧的缓存响应自然失效
+        schema = fingerprint(sorted(self.fields), colleges, majors)
 
-        # 构造 Prompt
-        prompt = f"""
-你是一个智能学生信息管理助手。请根据用户输入和上下文，判断用户意图并生成相应的操作。
+        # 构造 Prompt（取值目录按问题裁剪）
+        prompt, kept = PRIMARY_PROMPT.render(text, context, {"学院列表": colleges, "专业列表": majors})
 
-数据库表结构：
-students (
-    id INTEGER PRIMARY KEY,
-    student_id TEXT (学号),
-    name TEXT (姓名),
-    class_name TEXT (班级),
-    college TEXT (学院),
-    major TEXT (专业),
-    grade INTEGER (年级),
-    gender TEXT (性别),
-    phone TEXT (手机号)
-)
-
-数据库现有数据参考：
-学院列表: {colleges}
-专业列表: {majors}
-
-用户输入: "{text}"
-上下文: "{context if context else ''}"
-
-请以 JSON 格式返回结果，不要包含 Markdown 格式标记（如 ```json）：
-{{
-    "type": "sql" | "chat" | "ask" | "boolean_check",
-    // sql: 普通查询; chat: 闲聊/上下文回顾; ask: 追问; boolean_check: 是非判断(如"张三是男生吗")
-    
-    "sql": "SELECT ...",             // type="sql" 或 "boolean_check" 时需要。
-    "response_type": "count" | "select", // type="sql" 时需要。
-    "message": "...",                // type="chat" 或 "ask" 时需要。
-    "expected_value": "..."          // type="boolean_check" 时需要。用户预期的值(如"男")。
-}}
-
-注意：
-1. 如果用户询问之前的对话内容（如“我刚才问了什么”、“重复一遍”），请务必根据【上下文】中的信息进行回答，并将 type 设为 "chat"。
-2. 如果用户问“统计学院人数”或“各学院人数”，请使用 GROUP BY college。同理适用于专业、班级等。
-3. 如果用户问“张三是男生吗”，请返回 type="boolean_check"，生成查询性别的 SQL，并将 "男" 放入 expected_value。
-4. 如果用户只说“统计人数”且未指定维度，请返回 type="ask"，并在 message 中列出具体的学院或专业供用户选择（参考上面的列表）。
-5. 如果用户请求修改/删除/添加，请生成对应的 UPDATE/DELETE/INSERT 语句，并将 type 设为 "sql"。
-6. 模糊查询请使用 LIKE。
-7. 确保 SQL 语法正确。
-"""
+        # 流式接收时：SQL 一完整即后台预执行，message 逐段回调
+        prefetched: Dict[str, Tuple[tuple, Future]] = {}
+        on_update = self._stream_handler(prefetched, on_message)
         
         try:
-            # 调用 DashScope Qwen 模型
-            resp = dashscope.Generation.call(
-                model=dashscope.Generation.Models.qwen_turbo,
-                prompt=prompt,
-                result_format='message'
-            )
-            
-            if resp.status_code == 200:
-                content = resp.output.choices[0].message.content
-                # 清理可能的 Markdown 标记
-                content = content.replace("```json", "").replace("```", "").strip()
-                result = json.loads(content)
-                
+            result = self._call_llm(prompt, self.cache.make_key(text, schema, kept, PRIMARY_PROMPT.variant), on_update)
+            if result is not None:
                 if result["type"] == "sql":
                     self._validate_sql(result["sql"])
                     
@@ -150,7 +560,7 @@ students (
                                 
                                 # 查询当前值
                                 check_sql = f"SELECT * FROM students {where_clause}"
-                                current_df = query_df(check_sql)
+                                current_df = query_guarded(check_sql, max_rows=1).to_pandas()
                                 
                                 if not current_df.empty:
                                     # 尝试提取被修改的字段名
@@ -170,25 +580,26 @@ students (
                             "message": f"⚠️ **高风险操作确认**{context_msg}\n\n您即将执行以下数据库修改操作：\n```sql\n{result['sql']}\n```\n\n请回复 **“是”** 确认执行，或回复 **“否”** 取消。",
                             "pending": {
                                 "intent": "execute_modify",
-                                "sql": result["sql"]
+                                "sql": result["sql"],
+                                "fingerprint": sql_fingerprint(result["sql"])
                             }
                         }
 
-                    return {
-                        "type": "sql",
-                        "sql": result["sql"],
-                        "response_type": result.get("response_type", "select"),
-                        "explain": f"🤖 已为您执行查询：\n`{result['sql']}`"
-                    }
+                    return self._attach_prefetch(self._sql_result(
+                        result["sql"],
+                        result.get("response_type", "select"),
+                        f"🤖 已为您执行查询：\n`{result['sql']}`"
+                    ), prefetched)
                 elif result["type"] == "boolean_check":
-                    # 内部执行 SQL 并进行判断
+                    # 内部执行 SQL 并进行判断（流式接收时已在后台开始执行）
                     self._validate_sql(result["sql"])
                     try:
-                        df = query_df(result["sql"])
+                        future = self._take_prefetch(prefetched, result["sql"], "boolean")
+                        df = future.result() if future else query_guarded(result["sql"], max_rows=1)
                         if df.empty:
                             return {"type": "chat", "message": "⚠️ 未找到相关数据，无法判断。"}
                         
-                        actual_value = str(df.iloc[0, 0])
+                        actual_value = str(df.scalar())
                         expected = str(result.get("expected_value", ""))
                         
                         # 简单包含匹配
@@ -212,70 +623,24 @@ students (
                         "message": result["message"],
                         "pending": None
                     }
-            else:
-                print(f"LLM Error: {resp}")
         except Exception as e:
             print(f"LLM Exception: {e}")
             pass
 
         # ---------- 回退：原有规则逻辑 (作为兜底) ----------
-        prompt = f"""
-你是一个智能学生信息管理助手。请根据用户输入和上下文，判断用户意图并生成相应的操作。
-
-数据库表结构：
-students (
-    id INTEGER PRIMARY KEY,
-    student_id TEXT (学号),
-    name TEXT (姓名),
-    class_name TEXT (班级),
-    college TEXT (学院),
-    major TEXT (专业),
-    grade INTEGER (年级),
-    gender TEXT (性别),
-    phone TEXT (手机号)
-)
-
-用户输入: "{text}"
-上下文: "{context if context else ''}"
-
-请以 JSON 格式返回结果，不要包含 Markdown 格式标记（如 ```json）：
-{{
-    "type": "sql" | "chat" | "ask",  // sql: 需要查询数据库; chat: 普通闲聊/上下文回顾; ask: 需要用户补充信息
-    "sql": "SELECT ...",             // 仅当 type="sql" 时需要。请生成标准的 SQLite 查询语句。
-    "response_type": "count" | "select", // 仅当 type="sql" 时需要。count: 统计类; select: 明细类
-    "message": "..."                 // 仅当 type="chat" 或 "ask" 时需要。
-}}
-
-注意：
-1. 如果用户询问之前的对话内容（如“我刚才问了什么”），请务必根据【上下文】中的信息进行回答，并将 type 设为 "chat"。
-2. 如果用户问“张三是男生吗”，请生成查询性别的 SQL，不要直接回答。
-3. 如果用户问“一共有几个专业”，请使用 SELECT COUNT(DISTINCT major)...
-4. 模糊查询请使用 LIKE。
-5. 确保 SQL 语法正确，字段名符合表结构。
-"""
+        prompt, kept = FALLBACK_PROMPT.render(text, context)
         
+        self._discard_prefetch(prefetched)
         try:
-            # 调用 DashScope Qwen 模型
-            resp = dashscope.Generation.call(
-                model=dashscope.Generation.Models.qwen_turbo,
-                prompt=prompt,
-                result_format='message'  # 确保返回格式兼容
-            )
-            
-            if resp.status_code == 200:
-                content = resp.output.choices[0].message.content
-                # 清理可能的 Markdown 标记
-                content = content.replace("```json", "").replace("```", "").strip()
-                result = json.loads(content)
-                
+            result = self._call_llm(prompt, self.cache.make_key(text, schema, kept, FALLBACK_PROMPT.variant), on_update)
+            if result is not None:
                 if result["type"] == "sql":
                     self._validate_sql(result["sql"])
-                    return {
-                        "type": "sql",
-                        "sql": result["sql"],
-                        "response_type": result.get("response_type", "select"),
-                        "explain": f"🤖 已为您执行查询：\n`{result['sql']}`"
-                    }
+                    return self._attach_prefetch(self._sql_result(
+                        result["sql"],
+                        result.get("response_type", "select"),
+                        f"🤖 已为您执行查询：\n`{result['sql']}`"
+                    ), prefetched)
                 elif result["type"] == "chat":
                     return {
                         "type": "chat",
@@ -287,14 +652,13 @@ students (
                         "message": result["message"],
                         "pending": None
                     }
-            else:
-                # LLM 调用失败，回退到规则逻辑
-                print(f"LLM Error: {resp}")
         except Exception as e:
             print(f"LLM Exception: {e}")
             # 出错时回退到规则逻辑
             pass
 
+        self._discard_prefetch(prefetched)
+
         # ---------- 回退：原有规则逻辑 (作为兜底) ----------
         # 如果 LLM 失败，继续使用原来的逻辑
         original_text = text  # 保留原始输入用于展示
@@ -321,38 +685,139 @@ students (
 
         self._validate_sql(sql)
 
-        return {
-            "type": "sql",
-            "sql": sql,
-            "response_type": response_type,
-            "explain": self._explain(original_text, plan, response_type)
-        }
+        return self._sql_result(sql, response_type, self._explain(original_text, plan, response_type))
+
+    def _call_llm(
+        self,
+        prompt: str,
+        cache_key: str,
+        on_update: Optional[Callable[[StreamingJSONParser, List[str]], None]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        调用 DashScope Qwen 模型并解析 JSON，调用失败返回 None。
+        相同缓存键直接复用上次的响应；只缓存能解析且 SQL 通过校验的响应。
+        流式接收时每段输出后以 (解析器, 本段完整的字段) 回调 on_update；最终结果仍以完整文本解析为准。
+        """
+        content = self.cache.get(cache_key)
+        if content is not None:
+            return json.loads(content)
+
+        responses = dashscope.Generation.call(
+            model=dashscope.Generation.Models.qwen_turbo,
+            prompt=prompt,
+            result_format='message',
+            stream=LLM_STREAM,
+            incremental_output=LLM_STREAM,
+        )
+        parser = StreamingJSONParser()
+        for resp in _iter_responses(responses):
+            if resp.status_code != 200:
+                print(f"LLM Error: {resp}")
+                return None
+            completed = parser.feed(resp.output.choices[0].message.content or "")
+            if on_update:
+                on_update(parser, completed)
+        content = parser.text
+        # 清理可能的 Markdown 标记
+        content = content.replace("```json", "").replace("```", "").strip()
+        result = json.loads(content)
+        if result.get("type") in ("sql", "boolean_check"):
+            self._validate_sql(result["sql"])
+        if result.get("type") in ("sql", "boolean_check", "chat", "ask"):
+            self.cache.put(cache_key, content)
+        return result
+
+    def _stream_handler(self, prefetched: Dict[str, Tuple[tuple, Future]], on_message: Optional[Callable[[str], None]]):
+        """
+        流式解析回调：只读查询的执行参数确定后提交后台预执行；chat / ask 的 message 逐段转发。
+        type="sql" 需等 response_type 也到达（决定是否走分析引擎），Prompt 中它排在 sql 之前。
+        """
+        shown = {"message": None}
+
+        def on_update(parser: StreamingJSONParser, completed: List[str]):
+            fields = parser.fields
+            kind = fields.get("type")
+            if {"sql", "response_type"} & set(completed) and "sql" in fields:
+                if kind == "boolean_check" and "sql" in completed:
+                    self._start_prefetch(prefetched, fields["sql"], "boolean")
+                elif kind == "sql" and "response_type" in fields:
+                    self._start_prefetch(prefetched, fields["sql"], self._query_mode(fields["response_type"]))
+            if on_message and kind in ("chat", "ask"):
+                message = parser.fields.get("message", parser.partial.get("message"))
+                if message and message != shown["message"]:
+                    shown["message"] = message
+                    on_message(message)
+
+        return on_update
+
+    @staticmethod
+    def _query_mode(response_type: Any) -> str:
+        """界面执行查询的方式：统计类走分析引擎（analytics=True），其余为明细查询"""
+        return "count" if response_type == "count" else "select"
+
+    def _start_prefetch(self, prefetched: Dict[str, Tuple[tuple, Future]], sql: Any, mode: str):
+        if not isinstance(sql, str) or not sql.lower().strip().startswith("select"):
+            return
+        try:
+            self._validate_sql(sql)
+        except RuntimeError:
+            return
+        if mode == "boolean":
+            future = _prefetch_executor().submit(query_guarded, sql, max_rows=1)
+        else:
+            # 与界面执行 result["sql"] 时的参数一致；最终结果的 SQL 或方式不同时预取结果作废
+            future = _prefetch_executor().submit(query_guarded, sql, analytics=mode == "count")
+        self._discard_prefetch(prefetched)
+        prefetched["sql"] = ((sql, mode), future)
+
+    @staticmethod
+    def _take_prefetch(prefetched: Dict[str, Tuple[tuple, Future]], sql: str, mode: str) -> Optional[Future]:
+        entry = prefetched.pop("sql", None)
+        if entry is None:
+            return None
+        if entry[0] != (sql, mode):
+            entry[1].cancel()
+            return None
+        return entry[1]
+
+    @staticmethod
+    def _discard_prefetch(prefetched: Dict[str, Tuple[tuple, Future]]):
+        entry = prefetched.pop("sql", None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def _attach_prefetch(self, result: Dict[str, Any], prefetched: Dict[str, Tuple[tuple, Future]]) -> Dict[str, Any]:
+        """结果附带后台预执行的 Future（prefetch），界面取其结果即可，无需再次查询"""
+        future = self._take_prefetch(prefetched, result["sql"], self._query_mode(result.get("response_type")))
+        if future is not None:
+            result["prefetch"] = future
+        return result
 
     # =====================================================
     # A. 意图识别（修复重点）
     # =====================================================
     def _detect_intent(self, text: str) -> str:
+        hits = keyword_hits(text)
+
         # 存在性检查 / Boolean
-        if "有" in text and "吗" in text: # e.g. 有张三这个人吗
-            return "boolean"
-        if "是" in text and "吗" in text: # e.g. 张三是男生吗
+        if "question" in hits and ("has" in hits or "is" in hits): # e.g. 有张三这个人吗 / 张三是男生吗
             return "boolean"
 
         # 优先匹配统计意图 (避免 "查询人数" 被误判为 select)
-        if any(k in text for k in ["统计", "人数", "多少"]):
+        if "count" in hits:
             return "count"
 
         # 明确数据库操作
-        if any(k in text for k in ["查询", "查一下", "查看", "搜索", "找"]):
-            if any(k in text for k in ["和", "或", "且"]):
+        if "select" in hits:
+            if "conjunction" in hits:
                 return "complex_select"
             return "select"
         
-        if any(k in text for k in ["新增", "添加", "插入"]):
+        if "insert" in hits:
             return "insert"
-        if any(k in text for k in ["修改", "更新"]):
+        if "update" in hits:
             return "update"
-        if any(k in text for k in ["删除", "移除"]):
+        if "delete" in hits:
             return "delete"
 
         # 兜底：chat
@@ -363,13 +828,13 @@ students (
     # =====================================================
     def _chat_reply(self, text: str) -> Optional[str]:
         """简单的规则回复，如果匹配不到返回 None"""
-        t = text.lower()
+        hits = keyword_hits(text)
 
         # 如果包含具体操作指令，则不拦截，交给后续逻辑处理
-        if any(k in t for k in ["查", "统计", "多少", "是", "修改", "删除", "增加", "班", "级", "学院", "专业"]):
+        if "operation" in hits:
             return None
 
-        if any(k in t for k in ["你好", "您好", "嗨", "hello"]):
+        if "greeting" in hits:
             return (
                 "👋 你好！我是学生信息管理助手。\n\n"
                 "我可以帮你：\n"
@@ -378,7 +843,7 @@ students (
                 "• 统计人数（如：统计计算机学院人数）"
             )
 
-        if any(k in t for k in ["你能干什么", "会什么", "功能", "可以做什么"]):
+        if "capability" in hits:
             return (
                 "🤖 我主要负责学生信息管理相关任务，包括：\n\n"
                 "📌 学生信息查询\n"
@@ -387,7 +852,7 @@ students (
                 "你可以直接试试：`查询张三信息`"
             )
 
-        if any(k in t for k in ["怎么用", "帮助"]):
+        if "help" in hits:
             return (
                 "📖 使用示例：\n\n"
                 "• 查询张三信息\n"
@@ -396,7 +861,7 @@ students (
                 "• 一共有几个专业"
             )
 
-        if any(k in t for k in ["谢谢", "感谢"]):
+        if "thanks" in hits:
             return "😊 不客气！有需要随时找我。"
 
         # 移除兜底回复，交给 LLM 处理
@@ -408,7 +873,7 @@ students (
     def _plan(self, text: str, intent: str) -> Dict[str, Any]:
         # --- 统计缺参反问 ---
         if intent == "count":
-            if not any(k in text for k in ["学院", "专业", "性别", "班", "级", "总", "全部"]):
+            if "count_dimension" not in keyword_hits(text):
                 # 动态获取列表以引导用户
                 try:
                     colleges = [str(c) for c in get_distinct_values("college") if c]
@@ -470,10 +935,10 @@ students (
         if plan["type"] == "count":
             # --- 1. 聚合统计 (GROUP BY) ---
             if "各学院" in t or ("学院" in t and "人数" in t and not any(c in t for c in get_distinct_values("college"))):
-                return ("SELECT college, COUNT(*) as count FROM students GROUP BY college", "select")
+                return ("SELECT college, COUNT(*) as count FROM students GROUP BY college", "count")
             
             if "各专业" in t or ("专业" in t and "人数" in t and "统计" in t and not re.search(r"统计(.+?)专业", t)):
-                 return ("SELECT major, COUNT(*) as count FROM students GROUP BY major", "select")
+                 return ("SELECT major, COUNT(*) as count FROM students GROUP BY major", "count")
 
             if "各班级" in t or ("班" in t and "人数" in t and "统计" in t):
                  # 检查是否指定了具体班级 (e.g. 软件2301班)
@@ -483,12 +948,12 @@ students (
                  is_specific = m and "班级" not in m.group(1)
                  
                  if (not is_specific) or "各" in t:
-                     return ("SELECT class_name, COUNT(*) as count FROM students GROUP BY class_name", "select")
+                     return ("SELECT class_name, COUNT(*) as count FROM students GROUP BY class_name", "count")
 
             if "各年级" in t or ("级" in t and "人数" in t and "统计" in t):
                  m = re.search(r"(\d{4})", t)
                  if not m or "各" in t:
-                     return ("SELECT grade, COUNT(*) as count FROM students GROUP BY grade", "select")
+                     return ("SELECT grade, COUNT(*) as count FROM students GROUP BY grade", "count")
 
             # --- 2. 过滤统计 (WHERE) ---
             if "学院" in t:
@@ -544,12 +1009,8 @@ students (
                     # 排除 "班级" 这个词本身被匹配的情况
                     if class_name != "班级" and class_name.strip():
                         # --- 智能引导逻辑 ---
-                        # 1. 先查询数据库看有几个匹配项
-                        conn = get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute(f"SELECT DISTINCT class_name FROM students WHERE class_name LIKE '%{class_name}%'")
-                        matches = [row[0] for row in cursor.fetchall()]
-                        conn.close()
+                        # 1. 先在班级目录中看有几个匹配项
+                        matches = [c for c in get_distinct_values("class_name") if c and class_name in c]
 
                         if len(matches) == 0:
                             return {
@@ -608,8 +1069,7 @@ students (
                 m = re.search(r"有(.+)这个人吗", t) or re.search(r"有(.+)吗", t)
                 if m:
                     name = m.group(1).strip()
-                    sql = f"SELECT COUNT(*) FROM students WHERE name='{name}'"
-                    count = query_df(sql).iloc[0, 0]
+                    count = query_df("SELECT COUNT(*) FROM students WHERE name = ?", [name]).iloc[0, 0]
                     return {
                         "type": "chat",
                         "message": f"✅ 数据库中包含「{name}」的信息。" if count > 0 else f"❌ 数据库中没有找到「{name}」。"
@@ -622,9 +1082,8 @@ students (
                 value = value.strip()
                 
                 # 尝试查询该主语（假设是人名）
-                sql = f"SELECT * FROM students WHERE name='{subject}'"
                 try:
-                    df = query_df(sql)
+                    df = query_df("SELECT * FROM students WHERE name = ?", [subject])
                     if df.empty:
                         return {
                             "type": "chat",
@@ -792,7 +1251,10 @@ students (
             if t in affirmative:
                 # 执行 SQL
                 try:
-                    from database import execute_sql
+                    from database import QueryPlanError, check_query_plan, execute_sql
+                    report = check_query_plan(pending["sql"])
+                    if report["action"] == "reject":
+                        raise QueryPlanError(report["message"])
                     rowcount = execute_sql(pending["sql"])
                     return {"type": "chat", "message": f"✅ 操作成功，影响了 {rowcount} 行数据。"}
                 except Exception as e:
@@ -831,6 +1293,16 @@ students (
                 
         return text
 
+    def _sql_result(self, sql: str, response_type: str, explain: str) -> Dict[str, Any]:
+        # sql 保留字面量便于展示与历史恢复；执行时由 query_df 参数化，fingerprint 可作为缓存键
+        return {
+            "type": "sql",
+            "sql": sql,
+            "response_type": response_type,
+            "explain": explain,
+            "fingerprint": sql_fingerprint(sql),
+        }
+
     def _explain(self, text: str, plan: Dict[str, Any], response_type: str) -> str:
         if response_type == "count":
             return f"📊 正在统计「{text}」的学生人数，结果如下："
@@ -1,14 +1,23 @@
+import asyncio
+import json
 import os
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
+import numpy as np
 import pandas as pd
 
 import database
-from llm_interface import LLMInterface
+from llm_cache import LLMResponseCache
+import llm_interface
+from llm_interface import KEYWORD_GROUPS, KeywordMatcher, LLMInterface
 
 
 class _DummyResponse:
@@ -19,6 +28,25 @@ class _DummyResponse:
             message = type("obj", (), {"content": ""})
 
 
+def _json_response(payload):
+    message = type("obj", (), {"content": json.dumps(payload, ensure_ascii=False)})
+    choice = type("obj", (), {"message": message})
+    return type("obj", (), {"status_code": 200, "output": type("obj", (), {"choices": [choice]})})
+
+
+def _with_monkeypatch(fn):
+    """脚本方式运行时为使用 monkeypatch 夹具的测试提供 MonkeyPatch，结束后撤销"""
+    def run():
+        import pytest
+
+        patcher = pytest.MonkeyPatch()
+        try:
+            fn(patcher)
+        finally:
+            patcher.undo()
+    return run
+
+
 def _run_test(name, fn):
     try:
         fn()
@@ -89,10 +117,834 @@ def test_llm_fallback_rules():
         raise AssertionError("Expected UPDATE SQL for modify command")
 
 
+def test_connection_pool_reuse():
+    conn = database.get_connection()
+    try:
+        inner = database.get_connection()
+        if inner is not conn:
+            raise AssertionError("Nested acquire in one thread should reuse the connection")
+        inner.close()
+        conn.execute("SELECT 1")
+    finally:
+        conn.close()
+
+    again = database.get_connection()
+    try:
+        if again is not conn:
+            raise AssertionError("Released connection should be reused by the next acquire")
+    finally:
+        again.close()
+
+
+def test_wal_journal_mode():
+    database.init_db()
+    conn = database.get_connection()
+    try:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+    if mode.lower() != "wal":
+        raise AssertionError(f"Expected WAL journal mode, got {mode}")
+
+
+def test_indexes_and_advisor():
+    database.init_db()
+    conn = database.get_connection()
+    try:
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(students)")}
+    finally:
+        conn.close()
+    missing = set(database.STUDENT_INDEXES) - indexes
+    if missing:
+        raise AssertionError(f"Missing indexes: {missing}")
+
+    suggestions = database.advise_indexes(["SELECT * FROM students WHERE phone = '13800000000'"])
+    if [s["columns"] for s in suggestions] != [["phone"]]:
+        raise AssertionError(f"Unexpected index suggestions: {suggestions}")
+
+
+def test_substring_search_index():
+    database.init_db()
+    row_id = database.insert_student({"student_id": "FTS000001", "name": "测试欧阳子串", "class_name": "测试9901班"})
+    try:
+        if row_id not in database.query_students(name="欧阳子串")["id"].tolist():
+            raise AssertionError("Substring search did not find inserted student")
+        database.update_student_by_id(row_id, {"name": "测试司马子串"})
+        if not database.query_students(name="欧阳子串").empty:
+            raise AssertionError("Search index kept the old name after update")
+        if row_id not in database.query_students(name="司马子", class_name="9901")["id"].tolist():
+            raise AssertionError("Search index missed the updated name")
+    finally:
+        database.delete_student_by_id(row_id)
+    if not database.query_students(student_id="FTS000001").empty:
+        raise AssertionError("Search index kept a deleted student")
+
+
+def test_keyset_pagination():
+    full = database.query_students()
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = database.query_students_page(page_size=70, cursor=cursor)
+        seen.extend(page["id"].tolist())
+        if cursor is None:
+            break
+    if seen != full["id"].tolist():
+        raise AssertionError("Paging through all pages should match the full query")
+
+    total, exact = database.estimate_student_count()
+    if not exact or total != len(full):
+        raise AssertionError("Unfiltered count estimate should be exact")
+
+
+def test_streaming_query_chunks():
+    total = int(database.query_df("SELECT COUNT(*) AS count FROM students").iloc[0, 0])
+    chunks = list(database.iter_query("SELECT * FROM students", chunk_size=64))
+    if sum(len(c) for c in chunks) != total or any(len(c) > 64 for c in chunks):
+        raise AssertionError("Chunked iteration should cover every row in bounded chunks")
+
+    rows = next(database.iter_query("SELECT id, name FROM students", chunk_size=5, as_frame=False))
+    if len(rows) != 5 or not isinstance(rows[0], tuple):
+        raise AssertionError("Tuple mode should yield lists of row tuples")
+
+    import io
+    empty = io.StringIO()
+    if database.export_students_csv(empty, name="不存在的学生姓名") != 0 or \
+            empty.getvalue().strip() != ",".join(["id"] + database.STUDENT_FIELDS):
+        raise AssertionError(f"Empty export should still write the header: {empty.getvalue()!r}")
+    full = io.StringIO()
+    if database.export_students_csv(full, chunk_size=64) != total or len(pd.read_csv(io.StringIO(full.getvalue()))) != total:
+        raise AssertionError("Chunked export should write every row under one header")
+
+
+def test_bulk_import_csv():
+    import io
+
+    database.init_db()
+    buffer = io.StringIO(
+        "学号,姓名,性别,年级\n"
+        "BULK000001,批量导入甲,男,2021\n"
+        "BULK000001,批量导入甲,男,2021\n"
+        ",缺学号,女,2022\n"
+        "BULK000002,批量导入乙,未知,二零二二\n"
+    )
+    buffer.name = "roster.csv"
+    try:
+        report = database.bulk_import(buffer)
+        if (report["inserted"], report["duplicates"], report["invalid"]) != (1, 1, 2):
+            raise AssertionError(f"Unexpected import report: {report}")
+        found = database.query_students(name="批量导入")
+        if found["student_id"].tolist() != ["BULK000001"]:
+            raise AssertionError("Imported row should be searchable through the substring index")
+    finally:
+        database.execute_sql("DELETE FROM students WHERE student_id LIKE 'BULK%'")
+
+
+def test_bulk_import_sql_script():
+    import io
+
+    database.init_db()
+    before = database.get_summary_counts()["total"]
+    scratch = os.path.join(tempfile.mkdtemp(), "created.db")
+    live = os.path.abspath(database.DB_PATH).replace("'", "''")
+    buffer = io.StringIO(
+        f"ATTACH DATABASE '{live}' AS live;\n"
+        "DELETE FROM live.students;\n"
+        f"ATTACH DATABASE '{scratch}' AS other;\n"
+        "PRAGMA writable_schema = ON;\n"
+        "INSERT INTO students (student_id, name, gender) VALUES ('BULKSQL01', '脚本导入; 甲', '男');\n"
+    )
+    buffer.name = "dump.sql"
+    try:
+        report = database.bulk_import(buffer)
+        if report["inserted"] != 1 or database.get_summary_counts()["total"] != before + 1:
+            raise AssertionError(f"Only the INSERT INTO students statement should run: {report}")
+        if os.path.exists(scratch):
+            raise AssertionError("ATTACH in an uploaded script must not create files")
+    finally:
+        database.execute_sql("DELETE FROM students WHERE student_id LIKE 'BULKSQL%'")
+
+
+def test_synthetic_data_deterministic():
+    single = list(database.iter_synthetic_records(1200, seed=3, batch_size=500))
+    parallel = list(database.iter_synthetic_records(1200, seed=3, workers=2, batch_size=500))
+    if single != parallel:
+        raise AssertionError("Same seed should produce the same data regardless of workers")
+    if sum(len(chunk) for chunk in single) != 1200:
+        raise AssertionError("Generator should produce exactly the requested record count")
+    if len({row[0] for chunk in single for row in chunk}) != 1200:
+        raise AssertionError("Generated student ids should be unique")
+    other = next(database.iter_synthetic_records(500, seed=4, batch_size=500))
+    if other == single[0]:
+        raise AssertionError("Different seeds should produce different data")
+
+
+def test_distinct_value_catalog():
+    database.init_db()
+    colleges = database.get_distinct_values("college")
+    if database.get_distinct_values("college") != colleges:
+        raise AssertionError("Catalog should return stable cached values")
+
+    row_id = database.insert_student({"student_id": "CAT000001", "name": "目录测试", "college": "目录测试学院", "major": "目录测试专业"})
+    try:
+        if "目录测试学院" not in database.get_distinct_values("college"):
+            raise AssertionError("Catalog should be invalidated after an insert")
+        if database.get_majors_by_college(["目录测试学院"]) != ["目录测试专业"]:
+            raise AssertionError("College -> major mapping should include the new major")
+        counts = dict(database.get_value_counts("college"))
+        if counts.get("目录测试学院") != 1:
+            raise AssertionError("Value counts should include the new college")
+    finally:
+        database.delete_student_by_id(row_id)
+    if "目录测试学院" in database.get_distinct_values("college"):
+        raise AssertionError("Catalog should be invalidated after a delete")
+
+
+def test_student_stats_triggers():
+    database.init_db()
+
+    def assert_consistent():
+        for dim in database.STATS_DIMS:
+            expected = dict(database.get_value_counts(dim))
+            actual = {
+                (None if pd.isna(value) else value): count
+                for value, count in database.get_dimension_counts(dim).itertuples(index=False, name=None)
+            }
+            if actual != expected:
+                raise AssertionError(f"student_stats out of sync for {dim}")
+
+    row_id = database.insert_student({"student_id": "STA000001", "name": "统计测试", "college": "统计测试学院", "grade": "2024"})
+    try:
+        assert_consistent()
+        database.update_student_by_id(row_id, {"college": "统计测试学院二", "grade": "2025"})
+        assert_consistent()
+        if database.get_summary_counts()["total"] != database.query_df("SELECT COUNT(*) AS c FROM students")["c"][0]:
+            raise AssertionError("Summary total should match COUNT(*)")
+    finally:
+        database.delete_student_by_id(row_id)
+    assert_consistent()
+    if "统计测试学院二" in set(database.get_dimension_counts("college")["college"]):
+        raise AssertionError("Zero-count values should not be reported")
+
+
+def test_bulk_update_delete():
+    database.init_db()
+    ids = [
+        database.insert_student({"student_id": f"BLK00000{i}", "name": f"批量测试{i}", "class_name": "批量测试班", "grade": 1990})
+        for i in range(3)
+    ]
+    try:
+        outcomes = database.update_students({"class_name": "批量测试新班"}, row_ids=ids[:2] + [-1])
+        if outcomes != {ids[0]: "updated", ids[1]: "updated", -1: "not_found"}:
+            raise AssertionError(f"Unexpected bulk update outcomes: {outcomes}")
+        moved = set(database.query_students(class_name="批量测试新班")["id"])
+        if moved != set(ids[:2]):
+            raise AssertionError("Bulk update should only touch the selected rows")
+
+        try:
+            database.delete_students()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Bulk delete without ids or filters should be rejected")
+
+        outcomes = database.delete_students(grade=1990)
+        if outcomes != {row_id: "deleted" for row_id in ids}:
+            raise AssertionError(f"Unexpected bulk delete outcomes: {outcomes}")
+        if database.delete_students(row_ids=ids) != {row_id: "not_found" for row_id in ids}:
+            raise AssertionError("Deleted rows should be reported as not found")
+    finally:
+        database.delete_students(row_ids=ids)
+
+
+def test_sql_parameterization():
+    sql, params = database.normalize_sql(
+        "SELECT name, 1 FROM students WHERE name='O''Brien' AND grade IN (2021, 2022) ORDER BY 2 LIMIT 10"
+    )
+    if sql != "SELECT name, 1 FROM students WHERE name=? AND grade IN (?, ?) ORDER BY 2 LIMIT ?":
+        raise AssertionError(f"Unexpected normalized SQL: {sql}")
+    if params != ["O'Brien", 2021, 2022, 10]:
+        raise AssertionError(f"Unexpected extracted params: {params}")
+
+    sql, params = database.normalize_sql("SELECT * FROM students WHERE id = ? AND college = 'x'", [5])
+    if params != [5, "x"]:
+        raise AssertionError("Existing placeholders should keep their position")
+
+    a = database.sql_fingerprint("SELECT COUNT(*) FROM students WHERE college='计算机学院'")
+    b = database.sql_fingerprint("select count(*) from students\n where college = '自动化学院';")
+    c = database.sql_fingerprint("SELECT COUNT(*) FROM students WHERE major='计算机学院'")
+    if a != b or a == c:
+        raise AssertionError("Fingerprint should ignore literals, case and whitespace only")
+
+    database.init_db()
+    database.clear_sql_log()
+    inline = database.query_df("SELECT COUNT(*) AS count FROM students WHERE gender='男'")
+    bound = database.query_df("SELECT COUNT(*) AS count FROM students WHERE gender = ?", ["男"])
+    if inline["count"][0] != bound["count"][0]:
+        raise AssertionError("Parameterized execution should return the same result")
+    if database.get_sql_log()[0] != ("SELECT COUNT(*) AS count FROM students WHERE gender=?", ("男",)):
+        raise AssertionError("query_df should log the parameterized statement")
+
+
+def test_columnar_results():
+    database.init_db()
+    sql = "SELECT college, gender, COUNT(*) AS count FROM students GROUP BY college, gender ORDER BY college, gender"
+    res = database.query_columnar(sql)
+    expected = database.query_df(sql)
+    if res.shape != expected.shape or res.columns != list(expected.columns):
+        raise AssertionError("Columnar result should match query_df shape and columns")
+    if not res.is_categorical("college") or res.codes("college").dtype != np.int32:
+        raise AssertionError("College should be dictionary-encoded")
+    if res.data["count"].dtype != np.int64 or not res.is_numeric("count"):
+        raise AssertionError("Counts should be an int64 array")
+    if list(res.column("college")) != list(expected["college"]):
+        raise AssertionError("Decoded categorical column should match query_df")
+    frame = res.to_pandas()
+    if not isinstance(frame["gender"].dtype, pd.CategoricalDtype) or list(frame["count"]) != list(expected["count"]):
+        raise AssertionError("to_pandas should keep categoricals and values")
+
+    total = database.query_columnar("SELECT COUNT(*) AS count FROM students").scalar()
+    if total != expected["count"].sum():
+        raise AssertionError("scalar() should return the single aggregate value")
+    if not database.query_columnar("SELECT college FROM students WHERE 0").empty:
+        raise AssertionError("Empty result should report empty")
+
+
+def test_analytics_backend():
+    database.init_db()
+    sql = "SELECT major, COUNT(*) AS count FROM students GROUP BY major ORDER BY count DESC, major"
+    expected = database.query_columnar(sql)
+    old_min_rows = database.ANALYTICS_MIN_ROWS
+    database.ANALYTICS_MIN_ROWS = 0
+    try:
+        if database.duckdb is None:
+            if database.analytics_backend() != "sqlite":
+                raise AssertionError("Without duckdb the analytics path should fall back to SQLite")
+        elif not database.refresh_analytics_snapshot():
+            raise AssertionError("Snapshot should be current right after a refresh")
+
+        result = database.query_analytics(sql)
+        if list(result.column("major")) != list(expected.column("major")) or \
+                list(result.data["count"]) != list(expected.data["count"]):
+            raise AssertionError("Analytics backend should return the same aggregate as SQLite")
+
+        # 与 SQLite 语义不同的写法（整数除法、LIKE 大小写、日期函数）不交给 DuckDB
+        for dialect_sql in (
+            "SELECT SUM(grade) / 2 FROM students",
+            "SELECT COUNT(*) FROM students WHERE name LIKE '%a%'",
+            "SELECT strftime('%Y', 'now'), COUNT(*) FROM students",
+        ):
+            if database._analytics_compatible(database.normalize_sql(dialect_sql)[0]):
+                raise AssertionError(f"Dialect-sensitive SQL should stay on SQLite: {dialect_sql}")
+        if not database._analytics_compatible(database.normalize_sql(sql)[0]):
+            raise AssertionError("Plain GROUP BY counts should be eligible for the analytics engine")
+        with_null = "SELECT college, COUNT(*) AS count FROM students GROUP BY college ORDER BY college"
+        if list(database.query_analytics(with_null).column("college")) != list(database.query_columnar(with_null).column("college")):
+            raise AssertionError("NULL ordering should match SQLite")
+
+        # 写入后快照失效，重建完成前仍需返回最新结果
+        row_id = database.insert_student({"student_id": "ANA000001", "name": "分析测试", "major": "分析测试专业"})
+        try:
+            result = database.query_analytics("SELECT COUNT(*) AS count FROM students WHERE major = '分析测试专业'")
+            if result.scalar() != 1:
+                raise AssertionError("Analytics queries should not serve a stale snapshot")
+        finally:
+            database.delete_student_by_id(row_id)
+    finally:
+        database.ANALYTICS_MIN_ROWS = old_min_rows
+
+
+def test_read_replica():
+    database.init_db()
+    database.READ_REPLICA = True
+    try:
+        conn = database.get_read_connection()
+        try:
+            if not isinstance(conn._pool, database._ReplicaPool):
+                raise AssertionError("Reads should be served from the in-memory replica")
+            try:
+                conn.execute("DELETE FROM students WHERE id = -1")
+            except sqlite3.OperationalError:
+                pass
+            else:
+                raise AssertionError("Replica connections should be read-only")
+        finally:
+            conn.close()
+
+        row_id = database.insert_student({"student_id": "REP000001", "name": "副本测试"})
+        try:
+            if database.query_students(name="副本测试").empty:
+                raise AssertionError("Replica should be refreshed after insert_student")
+            database.execute_sql(f"UPDATE students SET name = '副本测试二' WHERE id = {row_id}")
+            if database.query_df("SELECT name FROM students WHERE id = ?", [row_id])["name"][0] != "副本测试二":
+                raise AssertionError("Replica should be refreshed after execute_sql")
+        finally:
+            database.delete_student_by_id(row_id)
+        if not database.query_students(student_id="REP000001").empty:
+            raise AssertionError("Replica should be refreshed after delete")
+    finally:
+        database.READ_REPLICA = False
+        database.close_replica()
+
+
+def test_data_version_cross_process():
+    database.init_db()
+    version = database.get_data_version()
+    if database.get_data_version() != version:
+        raise AssertionError("Data version should be stable without writes")
+    database.get_distinct_values("college")  # 预热取值目录
+
+    # 模拟另一个进程：独立连接直接写库，不经过本进程的写入路径
+    other = sqlite3.connect(database.DB_PATH)
+    try:
+        other.execute("INSERT INTO students (student_id, name, college) VALUES ('VER000001', '版本测试', '版本测试学院')")
+        other.commit()
+        changed = database.get_data_version()
+        if changed <= version:
+            raise AssertionError("External commits should advance the data version")
+        if "版本测试学院" not in database.get_distinct_values("college"):
+            raise AssertionError("Catalog should be invalidated by external writes")
+    finally:
+        other.execute("DELETE FROM students WHERE student_id = 'VER000001'")
+        other.commit()
+        other.close()
+    if database.get_data_version() <= changed:
+        raise AssertionError("Each external commit should advance the data version")
+
+
+def test_guarded_execution():
+    database.init_db()
+    total = database.query_columnar("SELECT COUNT(*) FROM students").scalar()
+
+    capped = database.query_guarded("SELECT * FROM students", max_rows=10)
+    if len(capped) != 10 or not capped.attrs.get("truncated"):
+        raise AssertionError("Row cap should truncate and flag the result")
+    if capped.to_pandas().attrs.get("max_rows") != 10:
+        raise AssertionError("Truncation metadata should carry over to pandas")
+    full = database.query_guarded("SELECT COUNT(*) AS count FROM students")
+    if full.attrs.get("truncated") or full.scalar() != total:
+        raise AssertionError("Small results should not be flagged as truncated")
+
+    # 放开计划检查上限，确保由步数预算中断
+    max_cost = database.PLAN_MAX_COST
+    database.PLAN_MAX_COST = float("inf")
+    try:
+        database.query_guarded(
+            "SELECT COUNT(*) FROM students a, students b, students c WHERE a.id + b.id + c.id = 3",
+            step_budget=100_000,
+        )
+    except database.QueryBudgetError:
+        pass
+    else:
+        raise AssertionError("A runaway join should be interrupted by the step budget")
+    finally:
+        database.PLAN_MAX_COST = max_cost
+
+    # 中断后连接仍可正常使用
+    if database.query_columnar("SELECT COUNT(*) FROM students").scalar() != total:
+        raise AssertionError("Connection should stay usable after an interrupt")
+
+
+def test_query_plan_gate():
+    database.init_db()
+    database.clear_plan_log()
+
+    point = database.check_query_plan("SELECT * FROM students WHERE id = 1")
+    if point["action"] != "ok" or point["rows"] != 1:
+        raise AssertionError(f"Primary key lookup should be cheap: {point}")
+
+    cross = database.check_query_plan("SELECT COUNT(*) FROM students a, students b WHERE a.id + b.id = 3")
+    if not any("笛卡尔积" in issue for issue in cross["issues"]):
+        raise AssertionError(f"Cross join should be flagged: {cross['issues']}")
+
+    limit = database.PLAN_AUTO_LIMIT
+    database.PLAN_AUTO_LIMIT = 1
+    try:
+        rewritten = database.query_guarded("SELECT name FROM students")
+        if rewritten.attrs["plan"]["action"] != "rewrite" or len(rewritten) != 1:
+            raise AssertionError("Unbounded detail query should get an automatic LIMIT")
+        grouped = database.check_query_plan("SELECT college, COUNT(*) FROM students GROUP BY college")
+        if grouped["action"] == "rewrite":
+            raise AssertionError("Aggregate queries should not be rewritten")
+    finally:
+        database.PLAN_AUTO_LIMIT = limit
+
+    max_cost = database.PLAN_MAX_COST
+    database.PLAN_MAX_COST = 10
+    try:
+        database.query_guarded("SELECT COUNT(*) FROM students a, students b WHERE a.id + b.id = 3")
+    except database.QueryPlanError:
+        pass
+    else:
+        raise AssertionError("Expensive plan should be rejected before execution")
+    finally:
+        database.PLAN_MAX_COST = max_cost
+
+    if not any(entry["issues"] for entry in database.get_plan_log()):
+        raise AssertionError("Plan log should record flagged plans")
+
+    # 跳跃扫描、表达式索引的约束与旧版本 "SCAN TABLE" 格式都要能估算
+    skip, _ = database._plan_loop_rows("SEARCH students USING INDEX idx (ANY(college) AND major=?)", 1000, {"major": 10})
+    old_issues = []
+    database._plan_cost([(2, 0, "SCAN TABLE students"), (3, 0, "SCAN TABLE student_stats")], 0, 1000, {}, old_issues)
+    if skip != 100 or old_issues != ["全表扫描：SCAN TABLE students"]:
+        raise AssertionError(f"Unexpected estimate for unusual plan details: {skip}, {old_issues}")
+
+
+def test_normalized_storage():
+    original = database.DB_PATH
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "normalized.db")
+    try:
+        database.init_db()
+        before = database.query_students()
+        major_counts = database.get_dimension_counts("major", order_by="value")
+        if not database.migrate_to_normalized():
+            raise AssertionError("Migration should convert a plain students table")
+
+        conn = database.get_connection()
+        try:
+            kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'students'").fetchone()[0]
+            colleges = conn.execute("SELECT COUNT(*) FROM colleges").fetchone()[0]
+        finally:
+            conn.close()
+        if kind != "view" or colleges != len(database.get_distinct_values("college")):
+            raise AssertionError("students should become a view over the dimension tables")
+        pd.testing.assert_frame_equal(before, database.query_students())
+
+        row_id = database.insert_student({
+            "student_id": "DICT0001", "name": "字典编码测试", "class_name": "字典9901班",
+            "college": "字典测试学院", "major": "字典测试专业", "grade": 2024, "gender": "女",
+        })
+        if database.query_students(college="字典测试学院")["id"].tolist() != [row_id]:
+            raise AssertionError("Inserted student should be found through the view")
+        if "字典测试学院" not in database.get_distinct_values("college"):
+            raise AssertionError("New dimension value missing from distinct values")
+
+        # 视图上的原生 SQL（大模型生成的语句）同样可写，且返回真实影响行数
+        if database.execute_sql("UPDATE students SET major = '字典改名专业' WHERE id = ?", [row_id]) != 1:
+            raise AssertionError("UPDATE through the view should report one row")
+        majors = dict(database.get_dimension_counts("major").values.tolist())
+        if majors.get("字典改名专业") != 1 or "字典测试专业" in majors:
+            raise AssertionError("Stats triggers should follow updates through the view")
+        if database.query_students(name="字典编码")["id"].tolist() != [row_id]:
+            raise AssertionError("Substring search should work on normalized storage")
+        if database.execute_sql("DELETE FROM students WHERE id = ?", [row_id]) != 1:
+            raise AssertionError("DELETE through the view should report one row")
+        pd.testing.assert_frame_equal(major_counts, database.get_dimension_counts("major", order_by="value"))
+    finally:
+        database.DB_PATH = original
+        database.init_db()
+
+
+def test_async_database():
+    database.init_db()
+
+    def borrowed_connections():
+        pool = database.get_pool()
+        return pool._size - len(pool._idle)
+
+    def reentrant_connection():
+        outer = database.get_connection()
+        try:
+            inner = database.get_connection()
+            inner.close()
+            time.sleep(0.02)  # 让并发调用分散到各个线程
+            return threading.get_ident(), inner is outer
+        finally:
+            outer.close()
+
+    def failing_write():
+        conn = database.get_connection()
+        conn.execute("UPDATE students SET phone = 'async-rollback' WHERE id = (SELECT MIN(id) FROM students)")
+        raise RuntimeError("write failed before commit")
+
+    async def scenario(db):
+        summary, colleges, students = await asyncio.gather(
+            db.get_summary_counts(),
+            db.get_dimension_counts("college"),
+            db.query_students(grade=2022),
+        )
+        if summary != database.get_summary_counts():
+            raise AssertionError("Async summary differs from the sync helper")
+        pd.testing.assert_frame_equal(colleges, database.get_dimension_counts("college"))
+        pd.testing.assert_frame_equal(students, database.query_students(grade=2022))
+
+        # 调用内借用可重入；调用结束后连接归还，空闲的工作线程不占用连接池
+        before = borrowed_connections()
+        pairs = await asyncio.gather(*(db.run(reentrant_connection) for _ in range(6)))
+        if len({thread_id for thread_id, _ in pairs}) > 2 or not all(same for _, same in pairs):
+            raise AssertionError(f"Calls should share one connection per call on at most 2 threads: {pairs}")
+        if borrowed_connections() != before:
+            raise AssertionError("Async workers should return connections after each call")
+
+        try:
+            await db.run(failing_write)
+        except RuntimeError:
+            pass
+        leftover = await db.query_columnar("SELECT COUNT(*) FROM students WHERE phone = 'async-rollback'")
+        if leftover.scalar() != 0:
+            raise AssertionError("Uncommitted work should be rolled back after a failed call")
+
+        row_id = await db.insert_student({"student_id": "ASYNC0001", "name": "异步测试"})
+        if await db.delete_student_by_id(row_id) != 1:
+            raise AssertionError("Async delete should report one row")
+
+    db = database.AsyncDatabase(workers=2)
+    try:
+        asyncio.run(scenario(db))
+    finally:
+        db.close()
+
+
+def test_group_commit_queue():
+    database.init_db()
+    writes = database.WriteQueue()
+    started, release = threading.Event(), threading.Event()
+    ids = []
+
+    def first_insert(conn, student):
+        # 写线程执行到这里时第一个请求已单独成批；放行前其余请求都在队列中累积
+        started.set()
+        release.wait(10)
+        return database._insert_student_on(conn, student)
+
+    try:
+        first = writes.submit(first_insert, {"student_id": "GCQ0000", "name": "组提交测试"})
+        if not started.wait(10):
+            raise AssertionError("Writer thread should pick up the first request")
+        queued = [writes.insert({"student_id": f"GCQ{i:04d}", "name": "组提交测试"}) for i in range(1, 21)]
+        failing = writes.submit(lambda conn: conn.execute("INSERT INTO no_such_table VALUES (1)"))
+        release.set()
+
+        ids = [first.result(timeout=10)] + [f.result(timeout=10) for f in queued]
+        if not isinstance(failing.exception(timeout=10), sqlite3.OperationalError):
+            raise AssertionError("A failing request should only fail its own future")
+        if writes.stats()["batches"] != 2 or ids != sorted(ids):
+            raise AssertionError(f"Queued writes should commit as one ordered batch: {writes.stats()}")
+        # Future 完成时写入已提交，提交方随即可读到
+        if len(database.query_students(student_id="GCQ")) != 21:
+            raise AssertionError("Committed writes should be visible once futures resolve")
+        if writes.update(ids[0], {"name": "组提交改名"}).result(timeout=10) != 1:
+            raise AssertionError("Update future should carry the rowcount")
+    finally:
+        release.set()
+        writes.close()
+        if ids:
+            database.delete_students(ids)
+
+
+def test_write_queue_survives_hook_error(monkeypatch):
+    database.init_db()
+    writes = database.WriteQueue()
+    checkpoints = []
+
+    def failing_count():
+        checkpoints.append(1)
+        raise ValueError("boom")
+
+    monkeypatch.setattr(database, "_count_write", failing_count)
+    ids = []
+    try:
+        # 提交后的处理出错不影响已提交的请求，写线程继续处理后续请求
+        for i in range(2):
+            ids.append(writes.insert({"student_id": f"WQE{i:03d}", "name": "写线程"}).result(timeout=10))
+        if len(checkpoints) != 2 or len(database.query_students(student_id="WQE")) != 2:
+            raise AssertionError("Writer thread should keep serving after a post-write error")
+    finally:
+        writes.close()
+        monkeypatch.undo()
+        if ids:
+            database.delete_students(ids)
+
+
+def test_llm_response_cache():
+    import dashscope
+
+    calls = []
+
+    def fake_call(**kwargs):
+        calls.append(kwargs["prompt"])
+        return _json_response({
+            "type": "sql",
+            "sql": "SELECT college, COUNT(*) FROM students GROUP BY college",
+            "response_type": "count",
+        })
+
+    original = dashscope.Generation.call
+    dashscope.Generation.call = fake_call
+    path = os.path.join(tempfile.mkdtemp(), "llm_cache.db")
+    cache = LLMResponseCache(path=path)
+    try:
+        llm = LLMInterface(cache=cache)
+        first = llm.handle("统计各学院人数")
+        # 归一化后相同的问题应命中缓存
+        again = llm.handle(" 统计各学院人数？ ")
+        if len(calls) != 1 or again["sql"] != first["sql"]:
+            raise AssertionError(f"Repeat question should be served from cache ({len(calls)} calls)")
+        if cache.stats()["hits"] != 1:
+            raise AssertionError(f"Unexpected cache stats: {cache.stats()}")
+
+        # 上下文非空时总是纳入缓存键：同一追问只在上下文相同时复用
+        llm.handle("女生呢", context="用户: 统计计算机学院人数")
+        llm.handle("女生呢", context="用户: 统计计算机学院人数")
+        llm.handle("女生呢", context="用户: 统计数学学院人数")
+        if len(calls) != 3 or cache.stats()["hits"] != 2:
+            raise AssertionError("Follow-ups in different conversations should not share a cache entry")
+
+        # 持久化：新实例从 SQLite 文件命中
+        cache.close()
+        cache = LLMResponseCache(path=path)
+        LLMInterface(cache=cache).handle("统计各学院人数")
+        if len(calls) != 3 or cache.stats()["hits"] != 1:
+            raise AssertionError("Disk-backed cache should survive a restart")
+
+        small = LLMResponseCache(max_size=2, ttl=-1)
+        for key in ("a", "b", "c"):
+            small.put(key, "{}")
+        if small.stats()["evictions"] != 1 or small.get("c") is not None:
+            raise AssertionError("LRU should evict and TTL should expire entries")
+    finally:
+        dashscope.Generation.call = original
+        cache.close()
+
+
+def test_keyword_matcher():
+    matcher = KeywordMatcher(KEYWORD_GROUPS)
+    samples = [
+        "统计各学院人数", "查询张三信息", "张三是男生吗", "有张三这个人吗", "查询软件工程和计算机学院的学生",
+        "你好", "HELLO", "你能干什么", "谢谢", "修改张三的手机号", "删除学号2023001", "一共多少人", "",
+    ]
+    for text in samples:
+        expected = {group for group, words in KEYWORD_GROUPS.items() if any(w in text.lower() for w in words)}
+        if matcher.groups(text.lower()) != expected:
+            raise AssertionError(f"Keyword hits mismatch for {text!r}: {matcher.groups(text)} != {expected}")
+
+    # 重叠与嵌套的关键词都要报告（ab 与 bc 重叠，b 嵌套在 abc 中）
+    overlap = KeywordMatcher({"x": ["ab"], "y": ["bc"], "z": ["b"], "w": ["abcd"]})
+    if overlap.groups("abc") != {"x", "y", "z"}:
+        raise AssertionError(f"Overlapping keywords missed: {overlap.groups('abc')}")
+
+    llm = LLMInterface(cache=LLMResponseCache())
+    intents = {"统计各学院人数": "count", "查询张三和李四": "complex_select", "张三是男生吗": "boolean", "随便聊聊": "chat"}
+    for text, intent in intents.items():
+        if llm._detect_intent(text) != intent:
+            raise AssertionError(f"Unexpected intent for {text!r}: {llm._detect_intent(text)}")
+    if llm._chat_reply("Hello") is None or llm._chat_reply("你好，查询张三") is not None:
+        raise AssertionError("Chat shortcut should only answer pure small talk")
+
+
+def test_prompt_builder():
+    majors = [f"专业{i:03d}方向" for i in range(400)] + ["软件工程"]
+    colleges = ["计算机学院", "外国语学院", "经济管理学院"]
+    builder = llm_interface.PRIMARY_PROMPT
+    llm_interface.clear_prompt_log()
+
+    prompt = builder.build("统计软件工程专业人数", None, {"学院列表": colleges, "专业列表": majors})
+    if "'软件工程'" not in prompt or "专业001方向" in prompt:
+        raise AssertionError("Only catalog values relevant to the question should be included")
+    if "students (" not in prompt or '"type": "sql" | "chat" | "ask" | "boolean_check"' not in prompt:
+        raise AssertionError("Static schema and output spec must be kept")
+
+    # 超长上下文被截断到预算内，且保留最近的部分
+    context = "user: 查询张三\n" * 2000 + "user: 最后一条"
+    prompt = builder.build("统计人数", context, {"学院列表": colleges, "专业列表": majors})
+    entry = llm_interface.get_prompt_log()[-1]
+    if not entry["context_trimmed"] or entry["over_budget"] or "最后一条" not in prompt:
+        raise AssertionError(f"Context should be trimmed to the token budget: {entry}")
+    if entry["tokens"] > builder.budget or entry["catalog_size"] != len(colleges) + len(majors):
+        raise AssertionError(f"Unexpected prompt size record: {entry}")
+
+    stats = llm_interface.get_prompt_stats()
+    if stats["calls"] != 2 or stats["context_trimmed"] != 1:
+        raise AssertionError(f"Unexpected prompt stats: {stats}")
+
+    # 模板改动后缓存变体随之变化，旧的缓存响应不会被复用
+    edited = llm_interface.PromptBuilder(builder.name, builder.head, builder.tail + "\n")
+    if edited.variant == builder.variant or llm_interface.FALLBACK_PROMPT.variant == builder.variant:
+        raise AssertionError("Prompt edits should change the cache variant")
+
+
+def test_streaming_llm_response(monkeypatch):
+    import dashscope
+
+    def stream(payload, size=3):
+        content = "```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```"
+        for i in range(0, len(content), size):
+            chunk = type("obj", (), {"content": content[i:i + size]})
+            choice = type("obj", (), {"message": chunk})
+            yield type("obj", (), {"status_code": 200, "output": type("obj", (), {"choices": [choice]})})
+
+    sql = "SELECT COUNT(*) AS count FROM students"
+    calls = []
+    executed = []
+
+    def recording_query(*args, **kwargs):
+        executed.append(kwargs)
+        return database.query_guarded(*args, **kwargs)
+
+    def fake_call(**kwargs):
+        calls.append(kwargs)
+        if '用户输入: "统计' in kwargs["prompt"]:
+            return stream({"type": "sql", "sql": sql, "response_type": "count"})
+        return stream({"type": "chat", "message": "你好，我是\"学生助手\"，很高兴见到你"})
+
+    monkeypatch.setattr(dashscope.Generation, "call", fake_call)
+    monkeypatch.setattr(llm_interface, "query_guarded", recording_query)
+    llm = LLMInterface(cache=LLMResponseCache())
+    if not llm_interface.StreamingJSONParser().feed('{"a": 1}') == ["a"]:
+        raise AssertionError("Parser should report completed fields")
+
+    result = llm.handle("统计学生总数")
+    if not calls[-1].get("stream") or not calls[-1].get("incremental_output"):
+        raise AssertionError("Model should be called in streaming mode")
+    future = result.get("prefetch")
+    if future is None:
+        raise AssertionError("Complete SQL should be executed while the stream is still arriving")
+    if future.result().scalar() != database.query_guarded(sql).scalar():
+        raise AssertionError("Prefetched result should match a direct query")
+    # sql 先于 response_type 到达时也要等统计类型确定，按界面相同的方式（走分析引擎）执行
+    if executed != [{"analytics": True}]:
+        raise AssertionError(f"Count queries should be prefetched with analytics=True: {executed}")
+
+    shown = []
+    result = llm.handle("介绍一下你自己", on_message=shown.append)
+    if result["message"] != "你好，我是\"学生助手\"，很高兴见到你" or len(shown) < 3:
+        raise AssertionError(f"Chat message should be streamed incrementally: {shown}")
+    if shown[-1] != result["message"] or any(not result["message"].startswith(part) for part in shown):
+        raise AssertionError(f"Streamed parts should be prefixes of the final message: {shown}")
+
+
 def main():
     _run_test("db init and schema", test_db_init_and_schema)
     _run_test("query students filters", test_query_students_filters)
     _run_test("llm fallback rules", test_llm_fallback_rules)
+    _run_test("connection pool reuse", test_connection_pool_reuse)
+    _run_test("wal journal mode", test_wal_journal_mode)
+    _run_test("indexes and advisor", test_indexes_and_advisor)
+    _run_test("substring search index", test_substring_search_index)
+    _run_test("keyset pagination", test_keyset_pagination)
+    _run_test("streaming query chunks", test_streaming_query_chunks)
+    _run_test("bulk import csv", test_bulk_import_csv)
+    _run_test("bulk import sql script", test_bulk_import_sql_script)
+    _run_test("synthetic data deterministic", test_synthetic_data_deterministic)
+    _run_test("distinct value catalog", test_distinct_value_catalog)
+    _run_test("student stats triggers", test_student_stats_triggers)
+    _run_test("bulk update delete", test_bulk_update_delete)
+    _run_test("sql parameterization", test_sql_parameterization)
+    _run_test("columnar results", test_columnar_results)
+    _run_test("analytics backend", test_analytics_backend)
+    _run_test("read replica", test_read_replica)
+    _run_test("data version cross process", test_data_version_cross_process)
+    _run_test("guarded execution", test_guarded_execution)
+    _run_test("query plan gate", test_query_plan_gate)
+    _run_test("normalized storage", test_normalized_storage)
+    _run_test("async database", test_async_database)
+    _run_test("group commit queue", test_group_commit_queue)
+    _run_test("write queue survives hook error", _with_monkeypatch(test_write_queue_survives_hook_error))
+    _run_test("llm response cache", test_llm_response_cache)
+    _run_test("keyword matcher", test_keyword_matcher)
+    _run_test("prompt builder", test_prompt_builder)
+    _run_test("streaming llm response", _with_monkeypatch(test_streaming_llm_response))
     print("All tests passed.")
 
 